@@ -1,19 +1,24 @@
 # app/account.py
 from __future__ import annotations
 
+import asyncio
+import hmac
 import os
-import uuid
-from typing import Any, Dict, Optional
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import orjson
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+
+from .http_client import get_async_client
+from .token_cache import cache_token_uid, get_cached_uid
 
 try:
-    from supabase import create_client, Client  # type: ignore
+    import jwt  # type: ignore  # PyJWT
 except Exception:
-    create_client = None
-    Client = None  # type: ignore
+    jwt = None
 
 router = APIRouter(prefix="/account", tags=["account"])
 
@@ -27,12 +32,11 @@ def _normalize_url(raw: str) -> str:
     return raw.rstrip("/")
 
 
+_UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\Z")
+
+
 def _is_valid_uuid(val: str) -> bool:
-    try:
-        uuid.UUID(str(val))
-        return True
-    except (ValueError, AttributeError):
-        return False
+    return isinstance(val, str) and _UUID_RE.match(val) is not None
 
 
 SUPABASE_URL = _normalize_url(os.getenv("SUPABASE_URL"))
@@ -43,34 +47,73 @@ SUPABASE_SERVICE_ROLE_KEY = (
     or ""
 ).strip()
 RAILWAY_TOKEN = (os.getenv("RAILWAY_TOKEN") or "").strip()
-
-
-def _require_admin_client() -> "Client":
-    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY or not create_client:
+_RAILWAY_TOKEN_BYTES = RAILWAY_TOKEN.encode()
+# Supabase Dashboard → Settings → API → JWT Secret (enables local HS256 verification)
+SUPABASE_JWT_SECRET = (os.getenv("SUPABASE_JWT_SECRET") or "").strip()
+
+# Supabase asymmetric signing keys (JWKS): kid -> PyJWK
+_jwks: Dict[str, Any] = {}
+_jwks_fetched_at = 0.0
+_JWKS_REFRESH_SECONDS = 3600
+_JWKS_MIN_REFETCH_SECONDS = 60
+_JWKS_ALGORITHMS = ("RS256", "ES256")
+
+CLEANUP_TABLES = (
+    "user_profiles",
+    "user_focus_stats",
+    "focus_item_progress",
+    "focus_items",
+    "focus_days",
+    "focus_plans",
+)
+
+# Max concurrent PostgREST requests per account deletion
+DELETE_CONCURRENCY = 5
+
+# Account deletion talks to PostgREST directly over the shared httpx client (no supabase-py builders)
+POSTGREST_URL = f"{SUPABASE_URL}/rest/v1"
+_POSTGREST_HEADERS = {
+    "apikey": SUPABASE_SERVICE_ROLE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+}
+# count=exact, return=minimal -> server sends only the row count (Content-Range), not the rows
+_POSTGREST_DELETE_HEADERS = {**_POSTGREST_HEADERS, "Prefer": "count=exact,return=minimal"}
+
+
+def _require_postgrest() -> None:
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         raise HTTPException(status_code=503, detail="Supabase admin client not configured")
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 
-def _require_user_id(request: Request) -> str:
-    auth = request.headers.get("authorization") or ""
-    if not auth.lower().startswith("bearer "):
+async def _require_user_id(request: Request) -> str:
+    scheme, _, token = (request.headers.get("authorization") or "").partition(" ")
+    if scheme.lower() != "bearer":
         raise HTTPException(status_code=401, detail="Missing Authorization Bearer token")
-    token = auth.split(" ", 1)[1].strip()
+    token = token.strip()
     if not token:
         raise HTTPException(status_code=401, detail="Empty token")
 
     # Proxy mode: RAILWAY_TOKEN + X-User-ID
-    if RAILWAY_TOKEN and token == RAILWAY_TOKEN:
+    # (bytes compare: compare_digest rejects non-ASCII str, headers may carry latin-1)
+    if RAILWAY_TOKEN and hmac.compare_digest(token.encode(), _RAILWAY_TOKEN_BYTES):
         user_id = request.headers.get("x-user-id") or ""
         if not user_id or not _is_valid_uuid(user_id):
             raise HTTPException(status_code=401, detail="Invalid user_id format")
         return user_id
 
-    # Direct JWT validation
+    # Direct JWT validation: local signature check first (no network)
+    uid = await _verify_jwt_locally(token)
+    if uid:
+        return uid
+
+    cached = get_cached_uid(token)
+    if cached:
+        return cached
+
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         raise HTTPException(status_code=503, detail="Supabase not configured for auth validation")
 
-    r = requests.get(
+    r = await get_async_client().get(
         f"{SUPABASE_URL}/auth/v1/user",
         headers={
             "Authorization": f"Bearer {token}",
@@ -82,29 +125,135 @@ def _require_user_id(request: Request) -> str:
     if r.status_code != 200:
         raise HTTPException(status_code=401, detail="Invalid Supabase token")
 
-    uid = (r.json() or {}).get("id")
+    uid = (orjson.loads(r.content) if r.content else {}).get("id")
     if not uid or not _is_valid_uuid(uid):
         raise HTTPException(status_code=401, detail="Invalid Supabase token (no user id)")
+
+    cache_token_uid(token, uid)
     return uid
 
 
-def _safe_delete(table: str, filters: Dict[str, Any], client: "Client") -> int:
+async def _get_jwks(force: bool = False) -> Dict[str, Any]:
+    """Supabase signing keys (kid -> PyJWK), fetched lazily and refreshed hourly."""
+    global _jwks, _jwks_fetched_at
+
+    now = time.time()
+    age = now - _jwks_fetched_at
+    if age < _JWKS_REFRESH_SECONDS and not (force and age > _JWKS_MIN_REFETCH_SECONDS):
+        return _jwks
+    if not jwt or not SUPABASE_URL:
+        return _jwks
+
+    _jwks_fetched_at = now
+    try:
+        r = await get_async_client().get(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json", timeout=10)
+        if r.status_code == 200:
+            keys: Dict[str, Any] = {}
+            for k in orjson.loads(r.content).get("keys") or []:
+                try:
+                    keys[k.get("kid")] = jwt.PyJWK(k)
+                except jwt.PyJWTError:
+                    continue
+            _jwks = keys
+    except Exception as e:
+        print(f"[account] JWKS fetch failed (keeping previous keys): {e}")
+    return _jwks
+
+
+async def _verify_jwt_locally(token: str) -> Optional[str]:
+    """
+    Verify a Supabase access token without calling Supabase:
+    - HS256 with SUPABASE_JWT_SECRET
+    - RS256/ES256 against the project's JWKS
+    Returns the user id, or None if local verification is unavailable/inconclusive
+    (caller falls back to /auth/v1/user). Expired tokens are rejected outright.
+    """
+    if not jwt:
+        return None
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError:
+        return None
+
+    alg = header.get("alg")
+    if alg == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            return None
+        key: Any = SUPABASE_JWT_SECRET
+    elif alg in _JWKS_ALGORITHMS:
+        kid = header.get("kid")
+        jwk = (await _get_jwks()).get(kid)
+        if jwk is None:
+            # unknown kid: keys may have been rotated
+            jwk = (await _get_jwks(force=True)).get(kid)
+        if jwk is None:
+            return None
+        key = jwk.key
+    else:
+        return None
+
     try:
-        query = client.table(table).delete()
-        for key, value in filters.items():
-            if isinstance(value, list):
-                query = query.in_(key, value)
-            else:
-                query = query.eq(key, value)
-        res = query.execute()
-        return len(res.data or [])
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=[alg],
+            audience="authenticated",
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Supabase token expired")
+    except jwt.PyJWTError:
+        return None
+    uid = claims.get("sub")
+    if not uid or not _is_valid_uuid(uid):
+        raise HTTPException(status_code=401, detail="Invalid Supabase token (no user id)")
+    return uid
+
+
+def _postgrest_filter(value: Any) -> str:
+    if isinstance(value, list):
+        return f"in.({','.join(value)})"
+    return f"eq.{value}"
+
+
+async def _safe_delete(table: str, filters: Dict[str, Any]) -> int:
+    try:
+        r = await get_async_client().delete(
+            f"{POSTGREST_URL}/{table}",
+            params={key: _postgrest_filter(value) for key, value in filters.items()},
+            headers=_POSTGREST_DELETE_HEADERS,
+        )
+        if r.status_code >= 300:
+            return 0
+        # Content-Range: "*/<count>" or "<first>-<last>/<count>"
+        total = r.headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else 0
     except Exception:
         return 0
 
 
-def _delete_auth_user(uid: str) -> None:
+async def _select_plan_and_day_ids(uid: str) -> Tuple[List[str], List[str]]:
+    # One GET: PostgREST embeds each plan's focus_days via the plan_id FK
+    try:
+        r = await get_async_client().get(
+            f"{POSTGREST_URL}/focus_plans",
+            params={"select": "id,focus_days(id)", "user_id": f"eq.{uid}"},
+            headers=_POSTGREST_HEADERS,
+        )
+        if r.status_code != 200:
+            return [], []
+        plans = orjson.loads(r.content) or []
+    except Exception:
+        return [], []
+
+    plan_ids = [p["id"] for p in plans if p.get("id")]
+    day_ids = [d["id"] for p in plans for d in (p.get("focus_days") or []) if d.get("id")]
+    return plan_ids, day_ids
+
+
+async def _delete_auth_user(uid: str) -> None:
     url = f"{SUPABASE_URL}/auth/v1/admin/users/{uid}"
-    r = requests.delete(
+    r = await get_async_client().delete(
         url,
         headers={
             "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
@@ -116,51 +265,76 @@ def _delete_auth_user(uid: str) -> None:
         raise HTTPException(status_code=502, detail="Failed to delete auth user")
 
 
-@router.post("/delete")
-def delete_account(request: Request):
-    uid = _require_user_id(request)
-    client = _require_admin_client()
+async def _delete_user_rows_rpc(uid: str) -> Optional[Dict[str, int]]:
+    """Delete all app rows of a user via the delete_user_cascade() SQL function.
+    Returns per-table counts, or None if the function is unavailable."""
+    try:
+        r = await get_async_client().post(
+            f"{POSTGREST_URL}/rpc/delete_user_cascade",
+            json={"uid": uid},
+            headers=_POSTGREST_HEADERS,
+        )
+    except Exception as e:
+        print(f"[account] delete_user_cascade rpc failed, falling back: {e}")
+        return None
+    if r.status_code != 200:
+        print(f"[account] delete_user_cascade rpc unavailable ({r.status_code}), falling back")
+        return None
+    data = orjson.loads(r.content) if r.content else None
+    if not isinstance(data, dict):
+        return None
+    return {table: int(data.get(table) or 0) for table in CLEANUP_TABLES}
+
+
+async def _delete_user_rows_phased(uid: str, cleanup: Dict[str, int]) -> None:
+    # Bounded so one deletion can't take over the shared connection pool
+    sem = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def _run(fn, *args):
+        async with sem:
+            return await fn(*args)
+
+    # Phase 1: rows keyed directly by user id are independent of each other
+    (
+        cleanup["user_focus_stats"],
+        cleanup["focus_item_progress"],
+        cleanup["user_profiles"],
+        (plan_ids, day_ids),
+    ) = await asyncio.gather(
+        _run(_safe_delete, "user_focus_stats", {"user_id": uid}),
+        _run(_safe_delete, "focus_item_progress", {"user_id": uid}),
+        _run(_safe_delete, "user_profiles", {"id": uid}),
+        _run(_select_plan_and_day_ids, uid),
+    )
 
-    cleanup: Dict[str, int] = {
-        "user_profiles": 0,
-        "user_focus_stats": 0,
-        "focus_item_progress": 0,
-        "focus_items": 0,
-        "focus_days": 0,
-        "focus_plans": 0,
-    }
+    # Phase 2: plan tree, children first (FKs cascade, so this keeps the counts accurate)
+    if day_ids:
+        cleanup["focus_items"] = await _run(_safe_delete, "focus_items", {"day_id": day_ids})
 
-    try:
-        cleanup["user_focus_stats"] = _safe_delete("user_focus_stats", {"user_id": uid}, client)
-        cleanup["focus_item_progress"] = _safe_delete("focus_item_progress", {"user_id": uid}, client)
+    if plan_ids:
+        cleanup["focus_days"] = await _run(_safe_delete, "focus_days", {"plan_id": plan_ids})
 
-        plan_ids: list[str] = []
-        try:
-            plans = client.table("focus_plans").select("id").eq("user_id", uid).execute()
-            plan_ids = [p["id"] for p in (plans.data or []) if p.get("id")]
-        except Exception:
-            plan_ids = []
+    cleanup["focus_plans"] = await _run(_safe_delete, "focus_plans", {"user_id": uid})
 
-        day_ids: list[str] = []
-        if plan_ids:
-            try:
-                days = client.table("focus_days").select("id").in_("plan_id", plan_ids).execute()
-                day_ids = [d["id"] for d in (days.data or []) if d.get("id")]
-            except Exception:
-                day_ids = []
 
-        if day_ids:
-            cleanup["focus_items"] = _safe_delete("focus_items", {"day_id": day_ids}, client)
+@router.post("/delete", response_class=ORJSONResponse)
+async def delete_account(request: Request):
+    uid = await _require_user_id(request)
+    _require_postgrest()
 
-        if plan_ids:
-            cleanup["focus_days"] = _safe_delete("focus_days", {"plan_id": plan_ids}, client)
+    cleanup: Dict[str, int] = {table: 0 for table in CLEANUP_TABLES}
 
-        cleanup["focus_plans"] = _safe_delete("focus_plans", {"user_id": uid}, client)
-        cleanup["user_profiles"] = _safe_delete("user_profiles", {"id": uid}, client)
+    try:
+        # Single round-trip when the delete_user_cascade() SQL function is deployed
+        counts = await _delete_user_rows_rpc(uid)
+        if counts is not None:
+            cleanup.update(counts)
+        else:
+            await _delete_user_rows_phased(uid, cleanup)
 
-        _delete_auth_user(uid)
+        await _delete_auth_user(uid)
 
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=200,
             content={
                 "ok": True,
@@ -169,7 +343,7 @@ def delete_account(request: Request):
             },
         )
     except HTTPException as e:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=e.status_code,
             content={
                 "ok": False,
@@ -180,7 +354,7 @@ def delete_account(request: Request):
             },
         )
     except Exception:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={
                 "ok": False,
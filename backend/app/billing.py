@@ -1,12 +1,23 @@
 # app/billing.py
+import asyncio
+import functools
+import hashlib
+import logging
 import os
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+
+import orjson
 import stripe
 from fastapi import APIRouter, Header, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+from .http_client import get_async_client
+
 router = APIRouter(prefix="/billing", tags=["billing"])
+log = logging.getLogger("billing")
 
 # --- SUPABASE CONFIG (from env) ---
 def _normalize_url(raw: str) -> str:
@@ -29,6 +40,16 @@ STRIPE_API_KEY = (os.getenv("STRIPE_SECRET_KEY") or "").strip()
 STRIPE_PRICE_GENZ = (os.getenv("STRIPE_PRICE_GNZ") or os.getenv("STRIPE_PRICE_GENZ") or "").strip()
 STRIPE_PRICE_MILL = (os.getenv("STRIPE_PRICE_MILL") or os.getenv("STRIPE_PRICE_MILLENIAL") or "").strip()
 
+APP_URL = (os.getenv("APP_URL") or "https://emoria.life").rstrip("/")
+CHECKOUT_SUCCESS_URL = f"{APP_URL}/app/subscription?checkout=success"
+CHECKOUT_CANCEL_URL = f"{APP_URL}/app/subscription?checkout=cancel"
+
+# stripe-python ships native async methods (create_async) in newer releases
+STRIPE_HAS_ASYNC = hasattr(stripe.checkout.Session, "create_async")
+
+# Sync-SDK fallback runs here so a checkout burst can't starve the default threadpool
+_STRIPE_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="stripe")
+
 PRICE_MAP = {
     "GEN_Z": STRIPE_PRICE_GENZ,
     "MILLENIAL": STRIPE_PRICE_MILL,
@@ -36,7 +57,8 @@ PRICE_MAP = {
 
 
 class CheckoutIn(BaseModel):
-    tier: str
+    # Validated by pydantic before the handler runs (unknown tier -> 422); keys of PRICE_MAP
+    tier: Literal["GEN_Z", "MILLENIAL"]
 
 
 _billing_initialized = False
@@ -58,13 +80,13 @@ def init_billing_env():
         missing.append("Stripe Price IDs (STRIPE_PRICE_GENZ / STRIPE_PRICE_MILL)")
 
     if missing:
-        print(f"[billing] WARNING: Missing config: {', '.join(missing)}")
-        print("[billing] Billing endpoints will return 503 until configured")
+        log.warning("Missing config: %s", ", ".join(missing))
+        log.warning("Billing endpoints will return 503 until configured")
         return
 
     stripe.api_key = STRIPE_API_KEY
     _billing_initialized = True
-    print("[billing] Stripe initialized successfully")
+    log.info("Stripe initialized successfully")
 
 
 def _billing_unavailable(detail: str):
@@ -78,11 +100,11 @@ def _billing_unavailable(detail: str):
     )
 
 
-def supabase_get_user(access_token: str) -> dict:
+async def supabase_get_user(access_token: str) -> dict:
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
         raise HTTPException(status_code=503, detail="Supabase not configured for billing")
 
-    r = requests.get(
+    r = await get_async_client().get(
         f"{SUPABASE_URL}/auth/v1/user",
         headers={
             "Authorization": f"Bearer {access_token}",
@@ -94,43 +116,35 @@ def supabase_get_user(access_token: str) -> dict:
     if r.status_code != 200:
         raise HTTPException(status_code=401, detail="Invalid Supabase session")
 
-    return r.json()
+    return orjson.loads(r.content) if r.content else {}
 
 
 @router.post("/checkout-session")
-def create_checkout_session(payload: CheckoutIn, authorization: str = Header(None)):
+async def create_checkout_session(payload: CheckoutIn, authorization: str = Header(None)):
     try:
-        if not _billing_initialized:
-            init_billing_env()
-
+        # init_billing_env() runs once at startup; this flag is constant afterwards
         if not _billing_initialized:
             return _billing_unavailable("Billing not configured")
 
-        if not authorization or not authorization.startswith("Bearer "):
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme != "Bearer":
             raise HTTPException(status_code=401, detail="Missing Bearer token")
 
-        token = authorization.split(" ", 1)[1].strip()
-        user = supabase_get_user(token)
+        token = token.strip()
+        user = await supabase_get_user(token)
 
         user_id = user["id"]
         email = user.get("email")
 
-        tier = payload.tier.strip().upper()
-        if tier not in PRICE_MAP:
-            raise HTTPException(status_code=400, detail="Unknown tier")
-
+        tier = payload.tier
         price_id = PRICE_MAP[tier]
 
-        app_url = (os.getenv("APP_URL") or "https://emoria.life").rstrip("/")
-        success_url = f"{app_url}/app/subscription?checkout=success"
-        cancel_url = f"{app_url}/app/subscription?checkout=cancel"
-
         # --- STRIPE CHECKOUT SESSION ---
-        session = stripe.checkout.Session.create(
+        session_params = dict(
             mode="subscription",
             line_items=[{"price": price_id, "quantity": 1}],
-            success_url=success_url,
-            cancel_url=cancel_url,
+            success_url=CHECKOUT_SUCCESS_URL,
+            cancel_url=CHECKOUT_CANCEL_URL,
             customer_email=email,
 
             # 🔑 CRITICAL: user binding
@@ -138,11 +152,26 @@ def create_checkout_session(payload: CheckoutIn, authorization: str = Header(Non
             metadata={"tier": tier, "user_id": user_id},
             subscription_data={"metadata": {"tier": tier, "user_id": user_id}},
         )
+        # Retries (flaky mobile networks) within the same minute get the already-created session back
+        idempotency_key = hashlib.sha256(
+            f"checkout:{user_id}:{tier}:{int(time.time() // 60)}".encode()
+        ).hexdigest()
+
+        if STRIPE_HAS_ASYNC:
+            session = await stripe.checkout.Session.create_async(
+                idempotency_key=idempotency_key, **session_params
+            )
+        else:
+            # older stripe SDK: blocking call, run it on the Stripe pool (not the shared default executor)
+            session = await asyncio.get_running_loop().run_in_executor(
+                _STRIPE_POOL,
+                functools.partial(stripe.checkout.Session.create, idempotency_key=idempotency_key, **session_params),
+            )
 
         return {"url": session.url}
 
     except HTTPException:
         raise
     except Exception as e:
-        print("[billing.checkout-session] ERROR:", repr(e))
+        log.exception("checkout-session error")
         raise HTTPException(status_code=500, detail=f"checkout-session error: {e}")
@@ -1,23 +1,29 @@
 ﻿from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional, Union
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional, Tuple, Union
 import os
 import asyncio
-import json
+import functools
+import hashlib
+import re
+import time
+
+import orjson
 
 # Import Claude client directly
 try:
-    from anthropic import Anthropic
+    from anthropic import AsyncAnthropic
     ANTHROPIC_AVAILABLE = True
 except Exception:
     ANTHROPIC_AVAILABLE = False
-    Anthropic = None
+    AsyncAnthropic = None
 
-from .llm_client import claude_chat_answer
-from .query_analyzer import analyze_query, should_use_detailed_endpoint
+from .llm_client import CLAUDE_MODEL_SONNET, claude_chat_answer
+from .llm_cache import LLMCache
+from .query_analyzer import analyze_query, may_need_detailed, should_use_detailed_endpoint
 
 # Supabase-backed memory
 from .memory.service import MemoryService
@@ -30,8 +36,15 @@ except Exception:
     insert_shadow_log = None
 
 
-router = APIRouter(tags=["chat"])
+router = APIRouter(tags=["chat"], default_response_class=ORJSONResponse)
 memory_service = MemoryService()
+llm_cache = LLMCache()
+
+# Short-lived memory_block cache: burst follow-ups from the same user reuse the retrieval.
+# Key: (identity_key, sha1(user_text)) -> (block, expires_at). Dropped per user on memory store.
+MEMORY_BLOCK_TTL = 60
+MEMORY_BLOCK_CACHE_MAX = 10_000
+_memory_block_cache: Dict[Tuple[str, bytes], Tuple[str, float]] = {}
 
 # Claude API setup
 CLAUDE_API_KEY = (os.getenv("ANTHROPIC_API_KEY") or "").strip()
@@ -39,12 +52,46 @@ CLAUDE_MODEL = (os.getenv("CLAUDE_MODEL") or "claude-sonnet-4-20250514").strip()
 
 claude = None
 if ANTHROPIC_AVAILABLE and CLAUDE_API_KEY:
-    claude = Anthropic(api_key=CLAUDE_API_KEY)
+    claude = AsyncAnthropic(api_key=CLAUDE_API_KEY)
+
+
+# ---------- Memory retrieval cache ----------
+
+def _retrieve_memory_block(identity_key: str, user_text: str) -> str:
+    now = time.time()
+    key = (identity_key, hashlib.sha1(user_text.encode("utf-8")).digest())
+    hit = _memory_block_cache.get(key)
+    if hit and hit[1] > now:
+        return hit[0]
+
+    block = memory_service.retrieve_block(
+        user_id=identity_key,
+        query=user_text,
+        limit=5
+    )
+
+    if len(_memory_block_cache) >= MEMORY_BLOCK_CACHE_MAX:
+        for k in [k for k, (_, t) in _memory_block_cache.items() if t <= now]:
+            _memory_block_cache.pop(k, None)
+        if len(_memory_block_cache) >= MEMORY_BLOCK_CACHE_MAX:
+            _memory_block_cache.clear()
+
+    _memory_block_cache[key] = (block, now + MEMORY_BLOCK_TTL)
+    return block
+
+
+def _forget_memory_blocks(identity_key: str) -> None:
+    """A new memory was stored: cached blocks for this user are stale."""
+    for k in [k for k in _memory_block_cache if k[0] == identity_key]:
+        _memory_block_cache.pop(k, None)
 
 
 # ---------- Models ----------
 
 class ChatInput(BaseModel):
+    # request payloads are read-only inside the handlers; unknown frontend fields are dropped
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     message: str
     lang: str = "hu"
     tier: str = "genz"
@@ -90,6 +137,8 @@ class DetailedDocumentOutput(BaseModel):
 
 class FocusItemContentInput(BaseModel):
     """Input for generating detailed content for a specific focus item."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     item_type: str  # lesson, quiz, translation, roleplay, flashcard, writing, practice, etc.
     item_id: str
     topic: str
@@ -127,10 +176,21 @@ LEARNING_TASK_TYPES = {
 # Project mode: action/output-oriented tasks
 PROJECT_TASK_TYPES = {"step_checklist", "checklist", "upload_review", "rubric_eval", "before_after", "quiz"}
 
+# Canonical values map to themselves: the usual already-normalized input is one dict hit, no strip/lower copies
+_MODE_CANON = {m: m for m in ALLOWED_MODES}
+# task type -> modes that allow it (one lookup validates the name and the mode match)
+_TASK_MODES: Dict[str, frozenset] = {
+    t: frozenset(m for m, types in (("learning", LEARNING_TASK_TYPES), ("project", PROJECT_TASK_TYPES)) if t in types)
+    for t in LEARNING_TASK_TYPES | PROJECT_TASK_TYPES
+}
+
 
 # ---------- Helpers ----------
 
 def _require_mode(mode: Optional[str]) -> str:
+    m = _MODE_CANON.get(mode) if mode else None
+    if m is not None:
+        return m
     m = (mode or "").strip().lower()
     if not m:
         raise HTTPException(status_code=400, detail="Missing mode")
@@ -140,11 +200,14 @@ def _require_mode(mode: Optional[str]) -> str:
 
 
 def _require_task_type(mode: str, item_type: Optional[str]) -> str:
-    t = (item_type or "").strip().lower()
-    if not t:
-        raise HTTPException(status_code=400, detail="Missing item_type")
-    allowed = LEARNING_TASK_TYPES if mode == "learning" else PROJECT_TASK_TYPES
-    if t not in allowed:
+    t = item_type or ""
+    modes = _TASK_MODES.get(t)
+    if modes is None:
+        t = t.strip().lower()
+        if not t:
+            raise HTTPException(status_code=400, detail="Missing item_type")
+        modes = _TASK_MODES.get(t, frozenset())
+    if ("learning" if mode == "learning" else "project") not in modes:
         raise HTTPException(status_code=409, detail="task_not_allowed_for_mode")
     return t
 
@@ -163,11 +226,16 @@ def _normalize_tier(tier: str) -> str:
 
 
 def build_system_prompt(lang: str, memory_block: Optional[str]) -> str:
+    return _build_system_prompt_cached((lang or "").lower().startswith("hu"), memory_block or None)
+
+
+@functools.lru_cache(maxsize=512)
+def _build_system_prompt_cached(lang_is_hu: bool, memory_block: Optional[str]) -> str:
     base = (
         "Te PUMi vagy. Magyarul válaszolsz. Rövid, emberszagú. "
         "Nem asszisztens, nem tanár, nem terapeuta. "
         "Egyetlen rövid válasz, végén maximum egy kérdés."
-        if (lang or "").lower().startswith("hu")
+        if lang_is_hu
         else
         "You are PUMi. Short, human, non-assistant tone. One short reply, at most one question."
     )
@@ -178,6 +246,136 @@ def build_system_prompt(lang: str, memory_block: Optional[str]) -> str:
     return base
 
 
+_DETAILED_SYSTEM_HU = """Te egy professzionális magyar AI dokumentum-készítő vagy.
+
+FELADAT: Részletes, strukturált Markdown dokumentumot készítesz.
+
+KÖVETELMÉNYEK:
+- 2000-4000 token hosszúságú tartalom
+- Markdown formátum:
+  - # Fő cím
+  - ## Alcímek (több szint)
+  - **Félkövér** kiemelések
+  - *Dőlt* szöveg
+  - Listák (bullet és számozott)
+  - Kódblokkok ha releváns
+- Strukturált, szakaszokra bontott
+- Gyakorlati példák, konkrét információk
+- Részletes magyarázatok
+
+KRITIKUS:
+- NE használj semmilyen bevezető szöveget (pl. "Íme a dokumentum...")
+- Kezdd KÖZVETLENÜL a fő címmel (# ...)
+- CSAK a Markdown tartalom, semmi más
+- Legalább 5-10 bekezdés
+- Minden fontosabb gondolat külön szakaszban
+
+STÍLUS:
+- Szakmai, de érthető
+- Konkrét, informatív
+- Példákkal illusztrálva
+"""
+
+_DETAILED_SYSTEM_EN = """You are a professional AI document creator.
+
+TASK: Create a detailed, structured Markdown document.
+
+REQUIREMENTS:
+- 2000-4000 tokens long
+- Markdown format:
+  - # Main title
+  - ## Subheadings (multiple levels)
+  - **Bold** emphasis
+  - *Italic* text
+  - Lists (bullet and numbered)
+  - Code blocks if relevant
+- Structured, divided into sections
+- Practical examples, concrete information
+- Detailed explanations
+
+CRITICAL:
+- NO preamble (e.g. "Here is the document...")
+- Start DIRECTLY with the main title (# ...)
+- ONLY the Markdown content, nothing else
+- At least 5-10 paragraphs
+- Each major idea in separate section
+
+STYLE:
+- Professional but understandable
+- Concrete, informative
+- Illustrated with examples
+"""
+
+
+@functools.lru_cache(maxsize=512)
+def _detailed_system_prompt(lang_is_hu: bool, memory_block: Optional[str]) -> str:
+    system_prompt = _DETAILED_SYSTEM_HU if lang_is_hu else _DETAILED_SYSTEM_EN
+    if memory_block:
+        system_prompt = system_prompt.rstrip() + "\n\nUSER CONTEXT:\n" + memory_block.strip() + "\n"
+    return system_prompt
+
+
+# ---------- Keyword matching ----------
+# Each keyword group is compiled once into a single case-insensitive alternation,
+# so a message is scanned in one C-level pass instead of one `in` per keyword.
+
+_PERSIST_MEMORY_KEYWORDS = (
+    "cél", "terv", "döntöttem", "holnaptól",
+    "szokás", "mindig", "rendszeresen",
+    "stressz", "félek", "szorong", "kimer",
+    "probléma", "küzdök", "akadály",
+    "projekt",
+    "tanulok", "minden nap", "45 perc", "fókusz", "routine", "rutin",
+)
+
+# (category, keywords) in priority order: first category with a hit wins
+_MEMORY_CATEGORIES = (
+    ("life_goals", ("cél", "terv", "döntöttem", "holnaptól", "tanulok", "minden nap", "45 perc", "fókusz")),
+    ("interaction_patterns", ("szokás", "mindig", "rendszeresen", "rutin", "routine")),
+    ("emotional_context", ("stressz", "félek", "szorong", "kimer")),
+    ("challenges_and_obstacles", ("probléma", "küzdök", "akadály")),
+)
+_MEMORY_DEFAULT_CATEGORY = "personal_growth"
+
+_DOCUMENT_CATEGORIES = (
+    ("Útmutató", ("hogyan", "how to", "lépések", "útmutató", "guide")),
+    ("Magyarázat", ("mi a", "what is", "magyarázd", "explain")),
+    ("Életrajz", ("történet", "életrajz", "story", "biography", "élete", "született")),
+    ("Terv", ("terv", "stratégia", "plan", "strategy")),
+    ("Elemzés", ("elemzés", "analysis", "összehasonlítás", "comparison")),
+)
+_DOCUMENT_DEFAULT_CATEGORY = "Dokumentum"
+
+
+def _keyword_re(keywords) -> "re.Pattern[str]":
+    return re.compile("|".join(map(re.escape, keywords)), re.IGNORECASE)
+
+
+def _category_re(categories) -> "re.Pattern[str]":
+    # Zero-width lookahead finds a keyword at every position (overlaps included);
+    # named groups are ordered by priority so ties at one position go to the higher category.
+    groups = "|".join(
+        f"(?P<c{i}>{'|'.join(map(re.escape, keywords))})" for i, (_, keywords) in enumerate(categories)
+    )
+    return re.compile(f"(?=(?:{groups}))", re.IGNORECASE)
+
+
+def _first_category(pattern: "re.Pattern[str]", categories, text: str, default: str) -> str:
+    best = len(categories)
+    for m in pattern.finditer(text):
+        idx = int(m.lastgroup[1:])
+        if idx < best:
+            best = idx
+            if best == 0:
+                break
+    return categories[best][0] if best < len(categories) else default
+
+
+_PERSIST_MEMORY_RE = _keyword_re(_PERSIST_MEMORY_KEYWORDS)
+_MEMORY_CATEGORY_RE = _category_re(_MEMORY_CATEGORIES)
+_DOCUMENT_CATEGORY_RE = _category_re(_DOCUMENT_CATEGORIES)
+
+
 def _should_persist_memory(user_text: str) -> bool:
     if not user_text:
         return False
@@ -186,46 +384,15 @@ def _should_persist_memory(user_text: str) -> bool:
     if len(words) < 8:
         return False
 
-    lower = user_text.lower()
-    keywords = [
-        "cél", "terv", "döntöttem", "holnaptól",
-        "szokás", "mindig", "rendszeresen",
-        "stressz", "félek", "szorong", "kimer",
-        "probléma", "küzdök", "akadály",
-        "projekt",
-        "tanulok", "minden nap", "45 perc", "fókusz", "routine", "rutin"
-    ]
-    return any(k in lower for k in keywords)
+    return _PERSIST_MEMORY_RE.search(user_text) is not None
 
 
 def _categorize_memory(user_text: str) -> str:
-    lower = user_text.lower()
-
-    if any(k in lower for k in ["cél", "terv", "döntöttem", "holnaptól", "tanulok", "minden nap", "45 perc", "fókusz"]):
-        return "life_goals"
-    if any(k in lower for k in ["szokás", "mindig", "rendszeresen", "rutin", "routine"]):
-        return "interaction_patterns"
-    if any(k in lower for k in ["stressz", "félek", "szorong", "kimer"]):
-        return "emotional_context"
-    if any(k in lower for k in ["probléma", "küzdök", "akadály"]):
-        return "challenges_and_obstacles"
-    return "personal_growth"
+    return _first_category(_MEMORY_CATEGORY_RE, _MEMORY_CATEGORIES, user_text, _MEMORY_DEFAULT_CATEGORY)
 
 
 def _categorize_document(user_text: str) -> str:
-    lower = user_text.lower()
-
-    if any(k in lower for k in ["hogyan", "how to", "lépések", "útmutató", "guide"]):
-        return "Útmutató"
-    if any(k in lower for k in ["mi a", "what is", "magyarázd", "explain"]):
-        return "Magyarázat"
-    if any(k in lower for k in ["történet", "életrajz", "story", "biography", "élete", "született"]):
-        return "Életrajz"
-    if any(k in lower for k in ["terv", "stratégia", "plan", "strategy"]):
-        return "Terv"
-    if any(k in lower for k in ["elemzés", "analysis", "összehasonlítás", "comparison"]):
-        return "Elemzés"
-    return "Dokumentum"
+    return _first_category(_DOCUMENT_CATEGORY_RE, _DOCUMENT_CATEGORIES, user_text, _DOCUMENT_DEFAULT_CATEGORY)
 
 
 def _extract_title_from_query(user_text: str) -> str:
@@ -235,36 +402,17 @@ def _extract_title_from_query(user_text: str) -> str:
     return title
 
 
-def _safe_log(fn, *, kwargs: dict, args: tuple = ()) -> None:
+def _safe_log(fn, **kw) -> None:
     """
-    Defensive logger:
-    - tries kwargs
-    - tries positional
-    - tries no-arg
-    - never raises (so chat never 500s because of logging)
+    Write one audit log row with the db function's own keyword arguments.
+    Never raises (so chat never 500s because of logging).
     """
     if not fn:
         return
     try:
-        fn(**kwargs)
-        return
-    except TypeError:
-        pass
-    except Exception:
-        return
-
-    try:
-        fn(*args)
-        return
-    except TypeError:
-        pass
-    except Exception:
-        return
-
-    try:
-        fn()
-    except Exception:
-        return
+        fn(**kw)
+    except Exception as e:
+        print(f"[CHAT LOG] {getattr(fn, '__name__', 'log')} failed: {e}")
 
 
 def _extract_outline_obj(outline_value: Optional[Union[Dict[str, Any], str]]) -> Optional[Dict[str, Any]]:
@@ -279,25 +427,19 @@ def _extract_outline_obj(outline_value: Optional[Union[Dict[str, Any], str]]) ->
     if outline_value is None:
         return None
 
-    if isinstance(outline_value, dict):
-        # lehet, hogy wrapper: {"outline": {...}}
-        if "outline" in outline_value and isinstance(outline_value["outline"], dict):
-            return outline_value["outline"]
-        return outline_value
-
     if isinstance(outline_value, str):
         s = outline_value.strip()
         if not s:
             return None
         try:
-            parsed = json.loads(s)
-        except Exception:
+            outline_value = orjson.loads(s)
+        except orjson.JSONDecodeError:
             return None
 
-        if isinstance(parsed, dict):
-            if "outline" in parsed and isinstance(parsed["outline"], dict):
-                return parsed["outline"]
-            return parsed
+    if isinstance(outline_value, dict):
+        # lehet, hogy wrapper: {"outline": {...}}
+        inner = outline_value.get("outline")
+        return inner if isinstance(inner, dict) else outline_value
 
     return None
 
@@ -317,18 +459,40 @@ def _normalize_day_index(day_index: Optional[int]) -> int:
     return 1 if i <= 0 else i
 
 
-def _json_ok(payload: ChatOutput) -> JSONResponse:
+def _cache_namespace(route: str, lang: str, tier: str, mode: str, identity_key: str, memory_block: Optional[str]) -> str:
+    """
+    Cache namespace for LLM replies. Personalized prompts (memory injected)
+    are scoped to the user so one user's memory never leaks into another's reply.
+    """
+    ns = f"{route}|{(lang or '').lower()}|{tier}|{mode}"
+    if memory_block:
+        ns += f"|{identity_key}"
+    return ns
+
+
+@functools.lru_cache(maxsize=8)
+def _empty_ok_body(type_: str) -> bytes:
+    # signal-only replies (e.g. "needs_detailed") are constant: encode once
+    return orjson.dumps({"ok": True, "text": "", "type": type_, "memory_saved": 0})
+
+
+def _json_ok(text: str, type_: str = "chat", memory_saved: int = 0) -> Response:
     """
     Hard guarantee: mindig JSON Response.
-    (A response_model önmagában elég lenne, de itt biztosra megyünk.)
+    Server-built payload (ChatOutput shape): encoded straight to bytes with orjson,
+    no model validation/dump and no second render step in the response class.
     """
-    return JSONResponse(content=payload.model_dump())
+    if not text and not memory_saved:
+        body = _empty_ok_body(type_)
+    else:
+        body = orjson.dumps({"ok": True, "text": text, "type": type_, "memory_saved": memory_saved})
+    return Response(content=body, media_type="application/json")
 
 
 # ---------- Core Chat Logic ----------
 
 @router.post("/chat/enhanced", response_model=ChatOutput)
-async def chat_enhanced(payload: ChatInput):
+async def chat_enhanced(payload: ChatInput, background_tasks: BackgroundTasks):
     try:
         user_text = (payload.message or "").strip()
         if not user_text:
@@ -344,10 +508,9 @@ async def chat_enhanced(payload: ChatInput):
                 max_tokens=4096,
                 temperature=0.3,
             )
-            out = ChatOutput(ok=True, text=assistant_text or "", type="json", memory_saved=0)
-            return _json_ok(out)
+            return _json_ok(assistant_text or "", type_="json")
 
-        _require_mode(payload.mode)
+        mode = _require_mode(payload.mode)
 
         identity_key = payload.user_id or payload.session_id or payload.memberstack_id or "anon"
 
@@ -356,91 +519,93 @@ async def chat_enhanced(payload: ChatInput):
 
         # ========== REGULAR CHAT MODE ==========
 
-        # Load persistent memory (skip for anonymous users)
+        # Load persistent memory (skip for anonymous users) in a worker thread,
+        # overlapping the Supabase round-trip with the routing analysis below
+        mem_task = None
         if identity_key and identity_key != "anon":
-            memory_block = memory_service.retrieve_block(
-                user_id=identity_key,
-                query=user_text,
-                limit=5
-            )
-        else:
-            memory_block = None
+            mem_task = asyncio.create_task(asyncio.to_thread(_retrieve_memory_block, identity_key, user_text))
 
         # Decide detailed or normal
-        analysis = analyze_query(user_text)
-        use_detailed = should_use_detailed_endpoint(analysis)
+        # short turns without any document signal can never score high enough: skip the analysis
+        use_detailed = may_need_detailed(user_text) and should_use_detailed_endpoint(analyze_query(user_text))
 
-        if use_detailed:
-            out = ChatOutput(ok=True, text="", type="needs_detailed", memory_saved=0)
-            return _json_ok(out)
+        memory_block = await mem_task if mem_task else None
 
-        # Call LLM
-        assistant_text = await claude_chat_answer(
-            message=user_text,
-            lang=payload.lang,
-            tier=tier,
-            memory_block=memory_block,
-            enable_tools=False,
-            history=payload.history,
-        )
+        if use_detailed:
+            return _json_ok("", type_="needs_detailed")
+
+        # Call LLM (cache only history-less turns: with history the answer depends on the conversation)
+        cache_ns = _cache_namespace("chat", payload.lang, tier, mode, identity_key, memory_block)
+        assistant_text = None if payload.history else llm_cache.get(cache_ns, user_text)
+        llm_task = None
+        if assistant_text is None:
+            llm_task = asyncio.create_task(claude_chat_answer(
+                message=user_text,
+                lang=payload.lang,
+                tier=tier,
+                memory_block=memory_block,
+                enable_tools=False,
+                history=payload.history,
+            ))
+
+        # Memory write decision does not depend on the reply: decide it while the LLM runs
+        persist_category = _categorize_memory(user_text) if _should_persist_memory(user_text) else None
+
+        if llm_task is not None:
+            assistant_text = await llm_task
+            # llm_client reports API failures as reply text: never cache those
+            if not payload.history and not assistant_text.startswith(("Error:", "Claude API not available")):
+                llm_cache.set(cache_ns, user_text, assistant_text)
 
         # Store memory facts
         memory_saved = 0
-        if _should_persist_memory(user_text):
-            category = _categorize_memory(user_text)
-            stored = memory_service.store(
+        if persist_category:
+            stored = await asyncio.to_thread(
+                memory_service.store,
                 user_id=identity_key,
-                category=category,
+                category=persist_category,
                 title=user_text[:60],
                 content=user_text,
                 tags=[]
             )
             if stored:
                 memory_saved = 1
-
-        # Insert logs SAFELY (won't break chat even if signature mismatches)
-        chat_kwargs = dict(
-            session_id=payload.session_id,
+                _forget_memory_blocks(identity_key)
+
+        # Insert logs SAFELY (won't break chat even if signature mismatches).
+        # Background tasks: psycopg is blocking, so they run in the threadpool after the response is sent.
+        session_id = payload.session_id or identity_key
+        background_tasks.add_task(
+            _safe_log,
+            insert_chat_log,
+            session_id=session_id,
+            memberstack_id=payload.memberstack_id,
             identity_key=identity_key,
-            user_text=user_text,
-            assistant_text=assistant_text,
             tier=tier,
-            lang=payload.lang
-        )
-        chat_args = (
-            payload.session_id,
-            identity_key,
-            user_text,
-            assistant_text,
-            tier,
-            payload.lang
+            lang=payload.lang,
+            mode=mode,
+            user_message=user_text,
+            assistant_reply=assistant_text,
+            assistant_source="cache" if llm_task is None else "claude",
+            meta={"memory_saved": memory_saved},
         )
-        _safe_log(insert_chat_log, kwargs=chat_kwargs, args=chat_args)
-
-        shadow_kwargs = dict(
-            session_id=payload.session_id,
+        background_tasks.add_task(
+            _safe_log,
+            insert_shadow_log,
+            session_id=session_id,
+            memberstack_id=payload.memberstack_id,
             identity_key=identity_key,
-            user_text=user_text,
-            assistant_raw=assistant_text,
-            assistant_final=assistant_text,
             tier=tier,
             lang=payload.lang,
-            memory_saved=memory_saved
-        )
-        shadow_args = (
-            payload.session_id,
-            identity_key,
-            user_text,
-            assistant_text,  # raw
-            assistant_text,  # final
-            tier,
-            payload.lang,
-            memory_saved
+            mode=mode,
+            user_message=user_text,
+            production_model=CLAUDE_MODEL_SONNET,
+            production_reply=assistant_text,
+            shadow_model="",
+            shadow_meta={"memory_saved": memory_saved},
         )
-        _safe_log(insert_shadow_log, kwargs=shadow_kwargs, args=shadow_args)
 
-        out = ChatOutput(ok=True, text=assistant_text, type="chat", memory_saved=memory_saved)
-        return _json_ok(out)
+        return _json_ok(assistant_text, memory_saved=memory_saved)
 
     except HTTPException:
         raise
@@ -453,110 +618,36 @@ async def chat_enhanced(payload: ChatInput):
 
 # ---------- Detailed Document Generation ----------
 
-@router.post("/chat/detailed", response_model=DetailedDocumentOutput)
-async def chat_detailed(payload: ChatInput):
-    """
-    Generate a detailed, long-form document (2000-4000 tokens)
-    in Markdown format based on user query.
-
-    Uses direct Claude API call with high max_tokens to bypass
-    the normal chat's 280 token limit.
-    """
-    try:
-        user_text = (payload.message or "").strip()
-        if not user_text:
-            raise HTTPException(status_code=400, detail="Empty message")
+def _prepare_detailed(payload: ChatInput) -> Dict[str, Any]:
+    """Shared request building for /chat/detailed and /chat/detailed/stream."""
+    user_text = (payload.message or "").strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="Empty message")
 
-        _require_mode(payload.mode)
+    mode = _require_mode(payload.mode)
 
-        if not claude:
-            raise HTTPException(status_code=503, detail="Claude API not available")
+    if not claude:
+        raise HTTPException(status_code=503, detail="Claude API not available")
 
-        identity_key = payload.user_id or payload.session_id or payload.memberstack_id or "anon"
+    identity_key = payload.user_id or payload.session_id or payload.memberstack_id or "anon"
 
-        # normalize tier for logs
-        tier = _normalize_tier(payload.tier)
+    # normalize tier for logs
+    tier = _normalize_tier(payload.tier)
 
-        # Load persistent memory (skip for anonymous users)
-        if identity_key and identity_key != "anon":
-            memory_block = memory_service.retrieve_block(
-                user_id=identity_key,
-                query=user_text,
-                limit=5
-            )
-        else:
-            memory_block = None
+    # Load persistent memory (skip for anonymous users)
+    if identity_key and identity_key != "anon":
+        memory_block = _retrieve_memory_block(identity_key, user_text)
+    else:
+        memory_block = None
 
-        # Build detailed system prompt
-        lang_is_hu = (payload.lang or "").lower().startswith("hu")
+    # Build detailed system prompt
+    lang_is_hu = (payload.lang or "").lower().startswith("hu")
 
-        if lang_is_hu:
-            system_prompt = """Te egy professzionális magyar AI dokumentum-készítő vagy.
+    system_prompt = _detailed_system_prompt(lang_is_hu, memory_block or None)
 
-FELADAT: Részletes, strukturált Markdown dokumentumot készítesz.
-
-KÖVETELMÉNYEK:
-- 2000-4000 token hosszúságú tartalom
-- Markdown formátum:
-  - # Fő cím
-  - ## Alcímek (több szint)
-  - **Félkövér** kiemelések
-  - *Dőlt* szöveg
-  - Listák (bullet és számozott)
-  - Kódblokkok ha releváns
-- Strukturált, szakaszokra bontott
-- Gyakorlati példák, konkrét információk
-- Részletes magyarázatok
-
-KRITIKUS:
-- NE használj semmilyen bevezető szöveget (pl. "Íme a dokumentum...")
-- Kezdd KÖZVETLENÜL a fő címmel (# ...)
-- CSAK a Markdown tartalom, semmi más
-- Legalább 5-10 bekezdés
-- Minden fontosabb gondolat külön szakaszban
-
-STÍLUS:
-- Szakmai, de érthető
-- Konkrét, informatív
-- Példákkal illusztrálva
-"""
-        else:
-            system_prompt = """You are a professional AI document creator.
-
-TASK: Create a detailed, structured Markdown document.
-
-REQUIREMENTS:
-- 2000-4000 tokens long
-- Markdown format:
-  - # Main title
-  - ## Subheadings (multiple levels)
-  - **Bold** emphasis
-  - *Italic* text
-  - Lists (bullet and numbered)
-  - Code blocks if relevant
-- Structured, divided into sections
-- Practical examples, concrete information
-- Detailed explanations
-
-CRITICAL:
-- NO preamble (e.g. "Here is the document...")
-- Start DIRECTLY with the main title (# ...)
-- ONLY the Markdown content, nothing else
-- At least 5-10 paragraphs
-- Each major idea in separate section
-
-STYLE:
-- Professional but understandable
-- Concrete, informative
-- Illustrated with examples
-"""
-
-        if memory_block:
-            system_prompt = system_prompt.rstrip() + "\n\nUSER CONTEXT:\n" + memory_block.strip() + "\n"
-
-        # Build message with clear instruction
-        user_message = (
-            f"""Készíts részletes Markdown dokumentumot erről a témáról:
+    # Build message with clear instruction
+    user_message = (
+        f"""Készíts részletes Markdown dokumentumot erről a témáról:
 
 {user_text}
 
@@ -566,8 +657,8 @@ Emlékeztető:
 - Strukturált, szakaszokra bontott
 - Példákkal, konkrét információkkal
 """
-            if lang_is_hu else
-            f"""Create a detailed Markdown document about:
+        if lang_is_hu else
+        f"""Create a detailed Markdown document about:
 
 {user_text}
 
@@ -577,73 +668,102 @@ Remember:
 - Structured, divided into sections
 - With examples and concrete information
 """
-        )
+    )
 
-        # Build message history
-        messages = []
-        if payload.history:
-            for h in payload.history[-3:]:
-                role = h.get("role", "user")
-                cont = h.get("content", "")
-                if role in ("user", "assistant") and cont:
-                    messages.append({"role": role, "content": cont})
+    # Build message history
+    messages = []
+    if payload.history:
+        for h in payload.history[-3:]:
+            role = h.get("role", "user")
+            cont = h.get("content", "")
+            if role in ("user", "assistant") and cont:
+                messages.append({"role": role, "content": cont})
+
+    messages.append({"role": "user", "content": user_message})
+
+    return {
+        "user_text": user_text,
+        "identity_key": identity_key,
+        "tier": tier,
+        "mode": mode,
+        "system_prompt": system_prompt,
+        "messages": messages,
+        "cache_ns": _cache_namespace("detailed", payload.lang, tier, mode, identity_key, memory_block),
+    }
+
+
+def _detailed_meta(user_text: str, content: str) -> Dict[str, Any]:
+    return {
+        "title": _extract_title_from_query(user_text),
+        "category": _categorize_document(user_text),
+        # Estimate tokens (rough approximation)
+        "tokens_used": int(len(content.split()) * 1.3),
+    }
+
+
+def _log_detailed(background_tasks: BackgroundTasks, payload: ChatInput, req: Dict[str, Any], content: str) -> None:
+    background_tasks.add_task(
+        _safe_log,
+        insert_shadow_log,
+        session_id=payload.session_id or req["identity_key"],
+        memberstack_id=payload.memberstack_id,
+        identity_key=req["identity_key"],
+        tier=req["tier"],
+        lang=payload.lang,
+        mode=req["mode"],
+        user_message=req["user_text"],
+        production_model=CLAUDE_MODEL,
+        production_reply=content,
+        shadow_model="",
+        shadow_meta={"endpoint": "detailed", "memory_saved": 0},
+    )
+
+
+def _sse(event: Dict[str, Any]) -> bytes:
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+@router.post("/chat/detailed", response_model=DetailedDocumentOutput)
+async def chat_detailed(payload: ChatInput, background_tasks: BackgroundTasks):
+    """
+    Generate a detailed, long-form document (2000-4000 tokens)
+    in Markdown format based on user query.
 
-        messages.append({"role": "user", "content": user_message})
+    Uses direct Claude API call with high max_tokens to bypass
+    the normal chat's 280 token limit.
+    """
+    try:
+        req = _prepare_detailed(payload)
+        user_text = req["user_text"]
 
-        # Call Claude API directly with high max_tokens
-        def _call():
-            resp = claude.messages.create(
+        content = None if payload.history else llm_cache.get(req["cache_ns"], user_text)
+        if content is None:
+            # Call Claude API directly with high max_tokens (native async client, no thread hop)
+            resp = await claude.messages.create(
                 model=CLAUDE_MODEL,
-                system=system_prompt,
-                messages=messages,
+                system=req["system_prompt"],
+                messages=req["messages"],
                 max_tokens=4096,
                 temperature=0.7,
             )
             try:
-                return resp.content[0].text
+                content = resp.content[0].text
             except Exception:
-                return str(resp)
-
-        content = await asyncio.to_thread(_call)
-
-        # Extract title and category
-        title = _extract_title_from_query(user_text)
-        category = _categorize_document(user_text)
-
-        # Estimate tokens (rough approximation)
-        tokens_used = int(len(content.split()) * 1.3)
+                content = str(resp)
+            if not payload.history:
+                llm_cache.set(req["cache_ns"], user_text, content)
 
         # Log detailed generation
-        shadow_kwargs = dict(
-            session_id=payload.session_id,
-            identity_key=identity_key,
-            user_text=user_text,
-            assistant_raw=content,
-            assistant_final=content,
-            tier=tier,
-            lang=payload.lang,
-            memory_saved=0
-        )
-        shadow_args = (
-            payload.session_id,
-            identity_key,
-            user_text,
-            content,
-            content,
-            tier,
-            payload.lang,
-            0
-        )
-        _safe_log(insert_shadow_log, kwargs=shadow_kwargs, args=shadow_args)
-
-        return DetailedDocumentOutput(
-            ok=True,
-            title=title,
-            content=content,
-            category=category,
-            tokens_used=tokens_used,
-            type="detailed_document"
-        )
+        _log_detailed(background_tasks, payload, req, content)
+
+        # Server-built payload (DetailedDocumentOutput shape): returned as a Response,
+        # so FastAPI skips response_model validation and orjson encodes the dict directly
+        return ORJSONResponse(content={
+            "ok": True,
+            "content": content,
+            **_detailed_meta(user_text, content),
+            "type": "detailed_document",
+        })
 
     except HTTPException:
         raise
@@ -654,6 +774,60 @@ Remember:
         raise HTTPException(status_code=500, detail=f"Detailed generation failed: {str(e)}")
 
 
+@router.post("/chat/detailed/stream")
+async def chat_detailed_stream(payload: ChatInput, background_tasks: BackgroundTasks):
+    """
+    Streaming variant of /chat/detailed (Server-Sent Events).
+
+    Events (one JSON object per `data:` line):
+      {"type": "delta", "text": "..."}   - document text as it is generated
+      {"type": "done", "ok": true, "title", "category", "tokens_used"}
+      {"type": "error", "ok": false, "detail": "..."}
+
+    /chat/detailed stays as the non-streaming fallback.
+    """
+    req = _prepare_detailed(payload)
+    user_text = req["user_text"]
+
+    async def _stream():
+        cached = None if payload.history else llm_cache.get(req["cache_ns"], user_text)
+        if cached is not None:
+            parts = [cached]
+            yield _sse({"type": "delta", "text": cached})
+        else:
+            parts = []
+            try:
+                async with claude.messages.stream(
+                    model=CLAUDE_MODEL,
+                    system=req["system_prompt"],
+                    messages=req["messages"],
+                    max_tokens=4096,
+                    temperature=0.7,
+                ) as s:
+                    async for text in s.text_stream:
+                        parts.append(text)
+                        yield _sse({"type": "delta", "text": text})
+            except Exception as e:
+                print(f"[DETAILED ERROR] chat_detailed_stream failed: {e}")
+                yield _sse({"type": "error", "ok": False, "detail": f"Detailed generation failed: {str(e)}"})
+                return
+
+        # Post-stream: cache + shadow log (runs after the body is sent) + metadata event
+        content = "".join(parts)
+        if cached is None and not payload.history:
+            llm_cache.set(req["cache_ns"], user_text, content)
+        _log_detailed(background_tasks, payload, req, content)
+
+        yield _sse({"type": "done", "ok": True, **_detailed_meta(user_text, content)})
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks,
+    )
+
+
 # ---------- Focus Item Content Generation ----------
 
 @router.post("/chat/focus-item-content")
@@ -690,11 +864,11 @@ async def focus_item_content(payload: FocusItemContentInput):
         if isinstance(content, dict) and content.get("error"):
             error_code = content.get("error")
             if error_code == "task_not_allowed_for_mode":
-                return JSONResponse(status_code=409, content=content)
+                return ORJSONResponse(status_code=409, content=content)
             elif error_code == "missing_target_language":
-                return JSONResponse(status_code=400, content={"error": "missing_target_language", "detail": "target_language is required for translation/roleplay"})
+                return ORJSONResponse(status_code=400, content={"error": "missing_target_language", "detail": "target_language is required for translation/roleplay"})
             else:
-                return JSONResponse(status_code=400, content=content)
+                return ORJSONResponse(status_code=400, content=content)
 
         # Normalize lesson content
         if isinstance(content, dict) and content.get("type") == "lesson":
@@ -704,7 +878,7 @@ async def focus_item_content(payload: FocusItemContentInput):
             if isinstance(inner, dict) and inner.get("title") and not content.get("title"):
                 content["title"] = inner.get("title")
 
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "ok": True,
             "content": content,
             "item_id": payload.item_id,
@@ -8,6 +8,7 @@ from __future__ import annotations
 import json
 from typing import Any, Dict, List
 from datetime import datetime
+from secrets import token_hex
 
 
 def execute_tool(tool_name: str, tool_input: Dict[str, Any]) -> Dict[str, Any]:
@@ -72,20 +73,18 @@ def _create_summary_with_files(input_data: Dict[str, Any]) -> Dict[str, Any]:
             }
         }
     """
-    import uuid
-    
     title = input_data.get("title", "Untitled Summary")
     summary_content = input_data.get("summary_content", "")
     files = input_data.get("files", [])
     tags = input_data.get("tags", [])
     
     # Generate IDs
-    summary_id = f"summary_{uuid.uuid4().hex[:12]}"
+    summary_id = f"summary_{token_hex(6)}"
     
     # Prepare files with IDs
     prepared_files = []
     for file_data in files:
-        file_id = f"file_{uuid.uuid4().hex[:12]}"
+        file_id = f"file_{token_hex(6)}"
         prepared_files.append({
             "id": file_id,
             "filename": file_data.get("filename", "unknown.txt"),
@@ -117,13 +116,11 @@ def _create_markdown_doc(input_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Create a standalone markdown document.
     """
-    import uuid
-    
     title = input_data.get("title", "Untitled Document")
     content = input_data.get("content", "")
     tags = input_data.get("tags", [])
     
-    doc_id = f"doc_{uuid.uuid4().hex[:12]}"
+    doc_id = f"doc_{token_hex(6)}"
     
     result = {
         "type": "markdown_doc",
@@ -147,14 +144,12 @@ def _save_code_snippet(input_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Save a single code file.
     """
-    import uuid
-    
     filename = input_data.get("filename", "code.txt")
     content = input_data.get("content", "")
     description = input_data.get("description", "")
     language = input_data.get("language", "plaintext")
     
-    file_id = f"file_{uuid.uuid4().hex[:12]}"
+    file_id = f"file_{token_hex(6)}"
     
     result = {
         "type": "code_snippet",
@@ -1,13 +1,22 @@
 # app/db.py
 from __future__ import annotations
 
+import asyncio
+import functools
 import os
-import json
-from datetime import date, datetime
-from typing import Optional, Tuple, Any, List, Dict
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from secrets import token_hex
+from typing import Optional, Tuple, Any, Deque, Iterator, List, Dict
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import orjson
+import psycopg
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
 
 
 def get_db_dsn() -> str:
@@ -25,22 +34,72 @@ def get_db_dsn() -> str:
     return os.getenv("DATABASE_URL", "").strip()
 
 
-def _connect():
+def _checked_dsn() -> str:
     dsn = get_db_dsn()
     if not dsn:
         raise RuntimeError("DATABASE_URL or SUPABASE_DB_URL not set")
     # Safety check: never connect to SUPABASE_URL (REST endpoint)
     if ".supabase.co" in dsn and not dsn.startswith("postgres"):
         raise RuntimeError("Invalid DB DSN: looks like SUPABASE_URL (REST), not a Postgres DSN")
-    return psycopg2.connect(dsn, sslmode="require")
+    return dsn
+
+
+# =========================
+# Connection pool (reuses TCP+TLS sessions instead of connect-per-query)
+# =========================
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+
+
+def _prepare_threshold() -> Optional[int]:
+    """
+    psycopg prepares a statement server-side after it ran this many times on a connection,
+    so the hot usage/log statements skip parse+plan. "none" disables it
+    (needed behind PgBouncer transaction mode older than 1.22).
+    """
+    raw = os.getenv("DB_PREPARE_THRESHOLD", "3").strip().lower()
+    if raw in ("", "none", "off"):
+        return None
+    return int(raw)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _checked_dsn(),
+                    min_size=1,
+                    max_size=DB_POOL_MAX,
+                    kwargs={"sslmode": "require", "prepare_threshold": _prepare_threshold(), "prepared_max": 200},
+                    open=True,
+                )
+    return _pool
+
+
+@contextmanager
+def _pooled_conn():
+    """
+    Borrow a pooled connection (waits when all are busy).
+    The pool commits on success, rolls back on error and discards broken connections.
+    """
+    with _get_pool().connection() as conn:
+        yield conn
 
 
 def db_ok() -> bool:
     try:
         if not get_db_dsn():
             return False
-        conn = _connect()
-        conn.close()
+        with _pooled_conn() as conn:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
         return True
     except Exception:
         return False
@@ -52,46 +111,81 @@ def db_ok() -> bool:
 def run_sql(sql: str, params: Optional[tuple] = None) -> None:
     if not get_db_dsn():
         return
-    conn = _connect()
-    try:
-        with conn:
+    with _pooled_conn() as conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(sql, params or ())
-    finally:
-        conn.close()
 
 
 def fetch_all(sql: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
     if not get_db_dsn():
         return []
-    conn = _connect()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(sql, params or ())
-                rows = cur.fetchall()
-                return list(rows) if rows else []
-    finally:
-        conn.close()
+                return cur.fetchall()
 
 
 def fetch_one(sql: str, params: Optional[tuple] = None) -> Optional[Dict[str, Any]]:
     if not get_db_dsn():
         return None
-    conn = _connect()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(sql, params or ())
                 row = cur.fetchone()
                 return dict(row) if row else None
-    finally:
-        conn.close()
+
+
+def fetch_one_tuple(sql: str, params: Optional[tuple] = None) -> Optional[tuple]:
+    """fetch_one for fixed-column reads: plain tuple row, no per-row dict."""
+    if not get_db_dsn():
+        return None
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(sql, params or ())
+                return cur.fetchone()
+
+
+@contextmanager
+def fetch_iter(sql: str, params: Optional[tuple] = None, batch: int = 500) -> Iterator[Iterator[Dict[str, Any]]]:
+    """
+    Stream a large result set with a server-side (named) cursor, `batch` rows per round-trip.
+    The transaction stays open while the with-block is active:
+
+        with fetch_iter("SELECT ...", (x,)) as rows:
+            for row in rows:
+                ...
+    """
+    if not get_db_dsn():
+        yield iter(())
+        return
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor(name=f"fetch_iter_{token_hex(4)}", row_factory=dict_row) as cur:
+                cur.itersize = batch
+                cur.execute(sql, params or ())
+                yield _iter_batches(cur, batch)
+
+
+def _iter_batches(cur, batch: int) -> Iterator[Dict[str, Any]]:
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        yield from rows
 
 
 # =========================
 # Schema init
 # =========================
+# DDL runs at most once per process (first successful call); later calls are a flag check
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
 def ensure_schema() -> None:
     """
     Idempotens schema init.
@@ -101,104 +195,275 @@ def ensure_schema() -> None:
     - emoria_chat_logs: every turn audit log
     - emoria_shadow_logs: future training shadow log (Qwen etc.)
     """
-    if not get_db_dsn():
+    global _schema_ready
+
+    if _schema_ready or not get_db_dsn():
         return
 
-    conn = _connect()
-    try:
-        with conn:
+    with _schema_lock:
+        if _schema_ready:
+            return
+        _create_schema()
+        _schema_ready = True
+
+
+# All schema DDL in one batch: a single round trip instead of one per statement.
+# Parameterless, so psycopg sends it as one simple-query multi-statement string.
+_SCHEMA_DDL = """
+-- ---- usage ----
+CREATE TABLE IF NOT EXISTS emoria_usage_daily (
+    id BIGSERIAL PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    memberstack_id TEXT,
+    usage_day DATE NOT NULL,
+    tokens_used_today INTEGER NOT NULL DEFAULT 0,
+    usage_voice_seconds_today INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- covering unique index: usage_get is an index-only scan, ON CONFLICT still matches it
+CREATE UNIQUE INDEX IF NOT EXISTS ux_emoria_usage_daily_session_day_cov
+ON emoria_usage_daily (session_id, usage_day)
+INCLUDE (tokens_used_today, usage_voice_seconds_today);
+DROP INDEX IF EXISTS ux_emoria_usage_daily_session_day;
+CREATE INDEX IF NOT EXISTS ix_emoria_usage_daily_member_day
+ON emoria_usage_daily (memberstack_id, usage_day);
+
+-- ---- memory facts ----
+CREATE TABLE IF NOT EXISTS memory_facts (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    fact TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    identity_key TEXT NOT NULL
+);
+-- identity_key lookups are always "newest first": one composite index replaces two single-column ones
+CREATE INDEX IF NOT EXISTS idx_memory_facts_identity_created ON memory_facts(identity_key, created_at DESC);
+DROP INDEX IF EXISTS idx_memory_facts_identity_key;
+DROP INDEX IF EXISTS idx_memory_facts_created_at;
+
+-- ---- audit chat logs (ALWAYS written) ----
+-- daily range partitions on ts (see _ensure_log_partitions); the partition key must be in the PK
+CREATE TABLE IF NOT EXISTS emoria_chat_logs (
+    id BIGSERIAL,
+    ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    session_id TEXT NOT NULL,
+    memberstack_id TEXT,
+    identity_key TEXT,
+    tier TEXT,
+    lang TEXT,
+    mode TEXT,
+    user_message TEXT,
+    assistant_reply TEXT,
+    assistant_source TEXT,
+    meta_json JSONB,
+    PRIMARY KEY (id, ts)
+) PARTITION BY RANGE (ts);
+-- DEFAULT partition with the table: inserts always have a target, even before the first
+-- successful _ensure_log_partitions run
+CREATE TABLE IF NOT EXISTS emoria_chat_logs_default PARTITION OF emoria_chat_logs DEFAULT;
+CREATE INDEX IF NOT EXISTS ix_emoria_chat_logs_session_ts ON emoria_chat_logs(session_id, ts DESC);
+
+-- append-only, monotonically growing ts: BRIN is tiny and cheap to maintain on insert
+CREATE INDEX IF NOT EXISTS ix_emoria_chat_logs_ts_brin ON emoria_chat_logs USING BRIN (ts) WITH (pages_per_range = 32);
+DROP INDEX IF EXISTS ix_emoria_chat_logs_ts;
+
+-- ---- shadow logs (future training) ----
+CREATE TABLE IF NOT EXISTS emoria_shadow_logs (
+    id BIGSERIAL,
+    ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    session_id TEXT NOT NULL,
+    memberstack_id TEXT,
+    identity_key TEXT,
+    tier TEXT,
+    lang TEXT,
+    mode TEXT,
+    user_message TEXT NOT NULL,
+    production_model TEXT,
+    production_reply TEXT,
+    shadow_model TEXT,
+    shadow_reply TEXT,
+    shadow_meta_json JSONB,
+    PRIMARY KEY (id, ts)
+) PARTITION BY RANGE (ts);
+CREATE TABLE IF NOT EXISTS emoria_shadow_logs_default PARTITION OF emoria_shadow_logs DEFAULT;
+CREATE INDEX IF NOT EXISTS ix_emoria_shadow_logs_session_ts ON emoria_shadow_logs(session_id, ts DESC);
+CREATE INDEX IF NOT EXISTS ix_emoria_shadow_logs_ts_brin ON emoria_shadow_logs USING BRIN (ts) WITH (pages_per_range = 32);
+DROP INDEX IF EXISTS ix_emoria_shadow_logs_ts;
+"""
+
+
+def _create_schema() -> None:
+    with _pooled_conn() as conn:
+        with conn.transaction():
             with conn.cursor() as cur:
-                # ---- usage ----
-                cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS emoria_usage_daily (
-                        id BIGSERIAL PRIMARY KEY,
-                        session_id TEXT NOT NULL,
-                        memberstack_id TEXT,
-                        usage_day DATE NOT NULL,
-                        tokens_used_today INTEGER NOT NULL DEFAULT 0,
-                        usage_voice_seconds_today INTEGER NOT NULL DEFAULT 0,
-                        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                    );
-                    """
-                )
+                legacy = _detach_plain_log_tables(cur)
+                cur.execute(_SCHEMA_DDL)
+                _attach_legacy_log_tables(cur, legacy)
 
-                cur.execute(
-                    """
-                    CREATE UNIQUE INDEX IF NOT EXISTS ux_emoria_usage_daily_session_day
-                    ON emoria_usage_daily (session_id, usage_day);
-                    """
-                )
-                cur.execute(
-                    """
-                    CREATE INDEX IF NOT EXISTS ix_emoria_usage_daily_member_day
-                    ON emoria_usage_daily (memberstack_id, usage_day);
-                    """
-                )
 
-                # ---- memory facts ----
-                cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS memory_facts (
-                        id BIGSERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL DEFAULT 0,
-                        fact TEXT NOT NULL,
-                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                        identity_key TEXT NOT NULL
-                    );
-                    """
-                )
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_memory_facts_identity_key ON memory_facts(identity_key);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_memory_facts_created_at ON memory_facts(created_at DESC);")
+# Log tables are range-partitioned by day: inserts only touch the current partition's
+# small indexes, and old days are dropped as whole partitions (LOG_RETENTION_DAYS).
+LOG_PARTITIONED_TABLES = ("emoria_chat_logs", "emoria_shadow_logs")
+LOG_PARTITION_DAYS_AHEAD = 1
+# 0 = keep every day (audit logs); N > 0 = drop day partitions older than N days
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+LOG_PARTITION_RETRY_SECONDS = 300
+_log_partitions_day: Optional[date] = None
+_log_partitions_retry_at = 0.0
+_log_partitions_lock = threading.Lock()
 
-                # ---- audit chat logs (ALWAYS written) ----
-                cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS emoria_chat_logs (
-                        id BIGSERIAL PRIMARY KEY,
-                        ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                        session_id TEXT NOT NULL,
-                        memberstack_id TEXT,
-                        identity_key TEXT,
-                        tier TEXT,
-                        lang TEXT,
-                        mode TEXT,
-                        user_message TEXT,
-                        assistant_reply TEXT,
-                        assistant_source TEXT,
-                        meta_json JSONB
-                    );
-                    """
-                )
-                cur.execute("CREATE INDEX IF NOT EXISTS ix_emoria_chat_logs_session_ts ON emoria_chat_logs(session_id, ts DESC);")
-                cur.execute("CREATE INDEX IF NOT EXISTS ix_emoria_chat_logs_ts ON emoria_chat_logs(ts DESC);")
 
-                # ---- shadow logs (future training) ----
-                cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS emoria_shadow_logs (
-                        id BIGSERIAL PRIMARY KEY,
-                        ts TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                        session_id TEXT NOT NULL,
-                        memberstack_id TEXT,
-                        identity_key TEXT,
-                        tier TEXT,
-                        lang TEXT,
-                        mode TEXT,
-                        user_message TEXT NOT NULL,
-                        production_model TEXT,
-                        production_reply TEXT,
-                        shadow_model TEXT,
-                        shadow_reply TEXT,
-                        shadow_meta_json JSONB
-                    );
-                    """
-                )
-                cur.execute("CREATE INDEX IF NOT EXISTS ix_emoria_shadow_logs_session_ts ON emoria_shadow_logs(session_id, ts DESC);")
-                cur.execute("CREATE INDEX IF NOT EXISTS ix_emoria_shadow_logs_ts ON emoria_shadow_logs(ts DESC);")
+def _detach_plain_log_tables(cur) -> List[str]:
+    """
+    Migration for log tables created before partitioning (plain heap tables):
+    rename each one (and its indexes/sequence) to <name>_legacy so _SCHEMA_DDL
+    creates the partitioned parent under the original name.
+    """
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relname = ANY(%s) AND relkind = 'r' AND relnamespace = 'public'::regnamespace",
+        (list(LOG_PARTITIONED_TABLES),),
+    )
+    legacy = [parent for (parent,) in cur.fetchall()]
+    for parent in legacy:
+        cur.execute(f"ALTER TABLE {parent} RENAME TO {parent}_legacy")
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s", (f"{parent}_legacy",))
+        for (index_name,) in cur.fetchall():
+            # renaming the pkey index renames the constraint too
+            cur.execute(f"ALTER INDEX {index_name} RENAME TO {index_name}_legacy")
+        cur.execute(f"ALTER SEQUENCE IF EXISTS {parent}_id_seq RENAME TO {parent}_legacy_id_seq")
+    return legacy
+
+
+def _attach_legacy_log_tables(cur, legacy: List[str]) -> None:
+    """
+    Attach each renamed plain table as one range partition covering everything
+    up to tomorrow 00:00 UTC (so it holds all its existing rows; daily partitions start after it).
+    One-time cost: ATTACH validates the range and builds the (id, ts) unique index on it.
+    """
+    if not legacy:
+        return
+    cutoff = datetime.now(timezone.utc).date() + timedelta(days=1)
+    for parent in legacy:
+        # new ids continue after the legacy ones
+        cur.execute(
+            f"SELECT setval(pg_get_serial_sequence('{parent}', 'id'), "
+            f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {parent}_legacy), false)"
+        )
+        cur.execute(
+            f"ALTER TABLE {parent} ATTACH PARTITION {parent}_legacy "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutoff.isoformat()} 00:00+00')"
+        )
+        print(f"[db] migrated {parent} to a partitioned table ({parent}_legacy holds rows before {cutoff})")
+
+
+def _log_day_bounds(day: date) -> Tuple[str, str]:
+    return f"{day.isoformat()} 00:00+00", f"{(day + timedelta(days=1)).isoformat()} 00:00+00"
+
 
-    finally:
-        conn.close()
+def _create_log_day_partition(conn, parent: str, day: date) -> None:
+    """
+    Create parent_pYYYYMMDD for one UTC day, in its own transaction.
+    - range already covered by another partition (e.g. <parent>_legacy): nothing to do
+    - rows for that day already in the DEFAULT partition (missed midnight, first run):
+      detach DEFAULT, create the day partition, move those rows into it, re-attach DEFAULT
+    """
+    child = f"{parent}_p{day:%Y%m%d}"
+    lo, hi = _log_day_bounds(day)
+    create = f"CREATE TABLE IF NOT EXISTS {child} PARTITION OF {parent} FOR VALUES FROM ('{lo}') TO ('{hi}')"
+    try:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(create)
+        return
+    except psycopg.errors.InvalidObjectDefinition:
+        # "would overlap partition ..."
+        return
+    except psycopg.errors.CheckViolation:
+        # "updated partition constraint for default partition ... would be violated by some row"
+        pass
+
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {parent}_default")
+            cur.execute(create)
+            cur.execute(
+                f"WITH moved AS (DELETE FROM {parent}_default WHERE ts >= %s AND ts < %s RETURNING *) "
+                f"INSERT INTO {child} SELECT * FROM moved",
+                (lo, hi),
+            )
+            cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {parent}_default DEFAULT")
+    print(f"[db] {child}: moved rows out of {parent}_default")
+
+
+def _drop_expired_log_partitions(conn, parent: str, today: date) -> None:
+    """Drop parent_pYYYYMMDD partitions older than LOG_RETENTION_DAYS (never _default/_legacy)."""
+    if LOG_RETENTION_DAYS <= 0:
+        return
+    oldest_kept = f"{parent}_p{today - timedelta(days=LOG_RETENTION_DAYS):%Y%m%d}"
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass AND c.relname ~ %s
+                """,
+                (parent, f"^{parent}_p[0-9]{{8}}$"),
+            )
+            # fixed-width YYYYMMDD suffix: name order == day order
+            expired = [name for (name,) in cur.fetchall() if name < oldest_kept]
+    for name in expired:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {name}")
+        print(f"[db] dropped expired log partition {name}")
+
+
+def _ensure_log_partitions() -> None:
+    """
+    Once per UTC day: DEFAULT partition, today's + the next days' partitions, retention.
+    Every statement runs in its own transaction; the day only counts as done when all
+    succeeded, otherwise it is retried after LOG_PARTITION_RETRY_SECONDS (not on every flush).
+    """
+    global _log_partitions_day, _log_partitions_retry_at
+
+    today = datetime.now(timezone.utc).date()
+    if _log_partitions_day == today or time.time() < _log_partitions_retry_at:
+        return
+
+    with _log_partitions_lock:
+        if _log_partitions_day == today or time.time() < _log_partitions_retry_at:
+            return
+        try:
+            with _pooled_conn() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            SELECT c.relname
+                            FROM pg_partitioned_table p
+                            JOIN pg_class c ON c.oid = p.partrelid
+                            WHERE c.relname = ANY(%s)
+                            """,
+                            (list(LOG_PARTITIONED_TABLES),),
+                        )
+                        parents = [parent for (parent,) in cur.fetchall()]
+                for parent in parents:
+                    with conn.transaction():
+                        with conn.cursor() as cur:
+                            cur.execute(f"CREATE TABLE IF NOT EXISTS {parent}_default PARTITION OF {parent} DEFAULT")
+                    for offset in range(LOG_PARTITION_DAYS_AHEAD + 1):
+                        _create_log_day_partition(conn, parent, today + timedelta(days=offset))
+                    _drop_expired_log_partitions(conn, parent, today)
+        except Exception as e:
+            # rows still land in the DEFAULT partition (created with the schema in _SCHEMA_DDL;
+            # moved out into their day partition on the next successful run)
+            print(f"[db] log partition maintenance failed: {e}")
+            _log_partitions_retry_at = time.time() + LOG_PARTITION_RETRY_SECONDS
+            return
+        _log_partitions_day = today
 
 
 # =========================
@@ -220,10 +485,38 @@ TIER_TOKEN_LIMITS = {
 
 
 def get_token_limit(tier: Optional[str]) -> int:
-    t = (tier or "FREE").upper().replace("-", "_").replace(" ", "_")
+    return _token_limit_for(tier or "FREE")
+
+
+@functools.lru_cache(maxsize=64)
+def _token_limit_for(tier: str) -> int:
+    # few distinct tier strings reach here: normalize each once
+    t = tier.upper().replace("-", "_").replace(" ", "_")
     return TIER_TOKEN_LIMITS.get(t, TIER_TOKEN_LIMITS["FREE"])
 
 
+# Short TTL read cache for usage_get (per process). usage_commit_tokens writes the
+# RETURNING totals straight in, so reads after a commit in this process are exact.
+USAGE_CACHE_TTL = 5.0
+USAGE_CACHE_MAX = 10_000
+_usage_cache: Dict[Tuple[str, date], Tuple[int, int, float]] = {}
+_usage_cache_lock = threading.Lock()
+
+
+def _usage_cache_get(key: Tuple[str, date]) -> Optional[Tuple[int, int]]:
+    hit = _usage_cache.get(key)
+    if hit and hit[2] > time.monotonic():
+        return (hit[0], hit[1])
+    return None
+
+
+def _usage_cache_put(key: Tuple[str, date], tokens: int, voice_seconds: int) -> None:
+    with _usage_cache_lock:
+        if len(_usage_cache) >= USAGE_CACHE_MAX:
+            _usage_cache.clear()
+        _usage_cache[key] = (tokens, voice_seconds, time.monotonic() + USAGE_CACHE_TTL)
+
+
 def usage_get(memberstack_id: Optional[str], session_id: Optional[str], usage_day: Optional[str]) -> Tuple[str, int, int]:
     day = _parse_day(usage_day)
     day_s = day.isoformat()
@@ -235,7 +528,11 @@ def usage_get(memberstack_id: Optional[str], session_id: Optional[str], usage_da
     if not sid:
         return (day_s, 0, 0)
 
-    row = fetch_one(
+    cached = _usage_cache_get((sid, day))
+    if cached is not None:
+        return (day_s, cached[0], cached[1])
+
+    row = fetch_one_tuple(
         """
         SELECT tokens_used_today, usage_voice_seconds_today
         FROM emoria_usage_daily
@@ -244,8 +541,33 @@ def usage_get(memberstack_id: Optional[str], session_id: Optional[str], usage_da
         (sid, day),
     )
     if not row:
-        return (day_s, 0, 0)
-    return (day_s, int(row.get("tokens_used_today", 0)), int(row.get("usage_voice_seconds_today", 0)))
+        tokens, voice_seconds = 0, 0
+    else:
+        tokens, voice_seconds = int(row[0]), int(row[1])
+    _usage_cache_put((sid, day), tokens, voice_seconds)
+    return (day_s, tokens, voice_seconds)
+
+
+_USAGE_UPSERT_SQL = """
+    INSERT INTO emoria_usage_daily (
+        session_id, memberstack_id, usage_day,
+        tokens_used_today, usage_voice_seconds_today
+    )
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (session_id, usage_day)
+    DO UPDATE SET
+        memberstack_id = COALESCE(EXCLUDED.memberstack_id, emoria_usage_daily.memberstack_id),
+        tokens_used_today = emoria_usage_daily.tokens_used_today + EXCLUDED.tokens_used_today,
+        usage_voice_seconds_today = emoria_usage_daily.usage_voice_seconds_today + EXCLUDED.usage_voice_seconds_today,
+        updated_at = NOW()
+    RETURNING tokens_used_today, usage_voice_seconds_today
+"""
+
+_USAGE_COMMIT_AND_CHECK_SQL = f"""
+    WITH upsert AS ({_USAGE_UPSERT_SQL})
+    SELECT tokens_used_today, usage_voice_seconds_today, tokens_used_today <= %s
+    FROM upsert
+"""
 
 
 def usage_commit_tokens(
@@ -265,31 +587,54 @@ def usage_commit_tokens(
     if not get_db_dsn():
         return (day_s, max(0, int(add_tokens)), max(0, int(add_voice_seconds)))
 
-    conn = _connect()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
                 cur.execute(
-                    """
-                    INSERT INTO emoria_usage_daily (
-                        session_id, memberstack_id, usage_day,
-                        tokens_used_today, usage_voice_seconds_today
-                    )
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (session_id, usage_day)
-                    DO UPDATE SET
-                        memberstack_id = COALESCE(EXCLUDED.memberstack_id, emoria_usage_daily.memberstack_id),
-                        tokens_used_today = emoria_usage_daily.tokens_used_today + EXCLUDED.tokens_used_today,
-                        usage_voice_seconds_today = emoria_usage_daily.usage_voice_seconds_today + EXCLUDED.usage_voice_seconds_today,
-                        updated_at = NOW()
-                    RETURNING tokens_used_today, usage_voice_seconds_today
-                    """,
+                    _USAGE_UPSERT_SQL,
                     (sid, (memberstack_id or None), day, max(0, int(add_tokens)), max(0, int(add_voice_seconds))),
                 )
                 row = cur.fetchone()
-                return (day_s, int(row["tokens_used_today"]), int(row["usage_voice_seconds_today"]))
-    finally:
-        conn.close()
+                tokens, voice_seconds = int(row[0]), int(row[1])
+    _usage_cache_put((sid, day), tokens, voice_seconds)
+    return (day_s, tokens, voice_seconds)
+
+
+def commit_and_check(
+    memberstack_id: Optional[str],
+    session_id: Optional[str],
+    usage_day: Optional[str],
+    add_tokens: int,
+    tier: Optional[str],
+    add_voice_seconds: int = 0,
+) -> Tuple[str, int, int, int, bool]:
+    """
+    usage_commit_tokens + budget check in one atomic statement (one round-trip).
+    Returns (usage_day, tokens_used_today, usage_voice_seconds_today, token_limit, within_budget).
+    """
+    day = _parse_day(usage_day)
+    day_s = day.isoformat()
+    token_limit = get_token_limit(tier)
+
+    sid = (session_id or "").strip()
+    if not sid:
+        raise ValueError("session_id required for commit_and_check")
+
+    if not get_db_dsn():
+        tokens = max(0, int(add_tokens))
+        return (day_s, tokens, max(0, int(add_voice_seconds)), token_limit, tokens <= token_limit)
+
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(
+                    _USAGE_COMMIT_AND_CHECK_SQL,
+                    (sid, (memberstack_id or None), day, max(0, int(add_tokens)), max(0, int(add_voice_seconds)), token_limit),
+                )
+                row = cur.fetchone()
+                tokens, voice_seconds, allowed = int(row[0]), int(row[1]), bool(row[2])
+    _usage_cache_put((sid, day), tokens, voice_seconds)
+    return (day_s, tokens, voice_seconds, token_limit, allowed)
 
 
 def check_token_budget(session_id: Optional[str], tier: Optional[str], required_tokens: int = 0) -> Tuple[bool, int, int, int]:
@@ -303,6 +648,15 @@ def check_token_budget(session_id: Optional[str], tier: Optional[str], required_
 # =========================
 # Logging inserts
 # =========================
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _jsonb(meta: Optional[dict]) -> Jsonb:
+    # psycopg serializes with orjson straight to UTF-8 bytes when the row is sent (in the flusher)
+    return Jsonb(meta or {}, dumps=_orjson_dumps)
+
+
 def insert_chat_log(
     *,
     session_id: str,
@@ -316,30 +670,25 @@ def insert_chat_log(
     assistant_source: str,
     meta: Optional[dict] = None,
 ) -> None:
-    ensure_schema()
     if not get_db_dsn():
         return
 
-    run_sql(
-        """
-        INSERT INTO emoria_chat_logs(
-          session_id, memberstack_id, identity_key, tier, lang, mode,
-          user_message, assistant_reply, assistant_source, meta_json
-        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
-        """,
-        (
-            session_id,
-            (memberstack_id or None),
-            (identity_key or None),
-            (tier or None),
-            (lang or None),
-            (mode or None),
-            user_message,
-            assistant_reply,
-            assistant_source,
-            json.dumps(meta or {}, ensure_ascii=False),
-        ),
+    row = (
+        session_id,
+        (memberstack_id or None),
+        (identity_key or None),
+        (tier or None),
+        (lang or None),
+        (mode or None),
+        user_message,
+        assistant_reply,
+        assistant_source,
+        _jsonb(meta),
     )
+    if _log_flusher_task is None:
+        _write_log_batch([row], [])
+        return
+    _chat_log_queue.append(row)
 
 
 def insert_shadow_log(
@@ -357,53 +706,172 @@ def insert_shadow_log(
     shadow_reply: Optional[str] = None,
     shadow_meta: Optional[dict] = None,
 ) -> None:
-    ensure_schema()
     if not get_db_dsn():
         return
 
-    run_sql(
-        """
-        INSERT INTO emoria_shadow_logs(
-          session_id, memberstack_id, identity_key, tier, lang, mode,
-          user_message, production_model, production_reply,
-          shadow_model, shadow_reply, shadow_meta_json
-        ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
-        """,
-        (
-            session_id,
-            (memberstack_id or None),
-            (identity_key or None),
-            (tier or None),
-            (lang or None),
-            (mode or None),
-            user_message,
-            production_model,
-            production_reply,
-            shadow_model,
-            shadow_reply,
-            json.dumps(shadow_meta or {}, ensure_ascii=False),
-        ),
+    row = (
+        session_id,
+        (memberstack_id or None),
+        (identity_key or None),
+        (tier or None),
+        (lang or None),
+        (mode or None),
+        user_message,
+        production_model,
+        production_reply,
+        shadow_model,
+        shadow_reply,
+        _jsonb(shadow_meta),
     )
+    if _log_flusher_task is None:
+        _write_log_batch([], [row])
+        return
+    _shadow_log_queue.append(row)
+
+
+# =========================
+# Batched log writer
+# =========================
+# insert_*_log only enqueue while the flusher runs (started in main.py startup);
+# every LOG_FLUSH_INTERVAL the queued rows go out as one multi-row INSERT per table.
+# Rows the DB could not take (unreachable) are requeued; bounded deques cap memory if it stays down.
+LOG_FLUSH_INTERVAL = 0.1
+LOG_FLUSH_BATCH = 500
+LOG_QUEUE_MAX = 10_000
+
+_CHAT_LOG_INSERT = """
+    INSERT INTO emoria_chat_logs(
+      session_id, memberstack_id, identity_key, tier, lang, mode,
+      user_message, assistant_reply, assistant_source, meta_json
+    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+_SHADOW_LOG_INSERT = """
+    INSERT INTO emoria_shadow_logs(
+      session_id, memberstack_id, identity_key, tier, lang, mode,
+      user_message, production_model, production_reply,
+      shadow_model, shadow_reply, shadow_meta_json
+    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+"""
+
+# deque append/popleft are thread-safe: log calls come from the threadpool, draining from the event loop
+_chat_log_queue: Deque[tuple] = deque(maxlen=LOG_QUEUE_MAX)
+_shadow_log_queue: Deque[tuple] = deque(maxlen=LOG_QUEUE_MAX)
+_log_flusher_task: Optional[asyncio.Task] = None
+
+
+def _write_log_rows(sql: str, rows: List[tuple], kind: str) -> List[tuple]:
+    """
+    Insert one table's drained rows in their own transaction (executemany pipelines them:
+    one round-trip). If the batch is rejected, retry row by row so a bad row only costs itself.
+    Returns the rows not written because the DB is unreachable (the caller requeues them).
+    """
+    written = 0
+    try:
+        with _pooled_conn() as conn:
+            try:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        cur.executemany(sql, rows)
+                return []
+            except psycopg.OperationalError:
+                raise
+            except psycopg.Error as e:
+                print(f"[db] {kind} log batch of {len(rows)} rejected, retrying row by row: {e}")
+
+            for row in rows:
+                try:
+                    with conn.transaction():
+                        with conn.cursor() as cur:
+                            cur.execute(sql, row)
+                except psycopg.OperationalError:
+                    raise
+                except psycopg.Error as e:
+                    print(f"[db] dropped bad {kind} log row: {e}")
+                written += 1
+            return []
+    except psycopg.OperationalError as e:
+        # connection / pool failure: nothing past `written` reached the DB
+        print(f"[db] {kind} log write failed, requeueing {len(rows) - written} rows: {e}")
+        return rows[written:]
+
+
+def _write_log_batch(chat_rows: List[tuple], shadow_rows: List[tuple]) -> Tuple[List[tuple], List[tuple]]:
+    ensure_schema()
+    _ensure_log_partitions()
+    chat_left = _write_log_rows(_CHAT_LOG_INSERT, chat_rows, "chat") if chat_rows else []
+    shadow_left = _write_log_rows(_SHADOW_LOG_INSERT, shadow_rows, "shadow") if shadow_rows else []
+    return chat_left, shadow_left
+
+
+def _drain(queue: Deque[tuple], limit: int) -> List[tuple]:
+    rows: List[tuple] = []
+    while queue and len(rows) < limit:
+        rows.append(queue.popleft())
+    return rows
+
+
+def _requeue(queue: Deque[tuple], rows: List[tuple]) -> None:
+    # back to the front in their original order; a full deque (maxlen) drops from the newest end
+    queue.extendleft(reversed(rows))
+
+
+async def flush_logs() -> None:
+    while _chat_log_queue or _shadow_log_queue:
+        chat_rows = _drain(_chat_log_queue, LOG_FLUSH_BATCH)
+        shadow_rows = _drain(_shadow_log_queue, LOG_FLUSH_BATCH)
+        try:
+            chat_left, shadow_left = await asyncio.to_thread(_write_log_batch, chat_rows, shadow_rows)
+        except Exception as e:
+            # schema/pool setup failed before any insert: keep every row for the next flush
+            print(f"[db] log flush failed, requeueing {len(chat_rows)} chat + {len(shadow_rows)} shadow rows: {e}")
+            chat_left, shadow_left = chat_rows, shadow_rows
+        if chat_left or shadow_left:
+            _requeue(_chat_log_queue, chat_left)
+            _requeue(_shadow_log_queue, shadow_left)
+            return
+
+
+async def _log_flusher() -> None:
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        await flush_logs()
+
+
+def start_log_flusher() -> None:
+    global _log_flusher_task
+
+    if _log_flusher_task is None and get_db_dsn():
+        _log_flusher_task = asyncio.get_running_loop().create_task(_log_flusher())
+
+
+async def stop_log_flusher() -> None:
+    global _log_flusher_task
+
+    task, _log_flusher_task = _log_flusher_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await flush_logs()
+
+
 # --- Generic helpers for memory_store (required) ---
 
 from typing import Any, Iterable, List, Dict, Optional, Tuple
 
 def run_sql(sql: str, params: Optional[Tuple[Any, ...]] = None) -> None:
-    conn = _connect()
-    try:
-        with conn:
+    with _pooled_conn() as conn:
+        with conn.transaction():
             with conn.cursor() as cur:
                 cur.execute(sql, params)
-    finally:
-        conn.close()
 
 def fetch_all(sql: str, params: Optional[Tuple[Any, ...]] = None) -> List[Dict]:
-    conn = _connect()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with _pooled_conn() as conn:
+        with conn.transaction():
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(sql, params)
-                rows = cur.fetchall()
-                return [dict(r) for r in rows] if rows else []
-    finally:
-        conn.close()
+                # dict_row already yields plain dicts: no per-row copy
+                return cur.fetchall()
@@ -2,14 +2,20 @@ from __future__ import annotations
 
 
 
+import asyncio
 import os
 import base64
+import functools
 import json
+import re
+import time
 import uuid
 
-from datetime import datetime
+import orjson
 
-from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timedelta, timezone
+
+from typing import Any, Dict, List, Optional, Tuple
 
 from zoneinfo import ZoneInfo
 
@@ -22,6 +28,9 @@ from pydantic import BaseModel
 
 from supabase import create_client, Client  # pip: supabase
 
+from .http_client import get_async_client
+from .token_cache import cache_token_uid, get_cached_uid
+
 
 
 router = APIRouter(prefix="/focus", tags=["focus"])
@@ -41,7 +50,17 @@ claude = Anthropic(api_key=CLAUDE_API_KEY) if ANTHROPIC_AVAILABLE and CLAUDE_API
 ALLOWED_MODES = {"learning", "project"}
 LEARNING_TASK_TYPES = {"lesson", "quiz", "single_select", "flashcard", "cards", "translation", "roleplay", "writing", "speaking", "listening", "reading", "task", "checklist", "briefing", "feedback", "smart_lesson"}
 PROJECT_TASK_TYPES = {"upload_review", "checklist", "quiz", "writing", "task"}
+# already-normalized mode (the usual case) -> one dict hit, no strip/lower copies
+_MODE_CANON = {m: m for m in ALLOWED_MODES}
 UPLOAD_REVIEW_MAX_BYTES = 5 * 1024 * 1024  # 5MB
+# base64 length of a max-size file (4 chars per 3 bytes, padded)
+UPLOAD_REVIEW_MAX_B64_CHARS = 4 * -(-UPLOAD_REVIEW_MAX_BYTES // 3)
+
+# SIMD base64 decoder (SSSE3/AVX2) for upload_review payloads; stdlib fallback
+try:
+    import pybase64 as _b64
+except Exception:
+    _b64 = base64
 
 
 # Timezone for daily reset (Budapest = Europe/Budapest)
@@ -59,14 +78,31 @@ print(f"[timezone] Using {EFFECTIVE_TZ} for focus reset")
 
 # These are trivial inputs users might type to bypass validation
 
-LOW_EFFORT_RESPONSES = {
+LOW_EFFORT_RESPONSES = frozenset({
     "ok", "oké", "kész", "megcsináltam", "done", "yes", "igen",
     "ready", "finished", "complete", "completed", "megvan",
     "na", "jó", "jo", "yep", "yup", "k", "x", ".", "..",
+})
+
+
+def is_low_effort(text: str) -> bool:
+    return text.strip().casefold() in LOW_EFFORT_RESPONSES
+
+
+# Hard interaction rules by practice_type (MVP-level strictness):
+# practice_type -> (min user_input chars, min user_items, 422 message)
+PRACTICE_RULES: Dict[str, Tuple[int, int, str]] = {
+    "writing": (40, 0, "Interaction required: write at least 40 characters"),
+    "translation": (0, 1, "Interaction required: submit at least 1 translation"),
+    "exercise": (15, 0, "Interaction required: send at least 15 characters"),
+    "roleplay": (15, 0, "Interaction required: send at least 15 characters"),
 }
 
 
 def _require_mode(mode: Optional[str]) -> str:
+    m = _MODE_CANON.get(mode) if mode else None
+    if m is not None:
+        return m
     m = (mode or "").strip().lower()
     if not m:
         raise HTTPException(status_code=400, detail="Missing mode")
@@ -75,12 +111,23 @@ def _require_mode(mode: Optional[str]) -> str:
     return m
 
 
+_DATA_URL_RE = re.compile(r"data:.*?base64,", re.S)
+# strict base64 alphabet check for payloads that are forwarded without decoding
+_B64_RE = re.compile(r"[A-Za-z0-9+/]*={0,2}")
+# opening fence line (```json) or closing fence line, matched in one pass
+_JSON_FENCE_RE = re.compile(r"\A```[^\n]*\n|\n[^\n]*```\Z")
+
+
 def _strip_data_url(raw: str) -> str:
     if not raw:
         return ""
-    if raw.startswith("data:") and "base64," in raw:
-        return raw.split("base64,", 1)[1]
-    return raw
+    m = _DATA_URL_RE.match(raw)
+    return raw[m.end():] if m else raw
+
+
+def _b64_decoded_len(b64: str) -> int:
+    """Byte length of a padded base64 string, without decoding it."""
+    return len(b64) * 3 // 4 - b64.count("=", -2)
 
 
 def _fallback_review_response(message: str) -> Dict[str, Any]:
@@ -93,25 +140,21 @@ def _fallback_review_response(message: str) -> Dict[str, Any]:
 
 
 def _strip_json_fences(text: str) -> str:
-    s = (text or "").strip()
-    if s.startswith("```"):
-        s = s.split("\n", 1)[1] if "\n" in s else s
-    if s.endswith("```"):
-        s = s.rsplit("\n", 1)[0] if "\n" in s else s
-    return s.strip()
+    return _JSON_FENCE_RE.sub("", (text or "").strip()).strip()
 
 
 def _extract_json_object(text: str) -> Optional[Dict[str, Any]]:
     if not text:
         return None
-    s = _strip_json_fences(text)
+    # bare JSON reply (the usual case): braces bound it, no fence pass needed
+    s = text if text.lstrip()[:1] == "{" else _strip_json_fences(text)
     start = s.find("{")
     end = s.rfind("}")
     if start == -1 or end == -1 or end <= start:
         return None
     try:
-        return json.loads(s[start : end + 1])
-    except Exception:
+        return orjson.loads(s[start : end + 1])
+    except orjson.JSONDecodeError:
         return None
 
 
@@ -179,7 +222,7 @@ async def _generate_day_summary(sb, uid: str, day_id: str, day_data: dict, plan_
     """
     try:
         # Get all items for this day
-        items_res = _safe_execute(
+        items_res = await _safe_execute_async(
             sb.table("focus_items")
             .select("id, kind, type, topic, label, estimated_minutes")
             .eq("day_id", day_id)
@@ -192,7 +235,7 @@ async def _generate_day_summary(sb, uid: str, day_id: str, day_data: dict, plan_
         item_ids = [i["id"] for i in items]
 
         # Get progress for all items
-        progress_res = _safe_execute(
+        progress_res = await _safe_execute_async(
             sb.table("focus_item_progress")
             .select("item_id, status, score, attempts, last_result_json")
             .eq("user_id", uid)
@@ -251,13 +294,13 @@ async def _generate_day_summary(sb, uid: str, day_id: str, day_data: dict, plan_
             },
             "strong_areas": strong_areas[:3],
             "weak_areas": weak_areas[:3],
-            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "generated_at": _iso_utc_now(),
         }
 
         # Generate short LLM feedback (using Haiku for speed)
         try:
             from .llm_client import call_claude_json
-            plan_res = _safe_execute(
+            plan_res = await _safe_execute_async(
                 sb.table("focus_plans").select("settings, domain, lang").eq("id", plan_id).maybe_single()
             )
             plan_lang = "hu"
@@ -298,6 +341,15 @@ async def _generate_day_summary(sb, uid: str, day_id: str, day_data: dict, plan_
         return None
 
 
+def _stripped_pairs(rows: List[Any], key_a: str, key_b: str) -> List[Tuple[str, str]]:
+    """(row[key_a], row[key_b]) as stripped strings for every dict row."""
+    return [
+        (str(r.get(key_a) or "").strip(), str(r.get(key_b) or "").strip())
+        for r in rows
+        if isinstance(r, dict)
+    ]
+
+
 def _extract_lesson_context(content: Dict[str, Any]) -> str:
     """
     Extract a compact, structured context from a language lesson content dict.
@@ -319,14 +371,11 @@ def _extract_lesson_context(content: Dict[str, Any]) -> str:
     # Vocabulary
     vocab = src.get("vocabulary_table") or []
     if isinstance(vocab, list) and vocab:
-        items = []
-        for v in vocab[:15]:
-            if not isinstance(v, dict):
-                continue
-            word = str(v.get("word") or "").strip()
-            translation = str(v.get("translation") or "").strip()
-            if word and translation:
-                items.append(f"{word} = {translation}")
+        items = [
+            f"{word} = {translation}"
+            for word, translation in _stripped_pairs(vocab[:15], "word", "translation")
+            if word and translation
+        ]
         if items:
             parts.append("VOCABULARY:\n- " + "\n- ".join(items))
 
@@ -335,14 +384,11 @@ def _extract_lesson_context(content: Dict[str, Any]) -> str:
     if isinstance(grammar, dict) and grammar:
         rule_title = str(grammar.get("rule_title") or "").strip()
         formation = str(grammar.get("formation_pattern") or "").strip()
-        examples = []
-        for ex in (grammar.get("examples") or [])[:3]:
-            if not isinstance(ex, dict):
-                continue
-            tgt = str(ex.get("target") or "").strip()
-            hu = str(ex.get("hungarian") or "").strip()
-            if tgt and hu:
-                examples.append(f"{tgt} — {hu}")
+        examples = [
+            f"{tgt} — {hu}"
+            for tgt, hu in _stripped_pairs((grammar.get("examples") or [])[:3], "target", "hungarian")
+            if tgt and hu
+        ]
         lines = []
         if rule_title:
             lines.append(f"Rule: {rule_title}")
@@ -356,17 +402,15 @@ def _extract_lesson_context(content: Dict[str, Any]) -> str:
     # Dialogue snippets (1-2 lines)
     dialogues = src.get("dialogues") or []
     if isinstance(dialogues, list) and dialogues:
-        snippets = []
+        snippets: List[str] = []
         for d in dialogues:
             if not isinstance(d, dict):
                 continue
-            for line in (d.get("lines") or [])[:2]:
-                if not isinstance(line, dict):
-                    continue
-                text = str(line.get("text") or "").strip()
-                tr = str(line.get("translation") or "").strip()
-                if text and tr:
-                    snippets.append(f"{text} — {tr}")
+            snippets = [
+                f"{text} — {tr}"
+                for text, tr in _stripped_pairs((d.get("lines") or [])[:2], "text", "translation")
+                if text and tr
+            ]
             if snippets:
                 break
         if snippets:
@@ -375,7 +419,7 @@ def _extract_lesson_context(content: Dict[str, Any]) -> str:
     # Common mistakes
     mistakes = src.get("common_mistakes") or []
     if isinstance(mistakes, list) and mistakes:
-        mitems = [str(m).strip() for m in mistakes[:5] if str(m).strip()]
+        mitems = [m for m in (str(m).strip() for m in mistakes[:5]) if m]
         if mitems:
             parts.append("COMMON MISTAKES:\n- " + "\n- ".join(mitems))
 
@@ -389,6 +433,15 @@ def today_local_iso() -> str:
 
 
 
+def _iso_utc_now() -> str:
+
+    """Current UTC time as ISO string with Z suffix (same shape as utcnow().isoformat() + "Z")."""
+
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+
+
 
 def _normalize_supabase_url(raw: str) -> str:
 
@@ -448,19 +501,19 @@ def _validate_supabase_url(url: str) -> bool:
 
 
 
-def _is_valid_uuid(val: str) -> bool:
+# canonical 8-4-4-4-12 form (what Supabase issues); one match, no UUID object or exception
 
-    """Check if string is a valid UUID."""
+_UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\Z")
 
-    try:
 
-        uuid.UUID(str(val))
 
-        return True
 
-    except (ValueError, AttributeError):
 
-        return False
+def _is_valid_uuid(val: str) -> bool:
+
+    """Check if string is a valid UUID."""
+
+    return isinstance(val, str) and _UUID_RE.match(val) is not None
 
 
 
@@ -574,6 +627,20 @@ def _safe_execute(query):
 
 
 
+async def _safe_execute_async(query):
+
+    """
+
+    _safe_execute in a worker thread: supabase-py is blocking, keep it off the event loop.
+
+    """
+
+    return await asyncio.to_thread(_safe_execute, query)
+
+
+
+
+
 def _require_admin_key(request: Request) -> None:
 
     """
@@ -690,7 +757,13 @@ async def get_user_id(request: Request) -> str:
 
 
 
-    import httpx
+    # same session calls several endpoints within seconds: skip the auth round trip
+
+    cached = get_cached_uid(token)
+
+    if cached:
+
+        return cached
 
 
 
@@ -706,9 +779,9 @@ async def get_user_id(request: Request) -> str:
 
 
 
-    async with httpx.AsyncClient(timeout=15) as client:
+    # shared keep-alive client: no TCP+TLS handshake per request
 
-        r = await client.get(url, headers=headers)
+    r = await get_async_client().get(url, headers=headers, timeout=15)
 
 
 
@@ -732,12 +805,76 @@ async def get_user_id(request: Request) -> str:
 
         raise HTTPException(status_code=401, detail="Invalid user_id from Supabase (not UUID)")
 
+    cache_token_uid(token, uid)
+
     return uid
 
 
 
 
 
+# In-memory cache for user_focus_stats rows: uid -> ({streak, last_streak_date}, expires_at)
+
+# Streaks change at most once a day; complete_day writes through. The TTL bounds how long
+
+# another worker can serve a streak from before that write.
+
+_focus_stats_cache: Dict[str, Tuple[Dict[str, Any], float]] = {}
+
+_FOCUS_STATS_CACHE_TTL = 300
+
+_FOCUS_STATS_CACHE_MAX = 10_000
+
+
+
+
+
+def _cache_focus_stats(uid: str, row: Dict[str, Any]) -> None:
+
+    now = time.time()
+
+    if len(_focus_stats_cache) >= _FOCUS_STATS_CACHE_MAX:
+
+        for k in [k for k, (_, t) in _focus_stats_cache.items() if t <= now]:
+
+            _focus_stats_cache.pop(k, None)
+
+        if len(_focus_stats_cache) >= _FOCUS_STATS_CACHE_MAX:
+
+            _focus_stats_cache.clear()
+
+    _focus_stats_cache[uid] = (row, now + _FOCUS_STATS_CACHE_TTL)
+
+
+
+
+
+async def _get_focus_stats(sb: Client, uid: str) -> Dict[str, Any]:
+
+    """{streak, last_streak_date} of the user ({} if no row yet), cached for read-only paths."""
+
+    cached = _focus_stats_cache.get(uid)
+
+    if cached and cached[1] > time.time():
+
+        return cached[0]
+
+    res = await _safe_execute_async(
+
+        sb.table("user_focus_stats").select("streak, last_streak_date").eq("user_id", uid).maybe_single()
+
+    )
+
+    row = (res.data if res else None) or {}
+
+    _cache_focus_stats(uid, row)
+
+    return row
+
+
+
+
+
 class StartDayReq(BaseModel):
 
     plan_id: str
@@ -808,34 +945,36 @@ class FocusItemInput(BaseModel):
 # DOMAIN-BASED ITEM TYPE WHITELIST
 # =========================
 
+_NO_PRACTICE_TYPES: frozenset = frozenset()
+
 # Allowed item types per domain
 # Language domains get extended types for practice activities
 DOMAIN_ALLOWED_TYPES = {
-    "language_learning": {"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"},
-    "language": {"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"},
-    "learning": {"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"},
-    "project": {"upload_review", "checklist", "quiz"},
-    "business": {"upload_review", "checklist", "quiz"},
-    "fitness": {"lesson", "quiz", "single_select"},
-    "habits": {"lesson", "quiz", "single_select"},
-    "programming": {"lesson", "quiz", "single_select"},
-    "smart_learning": {"lesson", "quiz", "single_select", "smart_lesson"},
-    "other": {"lesson", "quiz", "single_select"},
+    "language_learning": frozenset({"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"}),
+    "language": frozenset({"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"}),
+    "learning": frozenset({"lesson", "quiz", "single_select", "practice", "cards", "flashcard", "translation", "roleplay", "dialogue", "writing"}),
+    "project": frozenset({"upload_review", "checklist", "quiz"}),
+    "business": frozenset({"upload_review", "checklist", "quiz"}),
+    "fitness": frozenset({"lesson", "quiz", "single_select"}),
+    "habits": frozenset({"lesson", "quiz", "single_select"}),
+    "programming": frozenset({"lesson", "quiz", "single_select"}),
+    "smart_learning": frozenset({"lesson", "quiz", "single_select", "smart_lesson"}),
+    "other": frozenset({"lesson", "quiz", "single_select"}),
 }
 
 # Allowed practice_types per domain
 # Language domains allow rich practice types; other domains stay restricted
 DOMAIN_ALLOWED_PRACTICE_TYPES = {
-    "language_learning": {"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"},
-    "language": {"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"},
-    "learning": {"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"},
-    "project": set(),
-    "business": set(),
-    "fitness": set(),
-    "habits": set(),
-    "programming": set(),
-    "smart_learning": set(),
-    "other": set(),
+    "language_learning": frozenset({"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"}),
+    "language": frozenset({"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"}),
+    "learning": frozenset({"translation", "exercise", "roleplay", "dialogue", "cards", "flashcard", "writing"}),
+    "project": _NO_PRACTICE_TYPES,
+    "business": _NO_PRACTICE_TYPES,
+    "fitness": _NO_PRACTICE_TYPES,
+    "habits": _NO_PRACTICE_TYPES,
+    "programming": _NO_PRACTICE_TYPES,
+    "smart_learning": _NO_PRACTICE_TYPES,
+    "other": _NO_PRACTICE_TYPES,
 }
 
 # Mapping: practice_type → canonical kind (must match llm_client.py VALID_KINDS)
@@ -868,6 +1007,16 @@ ITEM_TYPE_TO_KIND = {
 }
 
 
+def _domain_rules(domain: str) -> tuple[str, frozenset, frozenset]:
+    """(domain_lower, allowed item types, allowed practice types) - resolve once per request."""
+    domain_lower = (domain or "other").lower()
+    return (
+        domain_lower,
+        DOMAIN_ALLOWED_TYPES.get(domain_lower, DOMAIN_ALLOWED_TYPES["other"]),
+        DOMAIN_ALLOWED_PRACTICE_TYPES.get(domain_lower, _NO_PRACTICE_TYPES),
+    )
+
+
 def _normalize_item_for_domain(
     item_type: str,
     practice_type: Optional[str],
@@ -881,20 +1030,47 @@ def _normalize_item_for_domain(
     Language domains (language, language_learning) allow practice_type.
     Other domains: practice_type is forbidden.
     """
-    domain_lower = (domain or "other").lower()
+    return _normalize_item_fast(item_type, practice_type, *_domain_rules(domain))
+
+
+def _normalize_item_fast(
+    item_type: str,
+    practice_type: Optional[str],
+    domain_lower: str,
+    allowed_types: frozenset,
+    allowed_practice: frozenset,
+) -> tuple[str, Optional[str], str, dict]:
+    """_normalize_item_for_domain with the domain rules precomputed by _domain_rules()."""
     item_type_lower = (item_type or "").lower().strip()
     practice_type_lower = (practice_type or "").lower().strip()
 
-    # Get allowed types and practice types for this domain
-    allowed_types = DOMAIN_ALLOWED_TYPES.get(domain_lower, DOMAIN_ALLOWED_TYPES["other"])
-    allowed_practice = DOMAIN_ALLOWED_PRACTICE_TYPES.get(domain_lower, set())
+    normalized = _normalize_core(item_type_lower, practice_type_lower, domain_lower, allowed_types, allowed_practice)
+    if normalized is None:
+        print(f"[NORMALIZE] Blocked item_type/practice_type '{item_type_lower}/{practice_type_lower}' for domain '{domain_lower}'")
+        raise HTTPException(status_code=409, detail="task_not_allowed_for_mode")
+
+    # fresh content dict per item: it is mutable, so it stays out of the cache
+    normalized_content: dict = {}
+    return (*normalized, normalized_content)
 
+
+@functools.lru_cache(maxsize=512)
+def _normalize_core(
+    item_type_lower: str,
+    practice_type_lower: str,
+    domain_lower: str,
+    allowed_types: frozenset,
+    allowed_practice: frozenset,
+) -> Optional[tuple[str, Optional[str], str]]:
+    """
+    Pure part of _normalize_item_fast: (normalized_type, normalized_practice_type, kind),
+    or None when the domain does not allow the item (the caller raises).
+    """
     # Handle practice_type
     if practice_type_lower:
         # Check if practice_type is allowed for this domain
         if practice_type_lower not in allowed_practice:
-            print(f"[NORMALIZE] Blocked practice_type '{practice_type_lower}' for domain '{domain_lower}'")
-            raise HTTPException(status_code=409, detail="task_not_allowed_for_mode")
+            return None
 
         # For practice types, normalize item_type to "practice" or the practice_type itself
         # and determine kind from practice_type
@@ -905,10 +1081,7 @@ def _normalize_item_for_domain(
             normalized_type = item_type_lower
 
         # Get kind from practice_type mapping
-        kind = PRACTICE_TYPE_TO_KIND.get(practice_type_lower, "checklist")
-        normalized_content: dict = {}
-
-        return normalized_type, practice_type_lower, kind, normalized_content
+        return normalized_type, practice_type_lower, PRACTICE_TYPE_TO_KIND.get(practice_type_lower, "checklist")
 
     # No practice_type - handle item_type normalization
     # Normalize single_select → quiz
@@ -919,75 +1092,145 @@ def _normalize_item_for_domain(
 
     # Check if item_type is allowed for this domain
     if normalized_type not in allowed_types:
-        print(f"[NORMALIZE] Blocked item_type '{normalized_type}' for domain '{domain_lower}'")
-        raise HTTPException(status_code=409, detail="task_not_allowed_for_mode")
+        return None
 
     # Get kind from item_type mapping (or fallback to _determine_kind_from_type)
-    kind = ITEM_TYPE_TO_KIND.get(normalized_type, _determine_kind_from_type(normalized_type, None))
-    normalized_content: dict = {}
+    kind = ITEM_TYPE_TO_KIND.get(normalized_type)
+    if kind is None:
+        kind = _kind_from_lowered(normalized_type, "")
 
-    return normalized_type, None, kind, normalized_content
+    return normalized_type, None, kind
 
-def _sanitize_content_for_domain(content: dict, domain: str, item_type: str) -> dict:
 
-    """
 
-    Final sanitizer: remove language-learning patterns from non-language content.
+# Patterns that indicate language-learning content (should not appear in non-language domains)
 
-    This is the LAST LINE OF DEFENSE.
+FORBIDDEN_PATTERNS = (
+    "fordítsd le", "fordítás", "translation", "translate",
+    "ciao", "italiano", "olasz", "italian",
+    "role-play", "roleplay", "párbeszéd gyakorlat",
+    "célnyelv", "target language", "foreign language",
+    "vocabulary", "szókincs", "grammar", "nyelvtan",
+)
 
-    """
 
-    domain_lower = (domain or "other").lower()
 
+# One pass over the text for all patterns: Aho-Corasick automaton (pyahocorasick),
 
+# or a single case-insensitive alternation regex when the extension is not installed
 
-    # Language domains don't need sanitization
+# (google-re2's linear-time DFA if available, stdlib re otherwise)
 
-    if domain_lower in ("language_learning", "language", "learning"):
+try:
 
-        return content
+    import ahocorasick
 
+    _FORBIDDEN_AC = ahocorasick.Automaton()
 
+    for _p in FORBIDDEN_PATTERNS:
 
-    # Patterns that indicate language-learning content (should not appear in non-language domains)
+        _FORBIDDEN_AC.add_word(_p, _p)
 
-    FORBIDDEN_PATTERNS = [
-        "fordítsd le", "fordítás", "translation", "translate",
-        "ciao", "italiano", "olasz", "italian",
-        "role-play", "roleplay", "párbeszéd gyakorlat",
-        "célnyelv", "target language", "foreign language",
-        "vocabulary", "szókincs", "grammar", "nyelvtan",
-    ]
+    _FORBIDDEN_AC.make_automaton()
+
+except Exception:
+
+    _FORBIDDEN_AC = None
+
+
+
+try:
+
+    import re2 as _forbidden_re_engine
+
+except Exception:
+
+    _forbidden_re_engine = re
 
+# inline (?i) flag: accepted by both re and re2
 
+_FORBIDDEN_RE = _forbidden_re_engine.compile("(?i)" + "|".join(map(_forbidden_re_engine.escape, FORBIDDEN_PATTERNS)))
 
-    def contains_forbidden(text: str) -> bool:
 
-        if not text:
 
-            return False
 
-        text_lower = text.lower()
 
-        return any(pattern in text_lower for pattern in FORBIDDEN_PATTERNS)
+# shorter text cannot contain any pattern: the common empty/short-field case is a length check
+
+_FORBIDDEN_MIN_LEN = min(map(len, FORBIDDEN_PATTERNS))
+
+
+
+
+
+def _contains_forbidden(text: str) -> bool:
+
+    if not text or len(text) < _FORBIDDEN_MIN_LEN:
+
+        return False
+
+    if _FORBIDDEN_AC is not None:
+
+        return next(_FORBIDDEN_AC.iter(text.lower()), None) is not None
+
+    # case-insensitive match: no lowered copy of the text
+
+    return _FORBIDDEN_RE.search(text) is not None
+
+
+
+
+
+def _sanitize_content_for_domain(content: dict, domain: str, item_type: str) -> dict:
+
+    """
+
+    Final sanitizer: remove language-learning patterns from non-language content.
+
+    This is the LAST LINE OF DEFENSE.
+
+    """
+
+    # Nothing to scan (normalized items carry empty content)
+
+    if not content:
+
+        return content
+
+
+
+    domain_lower = (domain or "other").lower()
+
+
+
+    # Language domains don't need sanitization
+
+    if domain_lower in ("language_learning", "language", "learning"):
+
+        return content
 
 
 
     # Check and clean content fields
 
-    sanitized = dict(content)
+    # Copy-on-write: clean content (the usual case) is returned as-is, callers must not mutate it
+
+    sanitized = content
 
 
 
     # Check common text fields
 
-    for field in ["prompt", "question", "body_md", "text", "instructions"]:
+    for field in ("prompt", "question", "body_md", "text", "instructions"):
 
-        if field in sanitized and contains_forbidden(str(sanitized.get(field, ""))):
+        if field in sanitized and _contains_forbidden(str(sanitized.get(field, ""))):
 
             print(f"[DOMAIN_GUARD] Sanitizing forbidden content in field '{field}' for domain '{domain}'")
 
+            if sanitized is content:
+
+                sanitized = dict(content)
+
             # Replace with generic content based on item_type
 
             if item_type in ("quiz", "single_select"):
@@ -1002,6 +1245,7 @@ def _sanitize_content_for_domain(content: dict, domain: str, item_type: str) ->
 
 
 
+@functools.lru_cache(maxsize=256)
 def _determine_kind_from_type(item_type: str, practice_type: Optional[str] = None) -> str:
     """
     Deterministically map item type → canonical kind for UI rendering.
@@ -1017,9 +1261,14 @@ def _determine_kind_from_type(item_type: str, practice_type: Optional[str] = Non
     - "roleplay" → dialogue/roleplay practice
     - "writing" → writing prompt
     """
-    item_type_lower = (item_type or "").lower().strip()
-    practice_type_lower = (practice_type or "").lower().strip()
+    return _kind_from_lowered(
+        (item_type or "").lower().strip(),
+        (practice_type or "").lower().strip(),
+    )
+
 
+def _kind_from_lowered(item_type_lower: str, practice_type_lower: str) -> str:
+    """_determine_kind_from_type for callers that already hold lowered/stripped values."""
     # If practice_type is specified, use PRACTICE_TYPE_TO_KIND mapping
     if practice_type_lower and practice_type_lower in PRACTICE_TYPE_TO_KIND:
         return PRACTICE_TYPE_TO_KIND[practice_type_lower]
@@ -1085,6 +1334,29 @@ def _sanitize_item_row_for_insert(item_row: Dict[str, Any], order_idx: int) -> D
     return row
 
 
+_ITEM_ROW_REQUIRED_TEXT = ("day_id", "item_key", "type", "kind")
+_ITEM_ROW_NOT_NULL_TEXT = ("topic", "label")
+_ITEM_ROW_INT = ("order_index", "estimated_minutes")
+
+
+def _validate_item_row(row: Dict[str, Any]) -> None:
+    """
+    Reject a sanitized item row that focus_items would refuse (NOT NULL / type),
+    so a bad row fails here with the field name instead of failing the bulk insert.
+    """
+    for field in _ITEM_ROW_REQUIRED_TEXT:
+        value = row.get(field)
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"focus_items row {row.get('item_key')!r}: '{field}' must be a non-empty string")
+    for field in _ITEM_ROW_NOT_NULL_TEXT:
+        if not isinstance(row.get(field), str):
+            raise ValueError(f"focus_items row {row.get('item_key')!r}: '{field}' must be a string")
+    for field in _ITEM_ROW_INT:
+        value = row.get(field)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"focus_items row {row.get('item_key')!r}: '{field}' must be an integer")
+
+
 class FocusDayInput(BaseModel):
 
     dayIndex: int
@@ -1146,6 +1418,128 @@ class GetDayReq(BaseModel):
 
 
 
+# ── Default day-item templates ──
+# Built once at import; per day only item_key ("{d}" = day_index), topic ("{t}" = day_title)
+# and order_index are filled in by _render_day_items.
+
+def _item_tpl(
+    key: str,
+    type_: str,
+    kind: str,
+    practice_type: Optional[str],
+    label: str,
+    minutes: int,
+    topic: str = "{t}",
+    **extra: Any,
+) -> Dict[str, Any]:
+    return {
+        "item_key": "d{d}-" + key,
+        "type": type_,
+        "kind": kind,
+        "practice_type": practice_type,
+        "topic": topic,
+        "label": label,
+        "estimated_minutes": minutes,
+        **extra,
+    }
+
+
+NON_LATIN_LANGUAGES = frozenset({
+    "greek", "korean", "japanese", "chinese", "mandarin",
+    "arabic", "hebrew", "hindi", "thai", "russian",
+    "ukrainian", "georgian", "armenian", "bengali", "tamil",
+})
+
+# Main task rotation for the 5th block (same as frontend MAIN_TASK_ROTATION)
+MAIN_ROTATION = (
+    {"type": "flashcard", "kind": "cards",       "practice_type": None,          "label": "Kártyák"},
+    {"type": "translation","kind": "translation", "practice_type": "translation", "label": "Fordítás"},
+    {"type": "quiz",      "kind": "quiz",         "practice_type": None,          "label": "Kvíz"},
+    {"type": "roleplay",  "kind": "roleplay",     "practice_type": "roleplay",    "label": "Párbeszéd"},
+    {"type": "writing",   "kind": "writing",      "practice_type": "writing",     "label": "Fogalmazás"},
+    {"type": "roleplay",  "kind": "roleplay",     "practice_type": "roleplay",    "label": "Párbeszéd"},
+    {"type": "quiz",      "kind": "quiz",         "practice_type": None,          "label": "Ismétlés"},
+)
+
+# Foundations, non-Latin script: Hook → Pattern → Micro → Meaning (+ rotating Main block)
+_FOUNDATIONS_NON_LATIN_TEMPLATE = (
+    _item_tpl("hook", "lesson", "content", None, "Ismerkedés", 4, topic="{t} - Hook: új betűk/karakterek"),
+    _item_tpl("pattern", "lesson", "content", None, "Minta", 4, topic="{t} - Pattern: hang és betű párosítás"),
+    _item_tpl("micro", "quiz", "quiz", None, "Mini feladat", 4, topic="{t} - Micro: betű/hang felismerés"),
+    _item_tpl("meaning", "lesson", "content", None, "Jelentés", 4, topic="{t} - Meaning: első szavak jelentéssel"),
+)
+_FOUNDATIONS_MAIN_TEMPLATES = tuple(
+    _item_tpl("main", m["type"], m["kind"], m["practice_type"], m["label"], 4) for m in MAIN_ROTATION
+)
+
+# Standard foundations day (Latin script): lesson → cards → quiz → translation → roleplay
+_FOUNDATIONS_TEMPLATE = (
+    _item_tpl("lesson-1", "lesson", "content", None, "Tananyag", 6),
+    _item_tpl("cards-1", "flashcard", "cards", None, "Kártyák", 4),
+    _item_tpl("quiz-1", "quiz", "quiz", None, "Kvíz", 4),
+    _item_tpl("translation-1", "translation", "translation", "translation", "Fordítás", 4),
+    _item_tpl("roleplay-1", "roleplay", "roleplay", "roleplay", "Párbeszéd", 5),
+)
+
+# Career language track: fixed 5-item structure (25 min)
+_CAREER_TEMPLATE = (
+    _item_tpl("briefing-1", "briefing", "briefing", None, "Mai helyzet", 2),
+    _item_tpl("phrase-pack-1", "flashcard", "cards", None, "Kifejezések", 6),
+    _item_tpl("micro-drill-1", "quiz", "quiz", None, "Gyors gyakorlat", 4),
+    _item_tpl("production-1", "writing", "writing", "writing", "Szövegalkotás", 8),
+    _item_tpl("feedback-1", "feedback", "feedback", None, "Visszajelzés", 5),
+)
+
+# Smart learning domain: single smart_lesson item per day (~5 min)
+_SMART_LEARNING_TEMPLATE = (
+    _item_tpl("smart-lesson-1", "smart_lesson", "smart_lesson", None, "Napi mikro-lecke", 5),
+)
+
+_PROJECT_TEMPLATE = (
+    _item_tpl("upload-review-1", "upload_review", "upload_review", None, "Fájl ellenőrzés", 5),
+    _item_tpl("checklist-1", "checklist", "checklist", None, "Checklist", 8),
+    _item_tpl("quiz-1", "quiz", "quiz", None, "Kvíz", 4),
+)
+# Extra item for longer sessions
+_PROJECT_TEMPLATE_45 = _PROJECT_TEMPLATE + (
+    _item_tpl("practice-1", "checklist", "checklist", None, "Gyakorlat", 10),
+)
+
+# Learning domain - scale by minutes_per_day
+# 10 min: 1 short lesson + 1 quiz
+_LEARNING_10 = (
+    _item_tpl("lesson-1", "lesson", "content", None, "Tananyag", 6, content_depth="short"),  # Signal for LLM
+    _item_tpl("quiz-1", "quiz", "quiz", None, "Kvíz", 4),
+)
+# 20 min: 1 medium lesson + 2 quizzes
+_LEARNING_20 = (
+    _item_tpl("lesson-1", "lesson", "content", None, "Tananyag", 10, content_depth="medium"),
+    _item_tpl("quiz-1", "quiz", "quiz", None, "Ismétlő kvíz", 5),
+    _item_tpl("quiz-2", "quiz", "quiz", None, "Elmélyítő kvíz", 5),
+)
+# 45 min: 2 lessons (structured) + 3 quizzes + 1 practice
+_LEARNING_45 = (
+    _item_tpl("lesson-1", "lesson", "content", None, "Tananyag I.", 12, topic="{t} - Alapok", content_depth="substantial"),
+    _item_tpl("quiz-1", "quiz", "quiz", None, "Kvíz I.", 5, topic="{t} - Alapok"),
+    _item_tpl("lesson-2", "lesson", "content", None, "Tananyag II.", 12, topic="{t} - Haladó", content_depth="substantial"),
+    _item_tpl("quiz-2", "quiz", "quiz", None, "Kvíz II.", 5, topic="{t} - Haladó"),
+    _item_tpl("practice-1", "writing", "writing", "writing", "Gyakorlat", 8),
+    _item_tpl("quiz-3", "quiz", "quiz", None, "Összefoglaló kvíz", 5),
+)
+
+
+def _render_day_items(templates: Tuple[Dict[str, Any], ...], day_index: int, day_title: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "order_index": i,
+            **t,
+            "item_key": t["item_key"].format(d=day_index),
+            "topic": t["topic"].format(t=day_title),
+        }
+        for i, t in enumerate(templates)
+    ]
+
+
 def _generate_default_items_for_domain(
     domain: str,
     day_index: int,
@@ -1168,389 +1562,93 @@ def _generate_default_items_for_domain(
     minutes = settings.get("minutes_per_day", 20)
     track = settings.get("track", "")
 
-    # ── Non-Latin script detection ──
-    NON_LATIN_LANGUAGES = {
-        "greek", "korean", "japanese", "chinese", "mandarin",
-        "arabic", "hebrew", "hindi", "thai", "russian",
-        "ukrainian", "georgian", "armenian", "bengali", "tamil",
-    }
-    target_lang = (settings.get("target_language") or "").lower()
-    is_non_latin = target_lang in NON_LATIN_LANGUAGES
-
-    # Main task rotation for the 5th block (same as frontend MAIN_TASK_ROTATION)
-    MAIN_ROTATION = [
-        {"type": "flashcard", "kind": "cards",       "practice_type": None,          "label": "Kártyák"},
-        {"type": "translation","kind": "translation", "practice_type": "translation", "label": "Fordítás"},
-        {"type": "quiz",      "kind": "quiz",         "practice_type": None,          "label": "Kvíz"},
-        {"type": "roleplay",  "kind": "roleplay",     "practice_type": "roleplay",    "label": "Párbeszéd"},
-        {"type": "writing",   "kind": "writing",      "practice_type": "writing",     "label": "Fogalmazás"},
-        {"type": "roleplay",  "kind": "roleplay",     "practice_type": "roleplay",    "label": "Párbeszéd"},
-        {"type": "quiz",      "kind": "quiz",         "practice_type": None,          "label": "Ismétlés"},
-    ]
-
     # ── Foundations language track: fixed 5-item structure ──
     if track == "foundations_language":
-        # Non-Latin scripts: Hook → Pattern → Micro → Meaning → Main (all days)
-        if is_non_latin:
-            main = MAIN_ROTATION[day_index % len(MAIN_ROTATION)]
-            return [
-                {
-                    "order_index": 0,
-                    "item_key": f"d{day_index}-hook",
-                    "type": "lesson",
-                    "kind": "content",
-                    "practice_type": None,
-                    "topic": f"{day_title} - Hook: új betűk/karakterek",
-                    "label": "Ismerkedés",
-                    "estimated_minutes": 4,
-                },
-                {
-                    "order_index": 1,
-                    "item_key": f"d{day_index}-pattern",
-                    "type": "lesson",
-                    "kind": "content",
-                    "practice_type": None,
-                    "topic": f"{day_title} - Pattern: hang és betű párosítás",
-                    "label": "Minta",
-                    "estimated_minutes": 4,
-                },
-                {
-                    "order_index": 2,
-                    "item_key": f"d{day_index}-micro",
-                    "type": "quiz",
-                    "kind": "quiz",
-                    "practice_type": None,
-                    "topic": f"{day_title} - Micro: betű/hang felismerés",
-                    "label": "Mini feladat",
-                    "estimated_minutes": 4,
-                },
-                {
-                    "order_index": 3,
-                    "item_key": f"d{day_index}-meaning",
-                    "type": "lesson",
-                    "kind": "content",
-                    "practice_type": None,
-                    "topic": f"{day_title} - Meaning: első szavak jelentéssel",
-                    "label": "Jelentés",
-                    "estimated_minutes": 4,
-                },
-                {
-                    "order_index": 4,
-                    "item_key": f"d{day_index}-main",
-                    "type": main["type"],
-                    "kind": main["kind"],
-                    "practice_type": main["practice_type"],
-                    "topic": day_title,
-                    "label": main["label"],
-                    "estimated_minutes": 4,
-                },
-            ]
+        # ── Non-Latin script detection ──
+        target_lang = (settings.get("target_language") or "").lower()
+        if target_lang in NON_LATIN_LANGUAGES:
+            main = _FOUNDATIONS_MAIN_TEMPLATES[day_index % len(_FOUNDATIONS_MAIN_TEMPLATES)]
+            return _render_day_items(_FOUNDATIONS_NON_LATIN_TEMPLATE + (main,), day_index, day_title)
+        return _render_day_items(_FOUNDATIONS_TEMPLATE, day_index, day_title)
 
-        # Standard foundations day (Latin script): lesson → cards → quiz → translation → roleplay
-        return [
-            {
-                "order_index": 0,
-                "item_key": f"d{day_index}-lesson-1",
-                "type": "lesson",
-                "kind": "content",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Tananyag",
-                "estimated_minutes": 6,
-            },
-            {
-                "order_index": 1,
-                "item_key": f"d{day_index}-cards-1",
-                "type": "flashcard",
-                "kind": "cards",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Kártyák",
-                "estimated_minutes": 4,
-            },
-            {
-                "order_index": 2,
-                "item_key": f"d{day_index}-quiz-1",
-                "type": "quiz",
-                "kind": "quiz",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Kvíz",
-                "estimated_minutes": 4,
-            },
-            {
-                "order_index": 3,
-                "item_key": f"d{day_index}-translation-1",
-                "type": "translation",
-                "kind": "translation",
-                "practice_type": "translation",
-                "topic": day_title,
-                "label": "Fordítás",
-                "estimated_minutes": 4,
-            },
-            {
-                "order_index": 4,
-                "item_key": f"d{day_index}-roleplay-1",
-                "type": "roleplay",
-                "kind": "roleplay",
-                "practice_type": "roleplay",
-                "topic": day_title,
-                "label": "Párbeszéd",
-                "estimated_minutes": 5,
-            },
-        ]
-
-    # Career language track: fixed 5-item structure (25 min)
     if track == "career_language":
-        return [
-            {
-                "order_index": 0,
-                "item_key": f"d{day_index}-briefing-1",
-                "type": "briefing",
-                "kind": "briefing",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Mai helyzet",
-                "estimated_minutes": 2,
-            },
-            {
-                "order_index": 1,
-                "item_key": f"d{day_index}-phrase-pack-1",
-                "type": "flashcard",
-                "kind": "cards",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Kifejezések",
-                "estimated_minutes": 6,
-            },
-            {
-                "order_index": 2,
-                "item_key": f"d{day_index}-micro-drill-1",
-                "type": "quiz",
-                "kind": "quiz",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Gyors gyakorlat",
-                "estimated_minutes": 4,
-            },
-            {
-                "order_index": 3,
-                "item_key": f"d{day_index}-production-1",
-                "type": "writing",
-                "kind": "writing",
-                "practice_type": "writing",
-                "topic": day_title,
-                "label": "Szövegalkotás",
-                "estimated_minutes": 8,
-            },
-            {
-                "order_index": 4,
-                "item_key": f"d{day_index}-feedback-1",
-                "type": "feedback",
-                "kind": "feedback",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Visszajelzés",
-                "estimated_minutes": 5,
-            },
-        ]
+        return _render_day_items(_CAREER_TEMPLATE, day_index, day_title)
 
-    # Smart learning domain: single smart_lesson item per day (~5 min)
     if domain_lower == "smart_learning":
-        return [
-            {
-                "order_index": 0,
-                "item_key": f"d{day_index}-smart-lesson-1",
-                "type": "smart_lesson",
-                "kind": "smart_lesson",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Napi mikro-lecke",
-                "estimated_minutes": 5,
-            },
-        ]
+        return _render_day_items(_SMART_LEARNING_TEMPLATE, day_index, day_title)
 
     if domain_lower in ("project", "business"):
-        items = [
-            {
-                "order_index": 0,
-                "item_key": f"d{day_index}-upload-review-1",
-                "type": "upload_review",
-                "kind": "upload_review",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Fájl ellenőrzés",
-                "estimated_minutes": 5,
-            },
-            {
-                "order_index": 1,
-                "item_key": f"d{day_index}-checklist-1",
-                "type": "checklist",
-                "kind": "checklist",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Checklist",
-                "estimated_minutes": 8,
-            },
-            {
-                "order_index": 2,
-                "item_key": f"d{day_index}-quiz-1",
-                "type": "quiz",
-                "kind": "quiz",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Kvíz",
-                "estimated_minutes": 4,
-            },
-        ]
-        # Add extra items for longer sessions
-        if minutes >= 45:
-            items.append({
-                "order_index": 3,
-                "item_key": f"d{day_index}-practice-1",
-                "type": "checklist",
-                "kind": "checklist",
-                "practice_type": None,
-                "topic": day_title,
-                "label": "Gyakorlat",
-                "estimated_minutes": 10,
-            })
-        return items
-
-    # Learning domain - scale by minutes_per_day
-    items = []
-    order = 0
+        return _render_day_items(_PROJECT_TEMPLATE_45 if minutes >= 45 else _PROJECT_TEMPLATE, day_index, day_title)
 
     if minutes <= 10:
-        # 10 min: 1 short lesson + 1 quiz
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-lesson-1",
-            "type": "lesson",
-            "kind": "content",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Tananyag",
-            "estimated_minutes": 6,
-            "content_depth": "short",  # Signal for LLM
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-1",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Kvíz",
-            "estimated_minutes": 4,
-        })
+        templates = _LEARNING_10
     elif minutes <= 20:
-        # 20 min: 1 medium lesson + 2 quizzes
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-lesson-1",
-            "type": "lesson",
-            "kind": "content",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Tananyag",
-            "estimated_minutes": 10,
-            "content_depth": "medium",
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-1",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Ismétlő kvíz",
-            "estimated_minutes": 5,
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-2",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Elmélyítő kvíz",
-            "estimated_minutes": 5,
-        })
+        templates = _LEARNING_20
     else:
-        # 45 min: 2 lessons (structured) + 3 quizzes + 1 practice
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-lesson-1",
-            "type": "lesson",
-            "kind": "content",
-            "practice_type": None,
-            "topic": f"{day_title} - Alapok",
-            "label": "Tananyag I.",
-            "estimated_minutes": 12,
-            "content_depth": "substantial",
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-1",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": f"{day_title} - Alapok",
-            "label": "Kvíz I.",
-            "estimated_minutes": 5,
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-lesson-2",
-            "type": "lesson",
-            "kind": "content",
-            "practice_type": None,
-            "topic": f"{day_title} - Haladó",
-            "label": "Tananyag II.",
-            "estimated_minutes": 12,
-            "content_depth": "substantial",
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-2",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": f"{day_title} - Haladó",
-            "label": "Kvíz II.",
-            "estimated_minutes": 5,
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-practice-1",
-            "type": "writing",
-            "kind": "writing",
-            "practice_type": "writing",
-            "topic": day_title,
-            "label": "Gyakorlat",
-            "estimated_minutes": 8,
-        })
-        order += 1
-        items.append({
-            "order_index": order,
-            "item_key": f"d{day_index}-quiz-3",
-            "type": "quiz",
-            "kind": "quiz",
-            "practice_type": None,
-            "topic": day_title,
-            "label": "Összefoglaló kvíz",
-            "estimated_minutes": 5,
-        })
+        templates = _LEARNING_45
+    return _render_day_items(templates, day_index, day_title)
+
+
+# check_existing_plan(p_uid, p_title) SQL function (docs/database-schema.sql):
+# plan lookup + days count in one round trip. Disabled on first "function not found".
+_check_existing_plan_rpc = True
+
+
+async def _find_existing_plan(sb: Client, uid: str, title: str) -> Optional[Tuple[str, int]]:
+    """(plan_id, days_count) of the user's active plan with this title, or None."""
+    global _check_existing_plan_rpc
+
+    if _check_existing_plan_rpc:
+        try:
+            res = await asyncio.to_thread(
+                sb.rpc("check_existing_plan", {"p_uid": uid, "p_title": title}).execute
+            )
+            rows = res.data or []
+            return (rows[0]["id"], rows[0]["days_count"]) if rows else None
+        except Exception as rpc_err:
+            if "PGRST202" not in str(rpc_err):
+                raise
+            print("[create-plan] check_existing_plan RPC not deployed, using two-query lookup")
+            _check_existing_plan_rpc = False
+
+    existing_plan = await _safe_execute_async(
+        sb.table("focus_plans")
+        .select("id")
+        .eq("user_id", uid)
+        .eq("status", "active")
+        .eq("title", title)
+        .maybe_single()
+    )
+    if not (existing_plan and existing_plan.data):
+        return None
+
+    # Count days for this plan
+    days_count_res = await asyncio.to_thread(
+        sb.table("focus_days").select("id", count="exact").eq("plan_id", existing_plan.data["id"]).execute
+    )
+    days_count = days_count_res.count if hasattr(days_count_res, 'count') else len(days_count_res.data or [])
+    return existing_plan.data["id"], days_count
+
+
+def _uuids(n: int) -> List[str]:
+    """n random (version 4) UUID strings from a single os.urandom call."""
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i : i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+
+def _insert_plan_row(sb: Client, plan_row: Dict[str, Any], settings: Dict[str, Any]) -> None:
+    # Try to insert with settings column (may not exist yet)
+    try:
+        plan_row_with_settings = {**plan_row, "settings": settings}
+        sb.table("focus_plans").insert(plan_row_with_settings).execute()
+    except Exception as insert_err:
+        if "PGRST204" in str(insert_err) or "settings" in str(insert_err).lower():
+            # Settings column doesn't exist yet - insert without it
+            print(f"[create-plan] Settings column not found, inserting without settings")
+            sb.table("focus_plans").insert(plan_row).execute()
+        else:
+            raise
 
-    return items
 
 @router.post("/create-plan")
 
@@ -1576,16 +1674,20 @@ async def create_plan(req: CreatePlanReq, request: Request):
 
     """
 
-    # Debug: log incoming payload (safe - no PII)
-    print(f"[create-plan] === INCOMING REQUEST ===")
-    print(f"  title={req.title}")
-    print(f"  domain={req.domain}")
-    print(f"  level={req.level}")
-    print(f"  mode={req.mode}")
-    print(f"  minutes_per_day={req.minutes_per_day}")
-    print(f"  days_count={len(req.days)}")
-    for i, d in enumerate(req.days):
-        print(f"  day[{i}]: dayIndex={d.dayIndex}, title={d.title[:50] if d.title else 'N/A'}, intro={d.intro[:30] if d.intro else 'N/A'}..., items_count={len(d.items)}")
+    # Debug: log incoming payload (safe - no PII) - one write for the whole block
+    print("\n".join([
+        "[create-plan] === INCOMING REQUEST ===",
+        f"  title={req.title}",
+        f"  domain={req.domain}",
+        f"  level={req.level}",
+        f"  mode={req.mode}",
+        f"  minutes_per_day={req.minutes_per_day}",
+        f"  days_count={len(req.days)}",
+        *(
+            f"  day[{i}]: dayIndex={d.dayIndex}, title={d.title[:50] if d.title else 'N/A'}, intro={d.intro[:30] if d.intro else 'N/A'}..., items_count={len(d.items)}"
+            for i, d in enumerate(req.days)
+        ),
+    ]))
 
     try:
         uid = await get_user_id(request)
@@ -1598,23 +1700,14 @@ async def create_plan(req: CreatePlanReq, request: Request):
         # IDEMPOTENCY CHECK: If there's an active plan with same title, return it
         # UNLESS force_new=True (user explicitly wants fresh start)
         if not req.force_new:
-            existing_plan = _safe_execute(
-                sb.table("focus_plans")
-                .select("id, title, domain, level, lang, status")
-                .eq("user_id", uid)
-                .eq("status", "active")
-                .eq("title", req.title)
-                .maybe_single()
-            )
+            existing = await _find_existing_plan(sb, uid, req.title)
 
-            if existing_plan and existing_plan.data:
-                # Count days for this plan
-                days_count_res = sb.table("focus_days").select("id", count="exact").eq("plan_id", existing_plan.data["id"]).execute()
-                days_count = days_count_res.count if hasattr(days_count_res, 'count') else len(days_count_res.data or [])
-                print(f"[create-plan] IDEMPOTENT: returning existing plan {existing_plan.data['id']} for user {uid}")
+            if existing:
+                existing_plan_id, days_count = existing
+                print(f"[create-plan] IDEMPOTENT: returning existing plan {existing_plan_id} for user {uid}")
                 return {
                     "ok": True,
-                    "plan_id": existing_plan.data["id"],
+                    "plan_id": existing_plan_id,
                     "days_count": days_count,
                     "idempotent": True,
                     "message": "Returned existing active plan with same title"
@@ -1623,14 +1716,14 @@ async def create_plan(req: CreatePlanReq, request: Request):
             print(f"[create-plan] force_new=True, skipping idempotency check")
 
         # 1) Archive any existing active plan for this user
-        sb.table("focus_plans").update({
-            "status": "archived",
-            "updated_at": datetime.utcnow().isoformat() + "Z"
-        }).eq("user_id", uid).eq("status", "active").execute()
-
         # 2) Create focus_plan
+        # Both run concurrently below: the archive excludes the new plan_id, so order doesn't matter
         plan_id = str(uuid.uuid4())
-        now_iso = datetime.utcnow().isoformat() + "Z"
+        now_iso = _iso_utc_now()
+        archive_query = sb.table("focus_plans").update({
+            "status": "archived",
+            "updated_at": now_iso
+        }).eq("user_id", uid).eq("status", "active").neq("id", plan_id)
 
         # Build settings JSON for wizard preferences + track system
         settings = {
@@ -1659,22 +1752,15 @@ async def create_plan(req: CreatePlanReq, request: Request):
             "updated_at": now_iso,
         }
 
-        # Try to insert with settings column (may not exist yet)
-        try:
-            plan_row_with_settings = {**plan_row, "settings": settings}
-            sb.table("focus_plans").insert(plan_row_with_settings).execute()
-        except Exception as insert_err:
-            if "PGRST204" in str(insert_err) or "settings" in str(insert_err).lower():
-                # Settings column doesn't exist yet - insert without it
-                print(f"[create-plan] Settings column not found, inserting without settings")
-                sb.table("focus_plans").insert(plan_row).execute()
-            else:
-                raise
-
-        # 3) Create focus_days + focus_items
-        total_items_created = 0
-        for day_input in req.days:
-            day_id = str(uuid.uuid4())
+        # 3) Build focus_days + focus_items rows (validated before anything is written:
+        #    a bad row must not leave the previous plan archived and the new one without days)
+        domain_rules = _domain_rules(req.domain)
+        # Fixed-structure tracks ALWAYS use backend defaults (ignore frontend syllabus items)
+        fixed_track = settings.get("track", "") in ("foundations_language", "career_language")
+        # rows are collected for the whole plan and inserted in bulk below (one round trip per table)
+        day_rows: List[Dict[str, Any]] = []
+        item_rows: List[Dict[str, Any]] = []
+        for day_input, day_id in zip(req.days, _uuids(len(req.days))):
             day_row = {
                 "id": day_id,
                 "plan_id": plan_id,
@@ -1683,21 +1769,18 @@ async def create_plan(req: CreatePlanReq, request: Request):
                 "started_at": None,
                 "completed_at": None,
             }
-            sb.table("focus_days").insert(day_row).execute()
+            day_rows.append(day_row)
 
             # ITEMS-OPTIONAL: If items missing/empty, generate defaults
-            # Fixed-structure tracks ALWAYS use backend defaults (ignore frontend syllabus items)
-            fixed_track = settings.get("track", "") in ("foundations_language", "career_language")
             items_to_create = []
             if day_input.items and len(day_input.items) > 0 and not fixed_track:
                 # Frontend provided items - use them (with domain normalization)
                 for idx, item_input in enumerate(day_input.items):
                     # Normalize item type/practice_type for domain
-                    normalized_type, normalized_practice_type, normalized_kind, normalized_content = _normalize_item_for_domain(
-                        item_type=item_input.type,
-                        practice_type=item_input.practiceType,
-                        domain=req.domain,
-                        topic=item_input.topic,
+                    normalized_type, normalized_practice_type, normalized_kind, normalized_content = _normalize_item_fast(
+                        item_input.type,
+                        item_input.practiceType,
+                        *domain_rules,
                     )
 
                     # Sanitize content as final defense
@@ -1705,7 +1788,6 @@ async def create_plan(req: CreatePlanReq, request: Request):
                         normalized_content = _sanitize_content_for_domain(normalized_content, req.domain, normalized_type)
 
                     item_row = {
-                        "id": str(uuid.uuid4()),
                         "day_id": day_id,
                         "order_index": idx,
                         "item_key": item_input.itemKey,
@@ -1724,11 +1806,11 @@ async def create_plan(req: CreatePlanReq, request: Request):
                         item_row["content"] = normalized_content
 
                     items_to_create.append(item_row)
-                    print(f"[create-plan] Item from frontend: {item_input.type}/{item_input.practiceType} -> {normalized_type}/{normalized_practice_type} (kind={normalized_kind})")
+                source = "frontend"
             else:
                 # NO ITEMS from frontend (or fixed-structure track override) - generate default items server-side
                 reason = "fixed-structure track override" if fixed_track else "no items from frontend"
-                print(f"[create-plan] Day {day_input.dayIndex}: {reason} - generating defaults for domain '{req.domain}', track='{settings.get('track', '')}'")
+                source = f"defaults: {reason}, domain='{req.domain}', track='{settings.get('track', '')}'"
 
                 default_items = _generate_default_items_for_domain(
                     domain=req.domain,
@@ -1738,40 +1820,63 @@ async def create_plan(req: CreatePlanReq, request: Request):
                 )
                 for item_template in default_items:
                     item_row = {
-                        "id": str(uuid.uuid4()),
                         "day_id": day_id,
                         **item_template,
                     }
                     items_to_create.append(item_row)
-                    print(f"[create-plan] Generated default item: {item_template['type']}/{item_template.get('practice_type')} (kind={item_template['kind']})")
-
-            # Insert all items for this day
-            for idx, item_row in enumerate(items_to_create):
-                # Sanitize before insert - ensures all NOT NULL fields have values
-                sanitized_row = _sanitize_item_row_for_insert(item_row, idx)
-
-                # Log item details before insert (for debugging)
-                print(f"[create-plan] INSERT item: item_key={sanitized_row.get('item_key')}, type={sanitized_row.get('type')}, kind={sanitized_row.get('kind')}, order_index={sanitized_row.get('order_index')}")
-
-                try:
-                    sb.table("focus_items").insert(sanitized_row).execute()
-                    total_items_created += 1
-                except Exception as insert_err:
-                    # Log detailed error for debugging
-                    err_str = str(insert_err)
-                    print(f"[create-plan] ITEM INSERT FAILED: {err_str}")
-                    print(f"[create-plan] Failed item_row keys: {list(sanitized_row.keys())}")
-                    print(f"[create-plan] Failed item_row values: item_key={sanitized_row.get('item_key')!r}, type={sanitized_row.get('type')!r}, kind={sanitized_row.get('kind')!r}")
-
-                    # Check for common Postgres error codes
-                    if "23502" in err_str:
-                        print(f"[create-plan] ERROR TYPE: NOT NULL violation (23502)")
-                    elif "23505" in err_str:
-                        print(f"[create-plan] ERROR TYPE: Unique constraint violation (23505)")
-                    elif "PGRST" in err_str:
-                        print(f"[create-plan] ERROR TYPE: PostgREST schema error")
-
-                    raise  # Re-raise to be caught by outer exception handler
+
+            # Sanitize before insert - ensures all NOT NULL fields have values
+            day_item_rows = [_sanitize_item_row_for_insert(item_row, idx) for idx, item_row in enumerate(items_to_create)]
+            for row in day_item_rows:
+                _validate_item_row(row)
+            item_rows.extend(day_item_rows)
+
+            # one summary line per day instead of one per item
+            items_summary = ", ".join(
+                f"{r.get('item_key')}:{r.get('type')}/{r.get('practice_type')}->{r.get('kind')}" for r in day_item_rows
+            )
+            print(f"[create-plan] Day {day_input.dayIndex}: {len(day_item_rows)} items ({source}) [{items_summary}]")
+
+        for item_row, item_id in zip(item_rows, _uuids(len(item_rows))):
+            item_row["id"] = item_id
+
+        await asyncio.gather(
+            asyncio.to_thread(archive_query.execute),
+            asyncio.to_thread(_insert_plan_row, sb, plan_row, settings),
+        )
+
+        # 4) Insert focus_days + focus_items
+        if day_rows:
+            await asyncio.to_thread(sb.table("focus_days").insert(day_rows).execute)
+
+        # PostgREST bulk insert needs identical keys per row: one insert per key shape
+        # (usually a single group; optional columns like content_depth split it)
+        item_groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in item_rows:
+            item_groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        total_items_created = 0
+        for group_keys, group_rows in item_groups.items():
+            try:
+                await asyncio.to_thread(sb.table("focus_items").insert(group_rows).execute)
+                total_items_created += len(group_rows)
+            except Exception as insert_err:
+                # Log detailed error for debugging (row details only on the failure path)
+                err_str = str(insert_err)
+                print(f"[create-plan] ITEM INSERT FAILED ({len(group_rows)} rows): {err_str}")
+                print(f"[create-plan] Failed item_row keys: {list(group_keys)}")
+                for failed_row in group_rows:
+                    print(f"[create-plan] Failed item_row values: item_key={failed_row.get('item_key')!r}, type={failed_row.get('type')!r}, kind={failed_row.get('kind')!r}")
+
+                # Check for common Postgres error codes
+                if "23502" in err_str:
+                    print(f"[create-plan] ERROR TYPE: NOT NULL violation (23502)")
+                elif "23505" in err_str:
+                    print(f"[create-plan] ERROR TYPE: Unique constraint violation (23505)")
+                elif "PGRST" in err_str:
+                    print(f"[create-plan] ERROR TYPE: PostgREST schema error")
+
+                raise  # Re-raise to be caught by outer exception handler
 
         print(f"[create-plan] SUCCESS: plan_id={plan_id}, days={len(req.days)}, items={total_items_created}")
         return {"ok": True, "plan_id": plan_id, "days_count": len(req.days), "items_created": total_items_created}
@@ -1818,7 +1923,7 @@ async def get_active(request: Request):
 
     # 1) Find active plan
 
-    plan_res = _safe_execute(
+    plan_res = await _safe_execute_async(
 
         sb.table("focus_plans")
 
@@ -1840,7 +1945,7 @@ async def get_active(request: Request):
 
         # No active plan
 
-        stats = _safe_execute(sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single())
+        stats = await _get_focus_stats(sb, uid)
 
         return {
 
@@ -1852,7 +1957,7 @@ async def get_active(request: Request):
 
             "current_day": None,
 
-            "streak": ((stats.data if stats else None) or {}).get("streak", 0),
+            "streak": stats.get("streak", 0),
 
         }
 
@@ -1962,103 +2067,192 @@ async def get_active(request: Request):
 
     # 4) Streak
 
-    stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
+    stats = await _get_focus_stats(sb, uid)
 
 
 
     return {
 
-        "ok": True,
+        "ok": True,
+
+        "has_active_plan": True,
+
+        "plan": plan,
+
+        "days": days,
+
+        "current_day": current_day,
+
+        "current_day_items": day_items,
+
+        "completed_days": completed_days,
+
+        "total_days": len(days),
+
+        "streak": stats.get("streak", 0),
+
+    }
+
+
+
+
+
+# get_day_with_status(p_plan, p_day, p_user, p_today) SQL function (docs/database-schema.sql):
+# ownership + day + status + items/progress in one round trip. Disabled on first "function not found".
+_get_day_with_status_rpc = True
+
+
+def _locked_day_response(day: Dict[str, Any], day_status: str) -> Dict[str, Any]:
+    return {
+        "ok": False,
+        "status": day_status,
+        "day": {
+            "id": day["id"],
+            "day_index": day.get("day_index"),
+            "title": day.get("title"),
+            "started_at": day.get("started_at"),
+            "completed_at": day.get("completed_at"),
+        },
+        "items": [],
+        "reason": "Day is locked. Start the day first (or wait until tomorrow).",
+    }
+
+
+@router.post("/get-day")
+
+async def get_day(req: GetDayReq, request: Request):
+
+    """
+
+    Get a specific day with items, progress, and status for the current user.
+
+    Status can be: locked, in_progress, completed, available, locked_until_tomorrow
+
+
+
+    IMPORTANT: If day is locked, we do NOT return items - this prevents
+
+    users from completing the entire week in one day.
+
+    """
+
+    uid = await get_user_id(request)
+
+    sb = _require_admin()
+
+
+
+    today = today_local_iso()
+
+
+
+    global _get_day_with_status_rpc
+
+    if _get_day_with_status_rpc:
+
+        try:
+
+            res = await asyncio.to_thread(
+
+                sb.rpc(
 
-        "has_active_plan": True,
+                    "get_day_with_status",
 
-        "plan": plan,
+                    {"p_plan": req.plan_id, "p_day": req.day_index, "p_user": uid, "p_today": today},
 
-        "days": days,
+                ).execute
 
-        "current_day": current_day,
+            )
 
-        "current_day_items": day_items,
+        except Exception as rpc_err:
 
-        "completed_days": completed_days,
+            if "PGRST202" not in str(rpc_err):
 
-        "total_days": len(days),
+                raise
 
-        "streak": (stats.data or {}).get("streak", 0),
+            print("[get-day] get_day_with_status RPC not deployed, using table selects")
 
-    }
+            _get_day_with_status_rpc = False
 
+        else:
 
+            data = res.data
 
+            if not data:
 
+                raise HTTPException(status_code=404, detail="Plan not found")
 
-@router.post("/get-day")
+            day = data.get("day")
 
-async def get_day(req: GetDayReq, request: Request):
+            if not day:
 
-    """
+                raise HTTPException(status_code=404, detail="Day not found")
 
-    Get a specific day with items, progress, and status for the current user.
+            if data["status"] not in ("in_progress", "completed"):
 
-    Status can be: locked, in_progress, completed, available, locked_until_tomorrow
+                return _locked_day_response(day, data["status"])
 
+            # progress_summary counts come from the SQL aggregate, not a pass over items
 
+            return {
 
-    IMPORTANT: If day is locked, we do NOT return items - this prevents
+                "ok": True,
 
-    users from completing the entire week in one day.
+                "day": day,
 
-    """
+                "items": data.get("items") or [],
 
-    uid = await get_user_id(request)
+                "status": data["status"],
 
-    sb = _require_admin()
+                "progress_summary": data.get("progress_summary") or {"completed_items": 0, "total_items": 0},
 
+            }
 
 
-    today = today_local_iso()
 
+    # Fallback: same checks with table selects
 
+    # 1) Verify plan belongs to user + 2) get ALL days to determine status (concurrently)
 
-    # 1) Verify plan belongs to user
+    plan, all_days_res = await asyncio.gather(
 
-    plan = (
+        asyncio.to_thread(
 
-        sb.table("focus_plans")
+            sb.table("focus_plans")
 
-        .select("*")
+            .select("*")
 
-        .eq("id", req.plan_id)
+            .eq("id", req.plan_id)
 
-        .eq("user_id", uid)
+            .eq("user_id", uid)
 
-        .maybe_single()
+            .maybe_single()
 
-        .execute()
+            .execute
 
-    )
+        ),
 
-    if not plan.data:
+        asyncio.to_thread(
 
-        raise HTTPException(status_code=404, detail="Plan not found")
+            sb.table("focus_days")
 
+            .select("*")
 
+            .eq("plan_id", req.plan_id)
 
-    # 2) Get ALL days to determine status
+            .order("day_index", desc=False)
 
-    all_days_res = (
+            .execute
 
-        sb.table("focus_days")
+        ),
 
-        .select("*")
+    )
 
-        .eq("plan_id", req.plan_id)
+    if not plan.data:
 
-        .order("day_index", desc=False)
+        raise HTTPException(status_code=404, detail="Plan not found")
 
-        .execute()
 
-    )
 
     all_days = all_days_res.data or []
 
@@ -2164,37 +2358,13 @@ async def get_day(req: GetDayReq, request: Request):
 
     if day_status not in allowed_statuses:
 
-        return {
-
-            "ok": False,
-
-            "status": day_status,
-
-            "day": {
-
-                "id": day["id"],
-
-                "day_index": day.get("day_index"),
-
-                "title": day.get("title"),
-
-                "started_at": day.get("started_at"),
-
-                "completed_at": day.get("completed_at"),
-
-            },
-
-            "items": [],
-
-            "reason": "Day is locked. Start the day first (or wait until tomorrow).",
-
-        }
+        return _locked_day_response(day, day_status)
 
 
 
     # 5) Get items for this day (only if allowed)
 
-    items_res = (
+    items_res = await asyncio.to_thread(
 
         sb.table("focus_items")
 
@@ -2204,7 +2374,7 @@ async def get_day(req: GetDayReq, request: Request):
 
         .order("order_index", desc=False)
 
-        .execute()
+        .execute
 
     )
 
@@ -2220,7 +2390,7 @@ async def get_day(req: GetDayReq, request: Request):
 
     if item_ids:
 
-        progress_res = (
+        progress_res = await asyncio.to_thread(
 
             sb.table("focus_item_progress")
 
@@ -2230,7 +2400,7 @@ async def get_day(req: GetDayReq, request: Request):
 
             .in_("item_id", item_ids)
 
-            .execute()
+            .execute
 
         )
 
@@ -2294,11 +2464,11 @@ async def get_stats(request: Request):
 
 
 
-    stats = _safe_execute(sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single())
+    stats = await _get_focus_stats(sb, uid)
 
 
 
-    if not stats or not stats.data:
+    if not stats:
 
         return {
 
@@ -2316,9 +2486,9 @@ async def get_stats(request: Request):
 
         "ok": True,
 
-        "streak": stats.data.get("streak", 0),
+        "streak": stats.get("streak", 0),
 
-        "last_streak_date": stats.data.get("last_streak_date"),
+        "last_streak_date": stats.get("last_streak_date"),
 
     }
 
@@ -2326,6 +2496,11 @@ async def get_stats(request: Request):
 
 
 
+# start_next_day(p_plan, p_user, p_today) SQL function (docs/database-schema.sql):
+# decide + start the next day in one UPDATE ... RETURNING. Disabled on first "function not found".
+_start_next_day_rpc = True
+
+
 @router.post("/start-day")
 
 async def start_day(req: StartDayReq, request: Request):
@@ -2350,6 +2525,86 @@ async def start_day(req: StartDayReq, request: Request):
 
 
 
+    today = today_local_iso()
+
+
+
+    global _start_next_day_rpc
+
+    if _start_next_day_rpc:
+
+        try:
+
+            res = await asyncio.to_thread(
+
+                sb.rpc(
+
+                    "start_next_day",
+
+                    {"p_plan": req.plan_id, "p_user": uid, "p_today": today},
+
+                ).execute
+
+            )
+
+        except Exception as rpc_err:
+
+            if "PGRST202" not in str(rpc_err):
+
+                raise
+
+            print("[start-day] start_next_day RPC not deployed, using select + update")
+
+            _start_next_day_rpc = False
+
+        else:
+
+            data = res.data
+
+            if not data:
+
+                raise HTTPException(status_code=404, detail="Plan not found")
+
+            if not data.get("has_days"):
+
+                raise HTTPException(status_code=400, detail="Plan has no days")
+
+            if data.get("in_progress"):
+
+                return {"ok": True, "plan_id": req.plan_id, "day": data["in_progress"], "status": "in_progress"}
+
+            if data.get("completed_today"):
+
+                stats = await _get_focus_stats(sb, uid)
+
+                return {
+
+                    "ok": True,
+
+                    "plan_id": req.plan_id,
+
+                    "day": data["completed_today"],
+
+                    "already_completed_today": True,
+
+                    "streak": stats.get("streak", 0),
+
+                    "message": "You already completed today's learning. Come back tomorrow!"
+
+                }
+
+            day = data.get("started") or data.get("next_pending")
+
+            if not day:
+
+                return {"ok": True, "plan_id": req.plan_id, "day": None, "done": True}
+
+            return {"ok": True, "plan_id": req.plan_id, "day": day, "status": "started"}
+
+
+
+    # Fallback: select all days, decide in Python, then update
+
     # Ensure plan belongs to user
 
     plan = sb.table("focus_plans").select("*").eq("id", req.plan_id).eq("user_id", uid).maybe_single().execute()
@@ -2360,10 +2615,6 @@ async def start_day(req: StartDayReq, request: Request):
 
 
 
-    today = today_local_iso()
-
-
-
     # 1) Check if user already completed a day TODAY
 
     all_days = (
@@ -2448,7 +2699,7 @@ async def start_day(req: StartDayReq, request: Request):
 
     if completed_today:
 
-        stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
+        stats = await _get_focus_stats(sb, uid)
 
         return {
 
@@ -2460,7 +2711,7 @@ async def start_day(req: StartDayReq, request: Request):
 
             "already_completed_today": True,
 
-            "streak": (stats.data or {}).get("streak", 0),
+            "streak": stats.get("streak", 0),
 
             "message": "You already completed today's learning. Come back tomorrow!"
 
@@ -2478,7 +2729,7 @@ async def start_day(req: StartDayReq, request: Request):
 
     # 5) Start the next day
 
-    now = datetime.utcnow().isoformat() + "Z"
+    now = _iso_utc_now()
 
     upd = (
 
@@ -2500,6 +2751,11 @@ async def start_day(req: StartDayReq, request: Request):
 
 
 
+# upsert_focus_progress(p_user, p_item, p_status, p_score, p_result) SQL function (docs/database-schema.sql):
+# INSERT ... ON CONFLICT (user_id, item_id) with attempts + 1. Disabled on first "function not found".
+_upsert_focus_progress_rpc = True
+
+
 @router.post("/complete-item")
 
 async def complete_item(req: CompleteItemReq, request: Request):
@@ -2553,7 +2809,7 @@ async def complete_item(req: CompleteItemReq, request: Request):
 
         # Low-effort filter: reject trivial inputs that bypass validation
 
-        if user_input and user_input.lower() in LOW_EFFORT_RESPONSES:
+        if user_input and is_low_effort(user_input):
 
             raise HTTPException(
 
@@ -2567,23 +2823,19 @@ async def complete_item(req: CompleteItemReq, request: Request):
 
         # Hard rules by practice_type (MVP-level strictness)
 
-        if practice_type == "writing":
+        rule = PRACTICE_RULES.get(practice_type)
 
-            if len(user_input) < 40:
+        if rule:
 
-                raise HTTPException(422, "Interaction required: write at least 40 characters")
+            min_chars, min_items, message = rule
 
-        elif practice_type == "translation":
+            if len(user_input) < min_chars or (
 
-            if not isinstance(user_items, list) or len(user_items) < 1:
+                min_items and (not isinstance(user_items, list) or len(user_items) < min_items)
 
-                raise HTTPException(422, "Interaction required: submit at least 1 translation")
+            ):
 
-        elif practice_type in ("exercise", "roleplay"):
-
-            if len(user_input) < 15:
-
-                raise HTTPException(422, "Interaction required: send at least 15 characters")
+                raise HTTPException(422, message)
 
 
 
@@ -2637,6 +2889,52 @@ async def complete_item(req: CompleteItemReq, request: Request):
 
     # upsert progress
 
+    global _upsert_focus_progress_rpc
+
+    if _upsert_focus_progress_rpc:
+
+        try:
+
+            res = await asyncio.to_thread(
+
+                sb.rpc(
+
+                    "upsert_focus_progress",
+
+                    {
+
+                        "p_user": uid,
+
+                        "p_item": req.item_id,
+
+                        "p_status": req.status,
+
+                        "p_score": req.score,
+
+                        "p_result": req.result_json,
+
+                    },
+
+                ).execute
+
+            )
+
+        except Exception as rpc_err:
+
+            if "PGRST202" not in str(rpc_err):
+
+                raise
+
+            print("[complete-item] upsert_focus_progress RPC not deployed, using select + update/insert")
+
+            _upsert_focus_progress_rpc = False
+
+        else:
+
+            return {"ok": True, "progress": res.data[0] if res.data else None}
+
+
+
     existing = (
 
         sb.table("focus_item_progress")
@@ -2667,7 +2965,7 @@ async def complete_item(req: CompleteItemReq, request: Request):
 
         "last_result_json": req.result_json,
 
-        "updated_at": datetime.utcnow().isoformat() + "Z",
+        "updated_at": _iso_utc_now(),
 
     }
 
@@ -2725,38 +3023,56 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     # Step 1: Verify plan belongs to user (simple select, no join)
 
-    plan_res = _safe_execute(
+    # user_focus_stats is read once, alongside it, and reused by every return branch below
 
-        sb.table("focus_plans").select("id, user_id").eq("id", req.plan_id).maybe_single()
+    # the day select (Step 2) does not depend on it either, so all three run concurrently
 
-    )
+    plan_res, stats_res, day_res = await asyncio.gather(
 
-    if not plan_res or not plan_res.data:
+        _safe_execute_async(
 
-        raise HTTPException(status_code=404, detail="Plan not found")
+            sb.table("focus_plans").select("id, user_id").eq("id", req.plan_id).maybe_single()
 
-    if plan_res.data.get("user_id") != uid:
+        ),
 
-        raise HTTPException(status_code=403, detail="Not your plan")
+        _safe_execute_async(
 
+            sb.table("user_focus_stats").select("streak, last_streak_date").eq("user_id", uid).maybe_single()
 
+        ),
 
-    # Step 2: Get day (simple select)
+        _safe_execute_async(
 
-    day_res = _safe_execute(
+            sb.table("focus_days")
 
-        sb.table("focus_days")
+            .select("*")
 
-        .select("*")
+            .eq("plan_id", req.plan_id)
 
-        .eq("plan_id", req.plan_id)
+            .eq("day_index", req.day_index)
 
-        .eq("day_index", req.day_index)
+            .maybe_single()
 
-        .maybe_single()
+        ),
 
     )
 
+    stats_row = (stats_res.data if stats_res else None) or {}
+
+    cached_streak = stats_row.get("streak", 0)
+
+    if not plan_res or not plan_res.data:
+
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    if plan_res.data.get("user_id") != uid:
+
+        raise HTTPException(status_code=403, detail="Not your plan")
+
+
+
+    # Step 2: Day (fetched above, checked only after ownership)
+
     if not day_res or not day_res.data:
 
         raise HTTPException(status_code=404, detail="Day not found")
@@ -2769,9 +3085,7 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     if day.data.get("completed_at") is not None:
 
-        stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
-
-        return {"ok": True, "already_completed": True, "streak": (stats.data or {}).get("streak", 0)}
+        return {"ok": True, "already_completed": True, "streak": cached_streak}
 
 
 
@@ -2791,8 +3105,6 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     if started_date != today:
 
-        stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
-
         return {
 
             "ok": False,
@@ -2805,7 +3117,7 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
             "today": today,
 
-            "streak": (stats.data or {}).get("streak", 0)
+            "streak": cached_streak
 
         }
 
@@ -2813,45 +3125,49 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     # Check if user already completed another day TODAY
 
+    # (count only, filtered server-side on the UTC day - same as completed_at[:10] == today)
+
+    tomorrow = (date.fromisoformat(today) + timedelta(days=1)).isoformat()
+
     other_completed_today = (
 
         sb.table("focus_days")
 
-        .select("*")
+        .select("id", count="exact")
 
         .eq("plan_id", req.plan_id)
 
         .neq("id", day.data["id"])
 
-        .execute()
+        .gte("completed_at", today + "T00:00:00Z")
 
-    )
+        .lt("completed_at", tomorrow + "T00:00:00Z")
 
-    for other in (other_completed_today.data or []):
+        .limit(1)
 
-        other_completed = other.get("completed_at")
+        .execute()
 
-        if other_completed and other_completed[:10] == today:
+    )
 
-            stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
+    if other_completed_today.count:
 
-            return {
+        return {
 
-                "ok": False,
+            "ok": False,
 
-                "not_allowed": True,
+            "not_allowed": True,
 
-                "reason": "Already completed another day today",
+            "reason": "Already completed another day today",
 
-                "streak": (stats.data or {}).get("streak", 0)
+            "streak": cached_streak
 
-            }
+        }
 
 
 
     # All checks passed - complete the day
 
-    now_iso = datetime.utcnow().isoformat() + "Z"
+    now_iso = _iso_utc_now()
 
     # ── Generate day summary from item progress ──
     day_id = day.data["id"]
@@ -2870,11 +3186,9 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     # Update streak
 
-    stats = sb.table("user_focus_stats").select("*").eq("user_id", uid).maybe_single().execute()
-
+    # (from the row read in Step 1 - no re-select before the write)
 
-
-    if not stats.data:
+    if not stats_row:
 
         sb.table("user_focus_stats").insert({"user_id": uid, "streak": 1, "last_streak_date": today}).execute()
 
@@ -2882,9 +3196,9 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
     else:
 
-        last = stats.data.get("last_streak_date")
+        last = stats_row.get("last_streak_date")
 
-        streak = int(stats.data.get("streak") or 0)
+        streak = int(stats_row.get("streak") or 0)
 
 
 
@@ -2910,6 +3224,10 @@ async def complete_day(req: CompleteDayReq, request: Request):
 
 
 
+    _cache_focus_stats(uid, {"streak": streak, "last_streak_date": today})
+
+
+
     return {"ok": True, "day_completed": True, "streak": streak, "summary": summary}
 
 
@@ -2936,7 +3254,7 @@ async def reset_focus(req: ResetFocusReq, request: Request):
 
 
     new_status = "archived" if req.reset_mode == "archive" else "deleted"
-    sb.table("focus_plans").update({"status": new_status, "updated_at": datetime.utcnow().isoformat() + "Z"}).eq("id", req.plan_id).execute()
+    sb.table("focus_plans").update({"status": new_status, "updated_at": _iso_utc_now()}).eq("id", req.plan_id).execute()
 
 
 
@@ -2955,6 +3273,46 @@ class SubmitUploadReviewReq(BaseModel):
     file_base64: str
 
 
+def _stream_review_text(system: str, messages: List[Dict[str, Any]], max_tokens: int = 500) -> str:
+    """
+    Stream the review reply and stop reading at the brace that closes the first
+    JSON object: trailing prose is never generated/buffered, and the reply is
+    handed to _extract_json_object as soon as it is complete.
+    """
+    parts: List[str] = []
+    depth = 0
+    in_string = False
+    escaped = False
+    with claude.messages.stream(
+        model=CLAUDE_MODEL,
+        system=system,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.2,
+    ) as stream:
+        for chunk in stream.text_stream:
+            for i, ch in enumerate(chunk):
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = depth > 0
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}" and depth > 0:
+                    depth -= 1
+                    if depth == 0:
+                        # leaving the with-block closes the stream (generation stops)
+                        parts.append(chunk[: i + 1])
+                        return "".join(parts)
+            parts.append(chunk)
+    return "".join(parts)
+
+
 @router.post("/submit-upload-review")
 async def submit_upload_review(req: SubmitUploadReviewReq, request: Request):
     """
@@ -2975,15 +3333,25 @@ async def submit_upload_review(req: SubmitUploadReviewReq, request: Request):
         raise HTTPException(status_code=400, detail="Missing file_base64")
 
     file_b64 = _strip_data_url(req.file_base64)
-    try:
-        file_bytes = base64.b64decode(file_b64, validate=True)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid base64 payload")
-
-    if len(file_bytes) > UPLOAD_REVIEW_MAX_BYTES:
+    # reject oversized payloads before allocating the decoded buffer
+    if len(file_b64) > UPLOAD_REVIEW_MAX_B64_CHARS:
+        raise HTTPException(status_code=413, detail="File too large")
+    if _b64_decoded_len(file_b64) > UPLOAD_REVIEW_MAX_BYTES:
         raise HTTPException(status_code=413, detail="File too large")
 
     file_type = (req.file_type or "").strip().lower()
+    is_image = file_type.startswith("image/")
+    # images go to Claude as base64 as-is: check the alphabet, only text is decoded
+    if is_image:
+        if len(file_b64) % 4 or not _B64_RE.fullmatch(file_b64):
+            raise HTTPException(status_code=400, detail="Invalid base64 payload")
+        file_bytes = b""
+    else:
+        try:
+            file_bytes = _b64.b64decode(file_b64, validate=True)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid base64 payload")
+
     file_name = (req.file_name or "upload").strip()
     domain = (req.domain or "other").strip().lower()
 
@@ -3006,7 +3374,7 @@ async def submit_upload_review(req: SubmitUploadReviewReq, request: Request):
     )
 
     try:
-        if file_type.startswith("image/"):
+        if is_image:
             messages = [
                 {
                     "role": "user",
@@ -3040,18 +3408,8 @@ async def submit_upload_review(req: SubmitUploadReviewReq, request: Request):
                 }
             ]
 
-        resp = claude.messages.create(
-            model=CLAUDE_MODEL,
-            system=system,
-            messages=messages,
-            max_tokens=500,
-            temperature=0.2,
-        )
-        raw_text = ""
-        try:
-            raw_text = resp.content[0].text
-        except Exception:
-            raw_text = str(resp)
+        # sync client: stream in a worker thread so the event loop is not blocked
+        raw_text = await asyncio.to_thread(_stream_review_text, system, messages)
 
         data = _extract_json_object(raw_text)
         return _coerce_review_response(data)
@@ -3113,19 +3471,12 @@ async def submit_answer(req: SubmitAnswerReq, request: Request):
     )
 
     try:
-        resp = claude.messages.create(
-            model=CLAUDE_MODEL,
-            system=system,
-            messages=[{"role": "user", "content": user_prompt}],
-            max_tokens=350,
-            temperature=0.2,
+        raw_text = await asyncio.to_thread(
+            _stream_review_text,
+            system,
+            [{"role": "user", "content": user_prompt}],
+            350,
         )
-        raw_text = ""
-        try:
-            raw_text = resp.content[0].text
-        except Exception:
-            raw_text = str(resp)
-
         data = _extract_json_object(raw_text)
         return _coerce_review_response(data)
     except HTTPException:
@@ -3168,9 +3519,11 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
 
 
 
-    HARDENED: Uses 3 simple selects instead of inner joins to avoid
+    Item, day and plan come back in one embedded select (many-to-one embeds, list
+
+    result instead of maybe_single(): no postgrest-py 204 edge case). item_key lookups
 
-    postgrest-py 204 edge case crashes.
+    are scoped to the caller's active plan in the query itself.
 
     """
 
@@ -3190,31 +3543,51 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
 
     item_ref = req.item_id
 
-    item_res = None
-
 
 
     if _is_valid_uuid(item_ref):
 
-        # Direct UUID lookup
+        # Direct UUID lookup (unique): left embeds, so missing day/plan keep their own 404/409 below
 
         print(f"[generate-item-content] Looking up by UUID: {item_ref}")
 
-        item_res = _safe_execute(
+        item_res = await asyncio.to_thread(
+
+            sb.table("focus_items")
+
+            .select("*, focus_days(*, focus_plans(*))")
 
-            sb.table("focus_items").select("*").eq("id", item_ref).maybe_single()
+            .eq("id", item_ref)
+
+            .limit(1)
+
+            .execute
 
         )
 
     else:
 
-        # item_key format (e.g. "d1-lesson-1") - lookup by item_key column
+        # item_key format (e.g. "d1-lesson-1"): the same default keys exist in every plan of every user,
+
+        # so the lookup is restricted to this user's active plan inside the query (inner embeds)
 
         print(f"[generate-item-content] Looking up by item_key: {item_ref}")
 
-        item_res = _safe_execute(
+        item_res = await asyncio.to_thread(
+
+            sb.table("focus_items")
+
+            .select("*, focus_days!inner(*, focus_plans!inner(*))")
+
+            .eq("item_key", item_ref)
+
+            .eq("focus_days.focus_plans.user_id", uid)
 
-            sb.table("focus_items").select("*").eq("item_key", item_ref).maybe_single()
+            .eq("focus_days.focus_plans.status", "active")
+
+            .limit(2)
+
+            .execute
 
         )
 
@@ -3226,37 +3599,39 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
 
         raise HTTPException(status_code=404, detail=f"Item not found: {item_ref}")
 
-    item = item_res.data
+    if len(item_res.data) > 1:
 
-    print(f"[generate-item-content] Found item: type={item.get('type')}, kind={item.get('kind')}, topic={item.get('topic')}")
+        # same as maybe_single() before: an ambiguous item_key is not a match
 
+        print(f"[generate-item-content] ERROR: item_key matches several items in the active plan: {item_ref}")
 
+        raise HTTPException(status_code=404, detail=f"Item not found: {item_ref}")
 
-    # Step 2: Get day by item's day_id
+    item = item_res.data[0]
 
-    day_id = item.get("day_id")
+    # embedded day (with its plan); popped so item keeps its table shape
 
-    if not day_id:
+    day = item.pop("focus_days", None)
 
-        raise HTTPException(status_code=409, detail="Item has no day_id (inconsistent state)")
+    print(f"[generate-item-content] Found item: type={item.get('type')}, kind={item.get('kind')}, topic={item.get('topic')}")
 
 
 
-    day_res = _safe_execute(
+    # Step 2: Day of the item
 
-        sb.table("focus_days").select("*").eq("id", day_id).maybe_single()
+    day_id = item.get("day_id")
 
-    )
+    if not day_id:
 
-    if not day_res or not day_res.data:
+        raise HTTPException(status_code=409, detail="Item has no day_id (inconsistent state)")
 
-        raise HTTPException(status_code=404, detail="Day not found for this item")
+    if not day:
 
-    day = day_res.data
+        raise HTTPException(status_code=404, detail="Day not found for this item")
 
 
 
-    # Step 3: Get plan by day's plan_id
+    # Step 3: Plan of the day
 
     plan_id = day.get("plan_id")
 
@@ -3264,20 +3639,12 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
 
         raise HTTPException(status_code=409, detail="Day has no plan_id (inconsistent state)")
 
+    plan = day.pop("focus_plans", None)
 
-
-    plan_res = _safe_execute(
-
-        sb.table("focus_plans").select("*").eq("id", plan_id).maybe_single()
-
-    )
-
-    if not plan_res or not plan_res.data:
+    if not plan:
 
         raise HTTPException(status_code=404, detail="Plan not found for this day")
 
-    plan = plan_res.data
-
 
 
     # Verify ownership
@@ -3495,7 +3862,7 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
     # FEEDBACK SPECIAL HANDLING: Find production item's user submission
     if stored_kind == "feedback":
         try:
-            day_items_res = _safe_execute(
+            day_items_res = await _safe_execute_async(
                 sb.table("focus_items")
                 .select("id, kind, type, order_index, content, item_key, result_json")
                 .eq("day_id", day_id)
@@ -3568,7 +3935,7 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
                 if isinstance(content.get("content"), dict):
                     content["content"]["user_text"] = user_production_text
                 # Save to DB
-                _safe_execute(
+                await _safe_execute_async(
                     sb.table("focus_items")
                     .update({"content": content})
                     .eq("id", item["id"])
@@ -3591,7 +3958,7 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
     practice_kinds = ("quiz", "translation", "roleplay", "writing", "cards")
     if is_language_domain and (stored_kind in practice_kinds or item_type in practice_kinds):
         try:
-            day_items_res = _safe_execute(
+            day_items_res = await _safe_execute_async(
                 sb.table("focus_items")
                 .select("id, kind, type, order_index, content, item_key, topic, label, estimated_minutes")
                 .eq("day_id", day_id)
@@ -3627,7 +3994,7 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
                             )
                             if lesson_result and isinstance(lesson_result, dict):
                                 # Save to DB so the lesson loads instantly when user opens it
-                                _safe_execute(
+                                await _safe_execute_async(
                                     sb.table("focus_items")
                                     .update({"content": lesson_result})
                                     .eq("id", di["id"])
@@ -3698,7 +4065,7 @@ async def generate_item_content(req: GenerateItemContentReq, request: Request):
 
         # Save generated content to DB for caching (next load = instant)
         try:
-            _safe_execute(
+            await _safe_execute_async(
                 sb.table("focus_items").update({"content": content}).eq("id", item["id"])
             )
             print(f"[generate-item-content] Saved content to DB for item {item.get('id')}")
@@ -3899,7 +4266,7 @@ async def backfill_lessons(req: BackfillLessonsReq, request: Request):
 
         # Verify plan belongs to user
 
-        plan_res = _safe_execute(
+        plan_res = await _safe_execute_async(
 
             sb.table("focus_plans").select("id").eq("id", req.plan_id).eq("user_id", uid).maybe_single()
 
@@ -4153,7 +4520,7 @@ async def backfill_domain_cleanup(req: BackfillDomainCleanupReq, request: Reques
 
         # Single plan mode
 
-        plan_res = _safe_execute(
+        plan_res = await _safe_execute_async(
 
             sb.table("focus_plans")
 
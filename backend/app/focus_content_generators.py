@@ -38,6 +38,8 @@ LEARNING_TASK_TYPES = {
 
 # Project mode: action/output-oriented tasks
 PROJECT_TASK_TYPES = {"step_checklist", "checklist", "upload_review", "rubric_eval", "before_after", "quiz"}
+# already-normalized mode (the usual case) -> one dict hit, no strip/lower copies
+_MODE_CANON = {m: m for m in ALLOWED_MODES}
 
 # Language-only types (blocked for non-language domains)
 LANGUAGE_ONLY_TYPES = {"translation", "roleplay", "dialogue"}
@@ -83,6 +85,9 @@ PLACEHOLDER_OPTIONS = {"a", "b", "c", "d", "1", "2", "3", "4"}
 
 
 def _require_mode(mode: Optional[str]) -> str:
+    m = _MODE_CANON.get(mode) if mode else None
+    if m is not None:
+        return m
     m = (mode or "").strip().lower()
     if not m:
         raise ValueError("Missing mode")
@@ -0,0 +1,31 @@
+# app/http_client.py
+# Shared async HTTP client for Supabase REST/Auth calls (keep-alive connection pooling)
+
+from __future__ import annotations
+
+from typing import Optional
+
+import httpx
+
+# Lazy-initialized process-wide client (created on first use, closed on shutdown)
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Get or create the shared AsyncClient. Reuses TCP+TLS connections across requests."""
+    global _async_client
+
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=20,
+        )
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client
+
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
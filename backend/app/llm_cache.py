@@ -0,0 +1,67 @@
+# app/llm_cache.py
+# In-process LLM response cache (exact match on the normalized prompt)
+
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+_SPACE_RE = re.compile(r"\s+")
+# trailing sentence punctuation only: operators, digits and words inside the prompt all count
+_TRAILING_PUNCT = " \t\n?!.…"
+
+
+def normalize_prompt(text: str) -> str:
+    """Casefold, collapse whitespace, drop trailing ?!. : 'Mi a X?' == 'mi a  x'."""
+    s = unicodedata.normalize("NFKC", text or "").casefold()
+    return _SPACE_RE.sub(" ", s).strip(_TRAILING_PUNCT)
+
+
+class LLMCache:
+    """
+    Exact-match cache for LLM replies: sha1(namespace|normalized prompt) -> reply.
+
+    No near-duplicate matching: prompts that differ by one number or one word
+    ("... 5678?" vs "... 5679?", "Spanish" vs "Danish") need different answers.
+
+    Namespace must contain everything that changes the answer (route, lang, tier,
+    mode, and the user identity when the prompt carries personal memory).
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl_seconds: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+    @staticmethod
+    def _key(namespace: str, normalized: str) -> bytes:
+        return hashlib.sha1(f"{namespace}|{normalized}".encode()).digest()
+
+    def get(self, namespace: str, prompt: str) -> Optional[str]:
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return None
+        key = self._key(namespace, normalized)
+        hit = self._entries.get(key)
+        if not hit:
+            return None
+        value, expires_at = hit
+        if expires_at <= time.time():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, namespace: str, prompt: str, value: str) -> None:
+        normalized = normalize_prompt(prompt)
+        if not normalized or not value:
+            return
+        key = self._key(namespace, normalized)
+        self._entries[key] = (value, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
@@ -1,5 +1,6 @@
 # app/main.py
 from __future__ import annotations
+import logging
 import os
 
 from fastapi import FastAPI
@@ -8,6 +9,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from .schemas import HealthOutput
 from .db import db_ok
 
+# Module loggers (logging.getLogger("billing") etc.) write through the root handler
+logging.basicConfig(level=logging.INFO, format="[%(name)s] %(levelname)s: %(message)s")
+
 BUILD = os.getenv("BUILD_TAG", "SUPABASE-AUTH-V2-FIX-PRACTICE-KIND")
 
 app = FastAPI(title="pumi-backend", version=BUILD)
@@ -50,6 +54,19 @@ def startup():
     except Exception as e:
         print(f"[startup] Billing init skipped (not fatal): {e}")
 
+@app.on_event("startup")
+async def start_log_writer():
+    # chat/shadow logs are queued and written in batches
+    from .db import start_log_flusher
+    start_log_flusher()
+
+@app.on_event("shutdown")
+async def shutdown():
+    from .db import stop_log_flusher
+    from .http_client import close_async_client
+    await stop_log_flusher()
+    await close_async_client()
+
 # Routers (REGISTER AT IMPORT TIME — not in startup)
 from .chat_enhanced import router as chat_enhanced_router
 from .guard import router as guard_router
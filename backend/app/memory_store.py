@@ -40,7 +40,15 @@ def _normalize_identity_key(
     return "anon"
 
 
+# DDL runs once per process: the DROP INDEX below takes a table lock, so not per call
+_schema_ready = False
+
+
 def ensure_schema() -> None:
+    global _schema_ready
+
+    if _schema_ready:
+        return
     run_sql(
         """
         CREATE TABLE IF NOT EXISTS memory_facts (
@@ -52,8 +60,16 @@ def ensure_schema() -> None:
         );
         """
     )
-    run_sql("CREATE INDEX IF NOT EXISTS idx_memory_facts_identity_key ON memory_facts(identity_key);")
-    run_sql("CREATE INDEX IF NOT EXISTS idx_memory_facts_created_at ON memory_facts(created_at DESC);")
+    # one composite index serves fetch_recent_facts (filter + ORDER BY + LIMIT) on its own
+    run_sql(
+        """
+        CREATE INDEX IF NOT EXISTS idx_memory_facts_identity_created
+        ON memory_facts(identity_key, created_at DESC);
+        DROP INDEX IF EXISTS idx_memory_facts_identity_key;
+        DROP INDEX IF EXISTS idx_memory_facts_created_at;
+        """
+    )
+    _schema_ready = True
 
 
 def fetch_recent_facts(*, identity_key: str, limit: int = DEFAULT_FACT_LIMIT) -> List[Dict]:
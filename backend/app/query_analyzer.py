@@ -103,10 +103,41 @@ DOC_TOPICS = [
 ]
 
 
+ASKS_DETAILED_KEYWORDS = ["részletes", "detailed", "bővebb", "comprehensive"]
+
+EXPLICIT_DETAILED_KEYWORDS = [
+    "hosszan", "hosszasan", "részletesen", "kifejted", "kifejtve",
+    "bővebben", "pontokba szedve", "lépésről lépésre",
+    "detailed", "in detail", "comprehensive", "step by step"
+]
+
+# Every substring that can add score (or force the failsafe) in one alternation.
+# Without any of them a query scores at most 0.32 (length) + 0.22 (questions) + 0.18 ("és"/"and"),
+# and the length part is 0 up to 90 chars -> max 0.40 < 0.50.
+_ANY_SIGNAL_RE = re.compile("|".join(
+    re.escape(k) for k in sorted({
+        *HARD_PHRASES, *DOC_VERBS, *FORMAT_HINTS, *ASKS_DETAILED_KEYWORDS, "teljes",
+        *BIO_KEYWORDS, *COMPARE_KEYWORDS, *EXPLAIN_KEYWORDS, *LIST_KEYWORDS, *DOC_TOPICS,
+        *EXPLICIT_DETAILED_KEYWORDS,
+    }, key=len, reverse=True)
+))
+_QUICK_MAX_LEN = 90
+
+
 def _contains_any(text_lower: str, items: List[str]) -> bool:
     return any(x in text_lower for x in items)
 
 
+def may_need_detailed(query: str) -> bool:
+    """
+    Cheap pre-filter for the chat hot path (no conversation context).
+    False means analyze_query + should_use_detailed_endpoint would also say False,
+    so short small-talk turns ("ok", "köszi") skip the full scoring.
+    """
+    q = (query or "").strip()
+    return len(q) > _QUICK_MAX_LEN or _ANY_SIGNAL_RE.search(q.lower()) is not None
+
+
 def analyze_query(query: str, conversation_context: Optional[list] = None) -> Dict:
     q = (query or "").strip()
     ql = q.lower()
@@ -130,7 +161,7 @@ def analyze_query(query: str, conversation_context: Optional[list] = None) -> Di
         reasons.append("doc_verb+format")
 
     # "részletes" / "detailed" is a strong hint
-    if any(k in ql for k in ["részletes", "detailed", "bővebb", "comprehensive"]):
+    if any(k in ql for k in ASKS_DETAILED_KEYWORDS):
         score += 0.40
         reasons.append("asks_detailed")
 
@@ -238,12 +269,7 @@ def should_use_detailed_endpoint(analysis: Dict) -> bool:
     query_lower = (analysis.get("query") or "").lower()
     
     # FAILSAFE: Always trigger for explicit detailed requests
-    explicit_keywords = [
-        "hosszan", "hosszasan", "részletesen", "kifejted", "kifejtve",
-        "bővebben", "pontokba szedve", "lépésről lépésre",
-        "detailed", "in detail", "comprehensive", "step by step"
-    ]
-    if any(k in query_lower for k in explicit_keywords):
+    if any(k in query_lower for k in EXPLICIT_DETAILED_KEYWORDS):
         return True
     
     # Standard analysis-based decision
@@ -142,4 +142,7 @@ class UsageCommitOutput(BaseModel):
     tokens_used_today: int = 0
     usage_voice_seconds_today: int = 0
     tier: Optional[str] = None
-    reset_at: Optional[str] = None
\ No newline at end of file
+    reset_at: Optional[str] = None
+    token_limit: Optional[int] = None
+    tokens_remaining: Optional[int] = None
+    within_budget: Optional[bool] = None
\ No newline at end of file
@@ -0,0 +1,59 @@
+# app/token_cache.py
+# Shared Supabase access token -> user id cache (skips the /auth/v1/user round trip)
+
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import jwt  # type: ignore  # PyJWT
+except Exception:
+    jwt = None
+
+TOKEN_CACHE_TTL = 300
+TOKEN_CACHE_MAX = 10_000
+
+# sha256(token) -> (uid, expires_at); expires_at never later than the token's own exp
+_token_uid_cache: Dict[bytes, Tuple[str, float]] = {}
+
+
+def _cache_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def _token_exp(token: str) -> Optional[float]:
+    if not jwt:
+        return None
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+def get_cached_uid(token: str) -> Optional[str]:
+    cached = _token_uid_cache.get(_cache_key(token))
+    if cached and cached[1] > time.time():
+        return cached[0]
+    return None
+
+
+def cache_token_uid(token: str, uid: str) -> None:
+    """Remember a verified token for TOKEN_CACHE_TTL seconds, capped at its JWT exp."""
+    now = time.time()
+    expires_at = now + TOKEN_CACHE_TTL
+    exp = _token_exp(token)
+    if exp is not None:
+        expires_at = min(expires_at, exp)
+    if expires_at <= now:
+        return
+
+    if len(_token_uid_cache) >= TOKEN_CACHE_MAX:
+        for k in [k for k, (_, t) in _token_uid_cache.items() if t <= now]:
+            _token_uid_cache.pop(k, None)
+        if len(_token_uid_cache) >= TOKEN_CACHE_MAX:
+            _token_uid_cache.clear()
+
+    _token_uid_cache[_cache_key(token)] = (uid, expires_at)
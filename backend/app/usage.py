@@ -4,7 +4,7 @@ from __future__ import annotations
 from fastapi import APIRouter, HTTPException
 
 from .schemas import UsageGetInput, UsageGetOutput, UsageCommitInput, UsageCommitOutput
-from .db import usage_get, usage_commit_tokens, get_token_limit
+from .db import usage_get, commit_and_check, get_token_limit
 
 router = APIRouter(prefix="/usage", tags=["usage"])
 
@@ -52,11 +52,13 @@ def usage_commit_route(payload: UsageCommitInput):
     if not payload.session_id:
         raise HTTPException(status_code=400, detail="session_id required")
 
-    day, tokens_used, voice_seconds = usage_commit_tokens(
+    # commit + budget check in one DB round-trip
+    day, tokens_used, voice_seconds, token_limit, within_budget = commit_and_check(
         memberstack_id=payload.memberstack_id,
         session_id=payload.session_id,
         usage_day=payload.usage_day,
         add_tokens=payload.add_tokens,
+        tier=payload.tier,
         add_voice_seconds=payload.add_voice_seconds,
     )
     
@@ -77,4 +79,7 @@ def usage_commit_route(payload: UsageCommitInput):
         usage_voice_seconds_today=voice_seconds,
         tier=payload.tier,
         reset_at=reset_at,
+        token_limit=token_limit,
+        tokens_remaining=max(0, token_limit - tokens_used),
+        within_budget=within_budget,
     )
\ No newline at end of file
@@ -57,6 +57,8 @@ CREATE TABLE IF NOT EXISTS focus_plans (
 CREATE INDEX IF NOT EXISTS idx_focus_plans_user_id ON focus_plans(user_id);
 CREATE INDEX IF NOT EXISTS idx_focus_plans_status ON focus_plans(status);
 CREATE INDEX IF NOT EXISTS idx_focus_plans_user_status ON focus_plans(user_id, status);
+-- create-plan idempotency lookup (user_id, status='active', title)
+CREATE INDEX IF NOT EXISTS idx_focus_plans_user_status_title ON focus_plans(user_id, status, title);
 
 -- Focus Days (daily sessions within a plan)
 CREATE TABLE IF NOT EXISTS focus_days (
@@ -76,6 +78,8 @@ CREATE TABLE IF NOT EXISTS focus_days (
 CREATE INDEX IF NOT EXISTS idx_focus_days_plan_id ON focus_days(plan_id);
 CREATE INDEX IF NOT EXISTS idx_focus_days_completed ON focus_days(completed);
 CREATE INDEX IF NOT EXISTS idx_focus_days_plan_number ON focus_days(plan_id, day_number);
+-- complete-day "another day completed today" count: index range scan on completed days only
+CREATE INDEX IF NOT EXISTS idx_focus_days_plan_completed_at ON focus_days(plan_id, completed_at) WHERE completed_at IS NOT NULL;
 
 -- Focus Items (individual lessons, quizzes, practices within a day)
 CREATE TABLE IF NOT EXISTS focus_items (
@@ -257,6 +261,127 @@ CREATE POLICY usage_daily_select ON usage_daily
 -- HELPER FUNCTIONS
 -- =====================================================
 
+-- create-plan idempotency check: active plan with this title + its day count in one call
+CREATE OR REPLACE FUNCTION check_existing_plan(p_uid UUID, p_title TEXT)
+RETURNS TABLE(id UUID, days_count INT) AS $$
+  SELECT p.id, COUNT(d.id)::INT
+  FROM focus_plans p
+  LEFT JOIN focus_days d ON d.plan_id = p.id
+  WHERE p.user_id = p_uid AND p.status = 'active' AND p.title = p_title
+  GROUP BY p.id
+  ORDER BY p.created_at DESC
+  LIMIT 1;
+$$ LANGUAGE sql STABLE;
+
+-- get-day in one call: ownership check, requested day, its status (same ladder as
+-- the /focus/get-day fallback) and, only for in_progress/completed days, the items
+-- with this user's progress plus the done/total counts. NULL when the plan is not the user's.
+CREATE OR REPLACE FUNCTION get_day_with_status(p_plan UUID, p_day INT, p_user UUID, p_today DATE)
+RETURNS JSON AS $$
+  WITH plan AS (
+    SELECT id FROM focus_plans WHERE id = p_plan AND user_id = p_user
+  ),
+  days AS (
+    SELECT d.* FROM focus_days d JOIN plan ON d.plan_id = plan.id
+  ),
+  target AS (
+    SELECT * FROM days WHERE day_index = p_day LIMIT 1
+  ),
+  flags AS (
+    SELECT
+      COALESCE(bool_or((completed_at AT TIME ZONE 'UTC')::date = p_today), false) AS completed_today,
+      COALESCE(bool_or(started_at IS NOT NULL AND completed_at IS NULL AND day_index <> p_day), false) AS other_in_progress,
+      COALESCE(bool_and(completed_at IS NOT NULL) FILTER (WHERE day_index < p_day), true) AS prev_completed
+    FROM days
+  ),
+  status AS (
+    SELECT CASE
+      WHEN t.completed_at IS NOT NULL THEN 'completed'
+      WHEN t.started_at IS NOT NULL THEN 'in_progress'
+      WHEN f.completed_today THEN 'locked_until_tomorrow'
+      WHEN f.other_in_progress THEN 'locked'
+      WHEN f.prev_completed THEN 'available'
+      ELSE 'locked'
+    END AS day_status
+    FROM target t, flags f
+  ),
+  items AS (
+    SELECT
+      i.order_index,
+      to_jsonb(i) || jsonb_build_object(
+        'progress', CASE WHEN pr.item_id IS NULL THEN NULL ELSE to_jsonb(pr) END
+      ) AS item,
+      COALESCE(pr.status = 'done', false) AS done
+    FROM focus_items i
+    JOIN target t ON i.day_id = t.id
+    JOIN status s ON s.day_status IN ('in_progress', 'completed')
+    LEFT JOIN focus_item_progress pr ON pr.item_id = i.id AND pr.user_id = p_user
+  )
+  SELECT CASE WHEN NOT EXISTS (SELECT 1 FROM plan) THEN NULL ELSE json_build_object(
+    'day', (SELECT to_json(t) FROM target t),
+    'status', (SELECT day_status FROM status),
+    'items', COALESCE((SELECT json_agg(item ORDER BY order_index) FROM items), '[]'::json),
+    'progress_summary', (
+      SELECT json_build_object('completed_items', COUNT(*) FILTER (WHERE done), 'total_items', COUNT(*))
+      FROM items
+    )
+  ) END;
+$$ LANGUAGE sql STABLE;
+
+-- start-day in one call: decide (in-progress day / day completed today / next pending)
+-- and start the next pending day in the same statement. NULL when the plan is not the user's.
+CREATE OR REPLACE FUNCTION start_next_day(p_plan UUID, p_user UUID, p_today DATE)
+RETURNS JSON AS $$
+  WITH plan AS (
+    SELECT id FROM focus_plans WHERE id = p_plan AND user_id = p_user
+  ),
+  days AS (
+    SELECT d.* FROM focus_days d JOIN plan ON d.plan_id = plan.id
+  ),
+  in_prog AS (
+    SELECT * FROM days WHERE started_at IS NOT NULL AND completed_at IS NULL
+    ORDER BY day_index DESC LIMIT 1
+  ),
+  comp_today AS (
+    SELECT * FROM days WHERE (completed_at AT TIME ZONE 'UTC')::date = p_today
+    ORDER BY day_index DESC LIMIT 1
+  ),
+  next_p AS (
+    SELECT * FROM days WHERE started_at IS NULL AND completed_at IS NULL
+    ORDER BY day_index LIMIT 1
+  ),
+  upd AS (
+    UPDATE focus_days SET started_at = now()
+    WHERE id = (
+      SELECT id FROM next_p
+      WHERE NOT EXISTS (SELECT 1 FROM in_prog) AND NOT EXISTS (SELECT 1 FROM comp_today)
+    )
+    AND started_at IS NULL
+    RETURNING *
+  )
+  SELECT CASE WHEN NOT EXISTS (SELECT 1 FROM plan) THEN NULL ELSE json_build_object(
+    'has_days', EXISTS (SELECT 1 FROM days),
+    'in_progress', (SELECT row_to_json(in_prog) FROM in_prog),
+    'completed_today', (SELECT row_to_json(comp_today) FROM comp_today),
+    'started', (SELECT row_to_json(upd) FROM upd),
+    'next_pending', (SELECT row_to_json(next_p) FROM next_p)
+  ) END;
+$$ LANGUAGE sql;
+
+-- complete-item progress write in one statement (relies on UNIQUE(user_id, item_id))
+CREATE OR REPLACE FUNCTION upsert_focus_progress(p_user UUID, p_item UUID, p_status TEXT, p_score NUMERIC, p_result JSONB)
+RETURNS SETOF focus_item_progress AS $$
+  INSERT INTO focus_item_progress (user_id, item_id, status, score, last_result_json, attempts, updated_at)
+  VALUES (p_user, p_item, p_status, p_score, p_result, 1, now())
+  ON CONFLICT (user_id, item_id) DO UPDATE SET
+    status = EXCLUDED.status,
+    score = EXCLUDED.score,
+    last_result_json = EXCLUDED.last_result_json,
+    attempts = COALESCE(focus_item_progress.attempts, 0) + 1,
+    updated_at = now()
+  RETURNING *;
+$$ LANGUAGE sql;
+
 -- Function to update streak on day completion
 CREATE OR REPLACE FUNCTION update_user_streak()
 RETURNS TRIGGER AS $$
@@ -302,6 +427,52 @@ AFTER UPDATE OF completed ON focus_days
 FOR EACH ROW
 EXECUTE FUNCTION update_user_streak();
 
+-- Function to delete all app rows of a user in one round-trip (used by /account/delete)
+-- Children are deleted first so the returned per-table counts are accurate.
+CREATE OR REPLACE FUNCTION delete_user_cascade(uid UUID)
+RETURNS JSON AS $$
+DECLARE
+  n_stats INTEGER;
+  n_progress INTEGER;
+  n_items INTEGER;
+  n_days INTEGER;
+  n_plans INTEGER;
+  n_profiles INTEGER;
+BEGIN
+  DELETE FROM user_focus_stats WHERE user_id = uid;
+  GET DIAGNOSTICS n_stats = ROW_COUNT;
+
+  DELETE FROM focus_item_progress WHERE user_id = uid;
+  GET DIAGNOSTICS n_progress = ROW_COUNT;
+
+  DELETE FROM focus_items WHERE day_id IN (
+    SELECT d.id FROM focus_days d JOIN focus_plans p ON p.id = d.plan_id WHERE p.user_id = uid
+  );
+  GET DIAGNOSTICS n_items = ROW_COUNT;
+
+  DELETE FROM focus_days WHERE plan_id IN (SELECT id FROM focus_plans WHERE user_id = uid);
+  GET DIAGNOSTICS n_days = ROW_COUNT;
+
+  DELETE FROM focus_plans WHERE user_id = uid;
+  GET DIAGNOSTICS n_plans = ROW_COUNT;
+
+  DELETE FROM user_profiles WHERE id = uid;
+  GET DIAGNOSTICS n_profiles = ROW_COUNT;
+
+  RETURN json_build_object(
+    'user_focus_stats', n_stats,
+    'focus_item_progress', n_progress,
+    'focus_items', n_items,
+    'focus_days', n_days,
+    'focus_plans', n_plans,
+    'user_profiles', n_profiles
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Service role only: never callable by end users
+REVOKE EXECUTE ON FUNCTION delete_user_cascade(UUID) FROM PUBLIC, anon, authenticated;
+
 -- =====================================================
 -- INDEXES FOR PERFORMANCE
 -- =====================================================